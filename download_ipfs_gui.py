@@ -1,11 +1,18 @@
 import os
 import csv
-import requests
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox, scrolledtext
 from pathlib import Path
 import threading
 import queue
+import ipfs_http
+import ipfs_gateways
+import ipfs_cache
+import ipfs_manifest
+import ipfs_plan
+import ipfs_retry
+import ipfs_arc19
+import ipfs_sniff
 from PIL import Image, ImageTk
 
 # Colors and styling constants
@@ -78,6 +85,12 @@ class CyberSkullsDownloaderApp:
         # Default IPFS gateway
         self.ipfs_gateway = "https://ipfs.io/ipfs/"
         
+        # Bytes held in memory per download while streaming to disk
+        self.chunk_size = ipfs_http.DEFAULT_CHUNK_SIZE
+        
+        # Race a backup gateway when the first one is slow
+        self.hedge = False
+        
         # Create a queue for log messages
         self.log_queue = queue.Queue()
         
@@ -205,7 +218,7 @@ class CyberSkullsDownloaderApp:
         gateway_frame = ttk.Frame(file_ops_frame)
         gateway_frame.pack(fill=tk.X, pady=5)
         
-        gateway_label = ttk.Label(gateway_frame, text="> IPFS_GATEWAY:", 
+        gateway_label = ttk.Label(gateway_frame, text="> IPFS_GATEWAYS:", 
                                  font=(FONT_FAMILY, 10, "bold"))
         gateway_label.pack(side=tk.LEFT, padx=(0, 10))
         
@@ -215,6 +228,21 @@ class CyberSkullsDownloaderApp:
                                 font=(FONT_FAMILY, 10))
         gateway_entry.pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         
+        # Gateway routing options
+        routing_frame = ttk.Frame(file_ops_frame)
+        routing_frame.pack(fill=tk.X, pady=5)
+        
+        routing_label = ttk.Label(routing_frame, text="> Separate several gateways with commas; the healthiest one is used first",
+                                 font=(FONT_FAMILY, 8))
+        routing_label.pack(side=tk.LEFT, padx=(0, 10))
+        
+        self.hedge_var = tk.BooleanVar(value=self.hedge)
+        hedge_check = tk.Checkbutton(routing_frame, text="HEDGE_SLOW_REQUESTS", variable=self.hedge_var,
+                                     bg=BACKGROUND_COLOR, fg=TEXT_COLOR, selectcolor="#111111",
+                                     activebackground=BACKGROUND_COLOR, activeforeground=TEXT_COLOR,
+                                     font=(FONT_FAMILY, 10))
+        hedge_check.pack(side=tk.RIGHT, padx=5)
+        
         # Action buttons in new frame
         action_frame = ttk.Frame(main_frame)
         action_frame.pack(fill=tk.X, pady=15)
@@ -289,48 +317,62 @@ class CyberSkullsDownloaderApp:
             self.log(f"[SYSTEM] Output folder set to: {self.output_dir}")
     
     def download_image(self, url, output_path, gateway_url):
-        """Download an image from IPFS URL and save it to the specified path"""
+        """Download an image from IPFS URL and save it to the specified path
+        
+        Returns the ipfs_sniff.FileType detected from the content, or False on failure.
+        """
         try:
             # Parse IPFS URL to extract CID
-            if url.startswith("ipfs://"):
-                # Extract the CID and handle any fragment identifier
-                path = url[7:]  # Remove 'ipfs://' prefix
-                
-                # Handle fragment identifiers (like #i at the end)
-                if '#' in path:
-                    path = path.split("#")[0]
-                
-                # Create full gateway URL
-                full_url = f"{gateway_url}{path}"
-            else:
+            path = ipfs_gateways.ipfs_path_from_url(url)
+            if path is None:
                 self.log(f"[WARNING] Skipping non-IPFS URL: {url}")
                 return False
             
+            # Serve from the local CID cache when this content was fetched before
+            cache = ipfs_cache.get_default_cache()
+            if cache and cache.copy_to(path, output_path):
+                self.log(f"[CACHE] Reused cached copy: {os.path.basename(output_path)}")
+                return ipfs_sniff.sniff_file(output_path)
+            
             # Download the image
             self.log(f"[DOWNLOAD] Retrieving: {os.path.basename(output_path)}")
-            response = requests.get(full_url, timeout=30)
-            if response.status_code == 200:
-                with open(output_path, 'wb') as f:
-                    f.write(response.content)
-                self.log(f"[SUCCESS] Downloaded: {os.path.basename(output_path)}")
-                return True
-            else:
-                self.log(f"[ERROR] Failed to download {url}: HTTP {response.status_code}")
-                return False
+            # Transient failures (429, 5xx, timeouts) are retried with backoff
+            with ipfs_retry.call(lambda: ipfs_gateways.fetch(path, gateway_url, timeout=30, hedge=self.hedge),
+                                 log_callback=self.log, description=path) as response:
+                if response.status_code == 200:
+                    # Stream to a temp file in chunks so large assets never sit in memory;
+                    # only the first bytes are kept to detect the file type
+                    sniffer = ipfs_sniff.Sniffer()
+                    ipfs_gateways.save_content(response, output_path, self.chunk_size, sniffer.feed)
+                    if cache:
+                        cache.put_file(path, output_path)
+                    self.log(f"[SUCCESS] Downloaded: {os.path.basename(output_path)}")
+                    return sniffer.detect(response.headers.get("Content-Type"))
+                else:
+                    self.log(f"[ERROR] Failed to download {url}: HTTP {response.status_code}")
+                    return False
         except Exception as e:
             self.log(f"[ERROR] Error downloading {url}: {str(e)}")
             return False
     
-    def process_csv_file(self, csv_file, output_dir, gateway_url):
-        """Process a CSV file to download images"""
+    def process_csv_file(self, csv_file, output_dir, gateway_url, manifest=None, downloaded=None, planner=None):
+        """Process a CSV file to download images, skipping rows the manifest marks as complete
+        and fetching each CID once (repeats are linked from the first download)"""
         try:
             # Create output directory if it doesn't exist
             Path(output_dir).mkdir(parents=True, exist_ok=True)
+            source = os.path.basename(csv_file)
             
             # Track success and failure counts
             success_count = 0
             fail_count = 0
+            skipped_count = 0
+            deduped_count = 0
             total_count = 0
+            if downloaded is None:
+                downloaded = ipfs_plan.DownloadedCids()
+            if planner is None:
+                planner = ipfs_plan.FilenamePlanner()
             
             # First, count total rows for progress
             with open(csv_file, 'r', encoding='utf-8') as file:
@@ -352,6 +394,7 @@ class CyberSkullsDownloaderApp:
                     missing = [col for col in required_columns if col not in reader.fieldnames]
                     self.log(f"[ERROR] CSV file {os.path.basename(csv_file)} is missing required columns: {', '.join(missing)}")
                     return 0, 0
+                reserve_column = ipfs_arc19.reserve_column(reader.fieldnames)
                 
                 # Process each row
                 current_row = 0
@@ -362,37 +405,52 @@ class CyberSkullsDownloaderApp:
                     progress = int((current_row / total_count) * 100)
                     self.update_progress(progress, f"PROCESSING: {os.path.basename(csv_file)} [{current_row}/{total_count}]")
                     
-                    name = row["name"].strip()
-                    unit_name = row["unit-name"].strip()
                     url = row["url"].strip()
+                    if reserve_column:
+                        # ARC-19: rebuild the CID from the asset's reserve address
+                        url = ipfs_arc19.resolve_url(url, row.get(reserve_column))
                     
-                    if not url or not name or not unit_name:
+                    # Plan a filename that no earlier row has claimed for different content
+                    filename = planner.plan_row(row["name"], row["unit-name"], row.get("metadata_mime_type"), url)
+                    if filename is None:
                         continue
                     
-                    # Create a filename-safe version of the name
-                    safe_name = f"{name}_{unit_name}".replace("/", "_").replace("\\", "_")
-                    safe_name = "".join(c for c in safe_name if c.isalnum() or c in "._- ")
-                    
-                    # Determine file extension based on mime type or default to .png
-                    mime_type = row.get("metadata_mime_type", "").strip()
-                    extension = ".png"  # Default extension
-                    if mime_type:
-                        if "jpeg" in mime_type or "jpg" in mime_type:
-                            extension = ".jpg"
-                        elif "png" in mime_type:
-                            extension = ".png"
-                        elif "gif" in mime_type:
-                            extension = ".gif"
+                    output_path = os.path.join(output_dir, filename)
                     
-                    output_path = os.path.join(output_dir, f"{safe_name}{extension}")
+                    # Skip rows finished by an earlier run
+                    key = ipfs_manifest.row_key(source, current_row - 1, url)
+                    if manifest and manifest.is_complete(key, output_path):
+                        skipped_count += 1
+                        success_count += 1
+                        continue
                     
-                    # Download the image
-                    success = self.download_image(url, output_path, gateway_url)
+                    # Reuse a CID already downloaded for an earlier row or CSV file
+                    reused = downloaded.reuse(url, output_path)
+                    if reused:
+                        output_path, mime_type = reused
+                        success = True
+                        deduped_count += 1
+                    else:
+                        # Download the image, then name it after the detected content type
+                        file_type = self.download_image(url, output_path, gateway_url)
+                        success = bool(file_type)
+                        if success:
+                            output_path = ipfs_sniff.retype_file(output_path, file_type)
+                            mime_type = file_type.mime_type
+                            downloaded.add(url, output_path, mime_type)
                     if success:
                         success_count += 1
+                        if manifest:
+                            manifest.mark_done(key, url, output_path, content_type=mime_type)
                     else:
                         fail_count += 1
+                        if manifest:
+                            manifest.mark_failed(key, url)
             
+            if skipped_count:
+                self.log(f"[RESUME] Skipped {skipped_count} rows already completed in {source}")
+            if deduped_count:
+                self.log(f"[DEDUPE] Linked {deduped_count} rows repeating an already downloaded CID in {source}")
             return success_count, fail_count
         except Exception as e:
             self.log(f"[ERROR] Error processing {os.path.basename(csv_file)}: {str(e)}")
@@ -401,27 +459,45 @@ class CyberSkullsDownloaderApp:
     def download_thread(self):
         """Background thread for downloading images"""
         try:
-            gateway_url = self.gateway_var.get()
-            if not gateway_url.endswith('/'):
-                gateway_url += '/'
+            gateway_url = ipfs_gateways.parse_gateway_list(self.gateway_var.get())
+            self.hedge = self.hedge_var.get() and len(gateway_url) > 1
+            self.log(f"[SYSTEM] Using {len(gateway_url)} gateway(s){' with hedging' if self.hedge else ''}")
             
             self.log("[SYSTEM] Initializing download sequence...")
             self.update_progress(0, "PREPARING_DOWNLOAD...")
             
+            # Per-row progress manifest in the output folder lets an interrupted run resume
+            manifest = ipfs_manifest.DownloadManifest.for_directory(self.output_dir)
+            
+            # CIDs fetched so far, so rows repeated within or across CSV files download once
+            downloaded = ipfs_plan.DownloadedCids()
+            
+            # One filename plan for every CSV, so files from different CSVs never overwrite each other
+            planner = ipfs_plan.FilenamePlanner()
+            
             # Process each CSV file
             total_success = 0
             total_fail = 0
             
-            for i, csv_file in enumerate(self.csv_files):
-                self.log(f"[SYSTEM] Processing file {i+1}/{len(self.csv_files)}: {os.path.basename(csv_file)}...")
-                success, fail = self.process_csv_file(csv_file, self.output_dir, gateway_url)
-                total_success += success
-                total_fail += fail
+            try:
+                for i, csv_file in enumerate(self.csv_files):
+                    self.log(f"[SYSTEM] Processing file {i+1}/{len(self.csv_files)}: {os.path.basename(csv_file)}...")
+                    success, fail = self.process_csv_file(csv_file, self.output_dir, gateway_url,
+                                                          manifest, downloaded, planner)
+                    total_success += success
+                    total_fail += fail
+            finally:
+                manifest.close()
             
             self.log("\n[REPORT] Download Summary:")
             self.log(f"[REPORT] Images successfully downloaded: {total_success}")
             self.log(f"[REPORT] Images failed to download: {total_fail}")
             self.log(f"[REPORT] Images saved to: {os.path.abspath(self.output_dir)}")
+            for line in ipfs_http.format_pool_stats():
+                self.log(f"[POOL] {line}")
+            for line in ipfs_gateways.default_router.format_stats():
+                self.log(f"[ROUTER] {line}")
+            self.log(f"[RETRY] {ipfs_retry.default_budget.format_stats()}")
             
             self.update_progress(100, "DOWNLOAD_COMPLETE")
             messagebox.showinfo("Download Complete", f"Download operation complete!\n\nSuccessful: {total_success}\nFailed: {total_fail}")
@@ -1,53 +1,109 @@
 import os
+import sys
 import csv
-import requests
 import argparse
+import tempfile
+import time
 from pathlib import Path
+import ipfs_http
+import ipfs_gateways
+import ipfs_cache
+import ipfs_manifest
+import ipfs_plan
+import ipfs_retry
+import ipfs_arc19
+import ipfs_sniff
+import ipfs_archive
+
+# Optional asyncio download engine (--async)
+try:
+    import asyncio
+    import aiohttp
+    AIOHTTP_AVAILABLE = True
+except ImportError:
+    AIOHTTP_AVAILABLE = False
 
 # Configure IPFS gateway
-IPFS_GATEWAY = "https://ipfs.io/ipfs/"
+IPFS_GATEWAY = ipfs_gateways.DEFAULT_GATEWAY
+
+# Default number of concurrent requests in --async mode
+DEFAULT_MAX_INFLIGHT = 100
 
-def download_image(url, output_path, gateway_url):
-    """Download an image from IPFS URL and save it to the specified path."""
+def download_image(url, output_path, gateway_url, chunk_size=ipfs_http.DEFAULT_CHUNK_SIZE, hedge=False):
+    """Download an image from IPFS URL and save it to the specified path.
+    
+    Returns the ipfs_sniff.FileType detected from the content, or False on failure.
+    """
     try:
         # Parse IPFS URL to extract CID
-        if url.startswith("ipfs://"):
-            # Extract the CID and handle any fragment identifier
-            path = url[7:]  # Remove 'ipfs://' prefix
-            
-            # Handle fragment identifiers (like #i at the end)
-            if '#' in path:
-                path = path.split("#")[0]
-            
-            # Create full gateway URL
-            full_url = f"{gateway_url}{path}"
-        else:
+        path = ipfs_gateways.ipfs_path_from_url(url)
+        if path is None:
             print(f"Skipping non-IPFS URL: {url}")
             return False
         
+        # Serve from the local CID cache when this content was fetched before
+        cache = ipfs_cache.get_default_cache()
+        if cache and cache.copy_to(path, output_path):
+            print(f"Reused cached copy: {output_path}")
+            return ipfs_sniff.sniff_file(output_path)
+        
         # Download the image
-        print(f"Downloading from: {full_url}")
-        response = requests.get(full_url, timeout=30)
-        if response.status_code == 200:
-            with open(output_path, 'wb') as f:
-                f.write(response.content)
-            print(f"Downloaded: {output_path}")
-            return True
-        else:
-            print(f"Failed to download {url}: HTTP {response.status_code}")
-            return False
+        print(f"Downloading: {path}")
+        # Transient failures (429, 5xx, timeouts) are retried with backoff
+        with ipfs_retry.call(lambda: ipfs_gateways.fetch(path, gateway_url, timeout=30, hedge=hedge),
+                             log_callback=print, description=path) as response:
+            if response.status_code == 200:
+                # Stream to a temp file in chunks so large assets never sit in memory;
+                # only the first bytes are kept to detect the file type
+                sniffer = ipfs_sniff.Sniffer()
+                ipfs_gateways.save_content(response, output_path, chunk_size, sniffer.feed)
+                if cache:
+                    cache.put_file(path, output_path)
+                print(f"Downloaded: {output_path}")
+                return sniffer.detect(response.headers.get("Content-Type"))
+            else:
+                print(f"Failed to download {url}: HTTP {response.status_code}")
+                return False
     except Exception as e:
         print(f"Error downloading {url}: {str(e)}")
         return False
 
-def process_csv_file(csv_file, output_dir, gateway_url):
-    """Process a CSV file to download images and save them with name_unit-name format."""
+def build_output_path(row, output_dir, planner, reserve_column=None):
+    """Return the (url, output_path) pair for a CSV row, or None if the row is incomplete.
+    
+    The planner gives colliding name/unit-name pairs distinct filenames.
+    ARC-19 template URLs are resolved from the row's reserve_column.
+    """
+    url = (row.get("url") or "").strip()
+    if reserve_column:
+        url = ipfs_arc19.resolve_url(url, row.get(reserve_column))
+    filename = planner.plan_row(row.get("name"), row.get("unit-name"), row.get("metadata_mime_type"), url)
+    if filename is None:
+        return None
+    return url, os.path.join(output_dir, filename)
+
+def process_csv_file(csv_file, output_dir, gateway_url, chunk_size=ipfs_http.DEFAULT_CHUNK_SIZE, hedge=False,
+                     manifest=None, downloaded=None, planner=None):
+    """Process a CSV file to download images and save them with name_unit-name format.
+    
+    With a manifest, rows recorded as complete whose file is still intact are
+    skipped and every new download is recorded, so an interrupted run resumes.
+    Each CID is fetched once; rows repeating a CID already in downloaded (which
+    may be shared across CSV files) get a hard link or copy instead.
+    """
     # Create output directory if it doesn't exist
     Path(output_dir).mkdir(parents=True, exist_ok=True)
+    source = os.path.basename(csv_file)
+    if downloaded is None:
+        downloaded = ipfs_plan.DownloadedCids()
+    if planner is None:
+        planner = ipfs_plan.FilenamePlanner()
     
     # Track success and failure counts
     success_count = 0
     fail_count = 0
+    skipped_count = 0
+    deduped_count = 0
     
     with open(csv_file, 'r', encoding='utf-8') as file:
         reader = csv.DictReader(file)
@@ -58,59 +114,321 @@ def process_csv_file(csv_file, output_dir, gateway_url):
             missing = [col for col in required_columns if col not in reader.fieldnames]
             print(f"Error: CSV file {csv_file} is missing required columns: {', '.join(missing)}")
             return 0, 0
+        reserve_column = ipfs_arc19.reserve_column(reader.fieldnames)
         
         # Process each row
-        for row in reader:
-            name = row["name"].strip()
-            unit_name = row["unit-name"].strip()
-            url = row["url"].strip()
-            
-            if not url or not name or not unit_name:
+        for row_number, row in enumerate(reader):
+            item = build_output_path(row, output_dir, planner, reserve_column)
+            if item is None:
                 continue
-                
-            # Create a filename-safe version of the name
-            safe_name = f"{name}_{unit_name}".replace("/", "_").replace("\\", "_")
-            safe_name = "".join(c for c in safe_name if c.isalnum() or c in "._- ")
+            url, output_path = item
             
-            # Determine file extension based on mime type or default to .png
-            mime_type = row.get("metadata_mime_type", "").strip()
-            extension = ".png"  # Default extension
-            if mime_type:
-                if "jpeg" in mime_type or "jpg" in mime_type:
-                    extension = ".jpg"
-                elif "png" in mime_type:
-                    extension = ".png"
-                elif "gif" in mime_type:
-                    extension = ".gif"
-            
-            output_path = os.path.join(output_dir, f"{safe_name}{extension}")
+            # Skip rows finished by an earlier run
+            key = ipfs_manifest.row_key(source, row_number, url)
+            if manifest and manifest.is_complete(key, output_path):
+                skipped_count += 1
+                success_count += 1
+                continue
             
-            # Download the image
-            success = download_image(url, output_path, gateway_url)
+            # Reuse a CID already downloaded for an earlier row or CSV file
+            reused = downloaded.reuse(url, output_path)
+            if reused:
+                output_path, mime_type = reused
+                success = True
+                deduped_count += 1
+            else:
+                # Download the image, then name it after the detected content type
+                file_type = download_image(url, output_path, gateway_url, chunk_size, hedge)
+                success = bool(file_type)
+                if success:
+                    output_path = ipfs_sniff.retype_file(output_path, file_type)
+                    mime_type = file_type.mime_type
+                    downloaded.add(url, output_path, mime_type)
             if success:
                 success_count += 1
+                if manifest:
+                    manifest.mark_done(key, url, output_path, content_type=mime_type)
             else:
                 fail_count += 1
+                if manifest:
+                    manifest.mark_failed(key, url)
     
     print(f"Processed {csv_file}:")
     print(f"  Success: {success_count}")
+    if skipped_count:
+        print(f"  Already complete (skipped): {skipped_count}")
+    if deduped_count:
+        print(f"  Duplicate CIDs (linked, not downloaded): {deduped_count}")
     print(f"  Failed: {fail_count}")
     return success_count, fail_count
 
+async def stream_to_file_async(response, output_path, chunk_size=ipfs_http.DEFAULT_CHUNK_SIZE, on_chunk=None):
+    """Async counterpart of ipfs_gateways.save_content for aiohttp responses."""
+    directory = os.path.dirname(output_path) or "."
+    fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".part", dir=directory)
+    written = 0
+    started = time.monotonic()
+    try:
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                f.write(chunk)
+                written += len(chunk)
+                if on_chunk:
+                    on_chunk(chunk)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    ipfs_gateways.record_transfer(response, written, time.monotonic() - started)
+    return written
+
+async def download_image_async(session, url, output_path, gateway_url, chunk_size=ipfs_http.DEFAULT_CHUNK_SIZE,
+                               hedge=False):
+    """Download an image from IPFS URL with a shared aiohttp session.
+    
+    Returns the ipfs_sniff.FileType detected from the content, or False on
+    failure. Cache copies run in worker threads, off the event loop.
+    """
+    try:
+        # Parse IPFS URL to extract CID
+        path = ipfs_gateways.ipfs_path_from_url(url)
+        if path is None:
+            print(f"Skipping non-IPFS URL: {url}")
+            return False
+        
+        # Serve from the local CID cache when this content was fetched before
+        cache = ipfs_cache.get_default_cache()
+        if cache and await asyncio.to_thread(cache.copy_to, path, output_path):
+            print(f"Reused cached copy: {output_path}")
+            return await asyncio.to_thread(ipfs_sniff.sniff_file, output_path)
+        
+        # Download the image
+        print(f"Downloading: {path}")
+        # Transient failures (429, 5xx, timeouts) are retried with backoff
+        response = await ipfs_retry.call_async(lambda: ipfs_gateways.fetch_async(session, path, gateway_url, hedge),
+                                               log_callback=print, description=path)
+        async with response:
+            if response.status == 200:
+                # Stream to a temp file in chunks so large assets never sit in memory;
+                # only the first bytes are kept to detect the file type
+                sniffer = ipfs_sniff.Sniffer()
+                await stream_to_file_async(response, output_path, chunk_size, sniffer.feed)
+                if cache:
+                    await asyncio.to_thread(cache.put_file, path, output_path)
+                print(f"Downloaded: {output_path}")
+                return sniffer.detect(response.headers.get("Content-Type"))
+            else:
+                print(f"Failed to download {url}: HTTP {response.status}")
+                return False
+    except asyncio.TimeoutError:
+        print(f"Error downloading {url}: timeout")
+        return False
+    except Exception as e:
+        print(f"Error downloading {url}: {str(e)}")
+        return False
+
+async def process_csv_file_async(csv_file, output_dir, gateway_url, max_inflight=DEFAULT_MAX_INFLIGHT,
+                                 chunk_size=ipfs_http.DEFAULT_CHUNK_SIZE, hedge=False, manifest=None,
+                                 downloaded=None, planner=None):
+    """Stream CSV rows into a pool of async fetchers with at most max_inflight requests in flight.
+    
+    File copies, renames, hashing and manifest commits block, so they run in
+    worker threads (asyncio.to_thread) and never stall the event loop.
+    """
+    # Create output directory if it doesn't exist
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    source = os.path.basename(csv_file)
+    if downloaded is None:
+        downloaded = ipfs_plan.DownloadedCids()
+    if planner is None:
+        planner = ipfs_plan.FilenamePlanner()
+    
+    with open(csv_file, 'r', encoding='utf-8') as file:
+        reader = csv.DictReader(file)
+        
+        # Check if the required columns exist
+        required_columns = ["name", "unit-name", "url"]
+        if not all(col in reader.fieldnames for col in required_columns):
+            missing = [col for col in required_columns if col not in reader.fieldnames]
+            print(f"Error: CSV file {csv_file} is missing required columns: {', '.join(missing)}")
+            return 0, 0
+        reserve_column = ipfs_arc19.reserve_column(reader.fieldnames)
+        
+        # Track success and failure counts
+        counts = {"success": 0, "fail": 0, "skipped": 0, "deduped": 0}
+        
+        # The bounded queue is the backpressure: the reader blocks once
+        # max_inflight rows are waiting for a free fetcher
+        pending = asyncio.Queue(maxsize=max_inflight)
+        
+        connector = aiohttp.TCPConnector(limit=max_inflight, limit_per_host=max_inflight)
+        # No total limit: it would also count time spent waiting for a free
+        # connection, failing healthy requests queued behind slow ones
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=30)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            # CIDs currently being fetched; rows repeating one wait for that
+            # download instead of sending their own request
+            inflight = {}
+            
+            async def fetch_once(url, output_path):
+                # Returns (output_path, mime_type) of the written file, or None
+                reused = await asyncio.to_thread(downloaded.reuse, url, output_path)
+                if reused:
+                    counts["deduped"] += 1
+                    return reused
+                cid = ipfs_plan.cid_key(url)
+                leader = inflight.get(cid) if cid else None
+                if leader is not None:
+                    if not await leader:
+                        return None
+                    reused = await asyncio.to_thread(downloaded.reuse, url, output_path)
+                    if reused:
+                        counts["deduped"] += 1
+                        return reused
+                
+                done = asyncio.get_running_loop().create_future()
+                if cid and leader is None:
+                    inflight[cid] = done
+                written = None
+                try:
+                    file_type = await download_image_async(session, url, output_path, gateway_url, chunk_size, hedge)
+                    if file_type:
+                        # Name the file after the detected content type
+                        output_path = await asyncio.to_thread(ipfs_sniff.retype_file, output_path, file_type)
+                        await asyncio.to_thread(downloaded.add, url, output_path, file_type.mime_type)
+                        written = (output_path, file_type.mime_type)
+                finally:
+                    if inflight.get(cid) is done:
+                        del inflight[cid]
+                    done.set_result(written is not None)
+                return written
+            
+            async def fetcher():
+                while True:
+                    item = await pending.get()
+                    if item is None:
+                        return
+                    key, url, output_path = item
+                    written = await fetch_once(url, output_path)
+                    counts["success" if written else "fail"] += 1
+                    # Hashes the file and commits to SQLite
+                    if manifest and written:
+                        await asyncio.to_thread(manifest.mark_done, key, url, written[0], content_type=written[1])
+                    elif manifest:
+                        await asyncio.to_thread(manifest.mark_failed, key, url)
+            
+            fetchers = [asyncio.create_task(fetcher()) for _ in range(max_inflight)]
+            
+            # Process each row, skipping rows finished by an earlier run
+            for row_number, row in enumerate(reader):
+                item = build_output_path(row, output_dir, planner, reserve_column)
+                if item is None:
+                    continue
+                url, output_path = item
+                key = ipfs_manifest.row_key(source, row_number, url)
+                if manifest and await asyncio.to_thread(manifest.is_complete, key, output_path):
+                    counts["skipped"] += 1
+                    counts["success"] += 1
+                    continue
+                await pending.put((key, url, output_path))
+            
+            # One stop marker per fetcher, then wait for the queue to drain
+            for _ in fetchers:
+                await pending.put(None)
+            await asyncio.gather(*fetchers)
+    
+    print(f"Processed {csv_file}:")
+    print(f"  Success: {counts['success']}")
+    if counts["skipped"]:
+        print(f"  Already complete (skipped): {counts['skipped']}")
+    if counts["deduped"]:
+        print(f"  Duplicate CIDs (linked, not downloaded): {counts['deduped']}")
+    print(f"  Failed: {counts['fail']}")
+    return counts["success"], counts["fail"]
+
 def main():
     parser = argparse.ArgumentParser(description="Download NFT images from IPFS URLs in CSV files")
     parser.add_argument("csv_files", nargs="+", help="CSV file(s) containing NFT data")
     parser.add_argument("--output", "-o", default="downloaded_images", help="Output directory for downloaded images")
-    parser.add_argument("--gateway", "-g", default=IPFS_GATEWAY, help="IPFS gateway URL")
+    parser.add_argument("--gateway", "-g", default=IPFS_GATEWAY,
+                        help="IPFS gateway URL, or several separated by commas (healthiest used first)")
+    parser.add_argument("--hedge", action="store_true",
+                        help="Fire a backup request at the next gateway when the first one is slow")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="Use the asyncio download engine (requires aiohttp)")
+    parser.add_argument("--max-inflight", type=int, default=DEFAULT_MAX_INFLIGHT,
+                        help="Maximum concurrent requests in --async mode")
+    parser.add_argument("--cache-dir", default=ipfs_cache.DEFAULT_CACHE_DIR,
+                        help="Directory of the local CID cache")
+    parser.add_argument("--cache-size-mb", type=int, default=ipfs_cache.DEFAULT_CACHE_SIZE_MB,
+                        help="Size cap of the local CID cache in MB")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always download from the gateway and do not fill the cache")
+    parser.add_argument("--chunk-size", type=int, default=ipfs_http.DEFAULT_CHUNK_SIZE // 1024,
+                        help="Streaming chunk size in KB (peak memory per download)")
+    parser.add_argument("--no-resume", action="store_true",
+                        help="Re-download every row instead of skipping rows completed by an earlier run")
+    parser.add_argument("--archive", metavar="PATH",
+                        help="Also pack the output directory into one archive at PATH ('-' writes it to stdout)")
+    parser.add_argument("--archive-format", choices=ipfs_archive.FORMATS,
+                        help="Archive format: zip, tar or tar.zst (zstd, requires zstandard); "
+                             "defaults to the extension of PATH, or tar.zst for stdout")
     
     args = parser.parse_args()
     
-    # Get the gateway URL
-    gateway_url = args.gateway
+    if args.use_async and not AIOHTTP_AVAILABLE:
+        print("Error: --async requires aiohttp (pip install aiohttp)")
+        return
+    if args.max_inflight < 1:
+        print("Error: --max-inflight must be at least 1")
+        return
+    if args.chunk_size < 1:
+        print("Error: --chunk-size must be at least 1 KB")
+        return
+    archive_format = args.archive_format
+    if args.archive and archive_format is None:
+        if args.archive == "-":
+            archive_format = ipfs_archive.TAR_ZSTD if ipfs_archive.ZSTD_AVAILABLE else ipfs_archive.TAR
+        else:
+            archive_format = ipfs_archive.format_for_path(args.archive)
+    if archive_format == ipfs_archive.TAR_ZSTD and not ipfs_archive.ZSTD_AVAILABLE:
+        print("Error: tar.zst archives require zstandard (pip install zstandard)")
+        return
+    if args.archive and args.archive != "-":
+        archive_path = os.path.abspath(args.archive)
+        if os.path.commonpath([archive_path, os.path.abspath(args.output)]) == os.path.abspath(args.output):
+            print("Error: --archive must be outside the output directory")
+            return
+    archive_stdout = None
+    if args.archive == "-":
+        # The archive owns stdout; progress messages go to stderr instead
+        archive_stdout = sys.stdout.buffer
+        sys.stdout = sys.stderr
+    chunk_size = args.chunk_size * 1024
+    ipfs_cache.configure_default_cache(args.cache_dir, args.cache_size_mb, enabled=not args.no_cache)
+    
+    # Get the gateway URLs
+    gateway_url = ipfs_gateways.parse_gateway_list(args.gateway)
+    if args.hedge and len(gateway_url) < 2:
+        print("Warning: --hedge needs at least two gateways; downloading without hedging")
     
     # Create the output directory
     output_dir = args.output
     
+    # Per-row progress manifest kept next to the downloads, so reruns resume
+    manifest = None
+    if not args.no_resume:
+        manifest = ipfs_manifest.DownloadManifest.for_directory(output_dir)
+    
+    # CIDs fetched so far, so rows repeated within or across CSV files download once
+    downloaded = ipfs_plan.DownloadedCids()
+    
+    # One filename plan for every CSV, so files from different CSVs never overwrite each other
+    planner = ipfs_plan.FilenamePlanner()
+    
     # Process each CSV file
     total_success = 0
     total_fail = 0
@@ -120,14 +438,44 @@ def main():
             continue
             
         print(f"Processing {csv_file}...")
-        success, fail = process_csv_file(csv_file, output_dir, gateway_url)
+        if args.use_async:
+            success, fail = asyncio.run(process_csv_file_async(csv_file, output_dir, gateway_url,
+                                                               args.max_inflight, chunk_size, args.hedge,
+                                                               manifest, downloaded, planner))
+        else:
+            success, fail = process_csv_file(csv_file, output_dir, gateway_url, chunk_size, args.hedge,
+                                             manifest, downloaded, planner)
         total_success += success
         total_fail += fail
     
+    # Stream the finished output directory into one archive, file by file
+    if args.archive:
+        if archive_stdout is not None:
+            archived = ipfs_archive.write_tree(output_dir, archive_stdout, archive_format)
+            archive_stdout.flush()
+        else:
+            with open(args.archive, "wb") as f:
+                archived = ipfs_archive.write_tree(output_dir, f, archive_format)
+        print(f"Archived {archived} files as {archive_format}: {args.archive if archive_stdout is None else 'stdout'}")
+    
     print("\nSummary:")
     print(f"Total images successfully downloaded: {total_success}")
     print(f"Total images failed to download: {total_fail}")
     print(f"Images saved to: {os.path.abspath(output_dir)}")
+    if args.use_async:
+        print("Connection pool: not tracked for --async downloads (aiohttp keeps its own pool)")
+    for line in ipfs_http.format_pool_stats():
+        print(f"Connection pool: {line}")
+    for line in ipfs_gateways.default_router.format_stats():
+        print(f"Gateway: {line}")
+    print(f"Retries: {ipfs_retry.default_budget.format_stats()}")
+    if manifest:
+        types = ", ".join(f"{content_type or 'unknown'} x{count}"
+                          for content_type, count in manifest.content_types().items())
+        if types:
+            print(f"Content types: {types}")
+        print(f"Progress manifest: {manifest.db_path}")
+        manifest.close()
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -3,18 +3,36 @@ import csv
 import requests
 import streamlit as st
 import pandas as pd
-from io import StringIO
 import time
 import threading
+import itertools
+from collections import deque
+import math
+import queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 import base64
 from pathlib import Path
 import tempfile
+import shutil
 import zipfile
 from PIL import Image
 import json
 import hashlib
 from urllib.parse import quote
 import io
+import ipfs_http
+import ipfs_gateways
+import ipfs_cache
+import ipfs_manifest
+import ipfs_plan
+import ipfs_retry
+import ipfs_csv
+import ipfs_arc19
+import ipfs_probe
+import ipfs_sniff
+import ipfs_archive
+import ipfs_serve
+import ipfs_spill
 
 # Additional imports for cloud integrations
 import json
@@ -50,6 +68,28 @@ BACKGROUND_COLOR = "#000000"  # Black background
 TEXT_COLOR = "#00FF00"  # Bright green text
 ACCENT_COLOR = "#005500"  # Darker green for accents
 
+# Shared helper modules shipped with the local desktop version
+LOCAL_VERSION_MODULES = ["ipfs_http.py", "ipfs_gateways.py", "ipfs_cache.py", "ipfs_manifest.py",
+                         "ipfs_plan.py", "ipfs_retry.py", "ipfs_cid.py", "ipfs_arc19.py", "ipfs_sniff.py"]
+
+# Parallel download settings (gateway latency, not bandwidth, is the bottleneck)
+DEFAULT_MAX_WORKERS = 8
+CLOUD_MAX_WORKERS = 4
+DOWNLOAD_WINDOW_PER_WORKER = 2  # Downloads queued or holding unarchived bytes, per worker
+
+# Downloads and progress manifests for each uploaded CSV live here, keyed by
+# the CSV content hash, so a rerun after a dropped session resumes the job.
+# A job's folder is removed once all of its items are archived; folders of
+# jobs that were never finished are pruned after JOB_MAX_AGE seconds
+JOB_ROOT_DIR = os.path.join(tempfile.gettempdir(), "cyber_skulls_jobs")
+JOB_MAX_AGE = 24 * 60 * 60
+
+# Size planning
+ZIP_PART_MB = 50  # Collections larger than this are split into ZIP parts of this size
+CLOUD_MEMORY_LIMIT_MB = 800  # Archive size the cloud deployment can hold in memory
+BUFFER_MEMORY_MB = 64  # Downloaded bytes kept in memory per run, across all buffers; further files spill to temp files
+DEFAULT_ITEM_SIZE_MB = 0.8  # Fallback estimate per item when probing is not possible
+
 # Apply custom CSS for Cyber Skulls theme
 def apply_cyber_skulls_theme():
     st.markdown("""
@@ -151,20 +191,41 @@ def apply_cyber_skulls_theme():
     <div class="grid-container"></div>
     """, unsafe_allow_html=True)
 
-# Utility function to create a download link for a zip file
-def create_download_link(zip_file_path, link_text="DOWNLOAD_FILES"):
-    with open(zip_file_path, "rb") as f:
-        bytes_data = f.read()
-        b64 = base64.b64encode(bytes_data).decode()
-        href = f'<a href="data:application/zip;base64,{b64}" download="ipfs_downloads.zip" style="text-decoration:none;"><button style="color:#00FF00;background-color:#111111;border:1px solid #00FF00;padding:8px 16px;font-family:\'Courier New\',monospace;cursor:pointer;">{link_text}</button></a>'
-    return href
+# Utility functions to hand files on disk to the browser
+def static_serving_enabled():
+    """Return True if Streamlit serves the app's static folder (see .streamlit/config.toml)"""
+    try:
+        return bool(st.get_option("server.enableStaticServing"))
+    except Exception:
+        return False
+
+def create_download_link(url, download_name, link_text="DOWNLOAD_FILES"):
+    """Return a button linking to a file served from disk; the browser streams it from the server"""
+    return f'<a href="{url}" download="{download_name}" style="text-decoration:none;"><button style="color:#00FF00;background-color:#111111;border:1px solid #00FF00;padding:8px 16px;font-family:\'Courier New\',monospace;cursor:pointer;">{link_text}</button></a>'
+
+def show_file_download(path, download_name, link_text, size=None, key=None):
+    """Render a download button for a file on disk without embedding it in the page.
+
+    Served files are linked by URL, so they are streamed in chunks (with
+    Range support) and never read into this process. Otherwise the button's
+    data is deferred and read only when it is clicked.
+    """
+    url = ipfs_serve.url_for(path, size) if static_serving_enabled() else None
+    if url:
+        st.markdown(create_download_link(url, download_name, link_text), unsafe_allow_html=True)
+    else:
+        st.download_button(link_text, data=Path(path).read_bytes, file_name=download_name,
+                           mime="application/zip" if path.endswith(".zip") else "application/octet-stream",
+                           key=key or f"download_{path}", on_click="ignore")
 
 # Function to create local version zip file
-def create_local_version_zip():
-    """Create a zip file containing the local GUI version and dependencies"""
+def create_local_version_zip(directory):
+    """Create a zip file containing the local GUI version and dependencies in directory"""
     try:
-        # Create a temporary zip file
-        zip_filename = os.path.join(tempfile.gettempdir(), "cyber_skulls_local_version.zip")
+        os.makedirs(directory, exist_ok=True)
+        zip_filename = os.path.join(directory, "cyber_skulls_local_version.zip")
+        # Build under a temporary name, so a download of the previous bundle is never cut short
+        build_filename = f"{zip_filename}.{os.getpid()}.tmp"
         
         # Create README for local version
         local_readme_content = """# Cyber Skulls NFT Downloader - Local Version
@@ -240,6 +301,7 @@ Your CSV file should contain columns:
 
 - **run.bat**: Easy launcher for Windows (double-click to start)
 - download_ipfs_gui.py: Main GUI application
+- ipfs_*.py: Shared download helpers used by the GUI
 - logo.png: Cyber Skulls logo (if available)
 - requirements_local.txt: Python dependencies
 - README_LOCAL.md: This file
@@ -322,6 +384,12 @@ pause
                 files_to_include.append((gui_file, gui_file))
                 total_size += file_size
         
+        # Shared helper modules imported by the GUI
+        for module_file in LOCAL_VERSION_MODULES:
+            if os.path.exists(module_file):
+                files_to_include.append((module_file, module_file))
+                total_size += os.path.getsize(module_file)
+        
         # Check for logo.png and include if reasonable size  
         logo_file = "logo.png"
         if os.path.exists(logo_file):
@@ -347,10 +415,11 @@ pause
                         break
         
         # Create the zip file with only essential files
-        with zipfile.ZipFile(zip_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
+        with zipfile.ZipFile(build_filename, 'w', zipfile.ZIP_DEFLATED) as zipf:
             # Add existing small files only
+            # The logo PNG is stored as is; deflating it would only cost time
             for source_file, archive_name in files_to_include:
-                zipf.write(source_file, archive_name)
+                zipf.write(source_file, archive_name, compress_type=ipfs_archive.compression_for(archive_name))
             
             # Add README
             zipf.writestr("README_LOCAL.md", local_readme_content)
@@ -362,53 +431,79 @@ pause
             zipf.writestr("run.bat", run_bat_content)
         
         # Check final zip size
-        if os.path.exists(zip_filename):
-            zip_size = os.path.getsize(zip_filename)
-            zip_size_mb = zip_size / (1024 * 1024)
-            print(f"Created local version zip: {zip_size_mb:.1f} MB")
-            
-            # If zip is too large (>100MB), don't return it
-            if zip_size > 100 * 1024 * 1024:
-                print(f"Zip file too large ({zip_size_mb:.1f} MB) - removing")
-                os.remove(zip_filename)
-                return None
+        zip_size = os.path.getsize(build_filename)
+        zip_size_mb = zip_size / (1024 * 1024)
+        print(f"Created local version zip: {zip_size_mb:.1f} MB")
+        
+        # If zip is too large (>100MB), don't return it
+        if zip_size > 100 * 1024 * 1024:
+            print(f"Zip file too large ({zip_size_mb:.1f} MB) - removing")
+            os.remove(build_filename)
+            return None
         
+        os.replace(build_filename, zip_filename)
         return zip_filename
     except Exception as e:
         print(f"Error creating local version zip: {str(e)}")
         return None
 
-# Function to create download link for local version
-def create_local_download_link():
-    """Create a download link for the local version"""
-    zip_path = create_local_version_zip()
+def local_version_fingerprint():
+    """Return a key that changes whenever any input of the local version zip changes.
+
+    The README, requirements and run.bat texts live in this script, so it is
+    an input too. Only stats are taken; nothing is read.
+    """
+    inputs = ["download_ipfs_gui.py", *LOCAL_VERSION_MODULES, "logo.png", "cs GLOW.png", os.path.abspath(__file__)]
+    fingerprint = hashlib.sha256()
+    for path in inputs:
+        try:
+            stat = os.stat(path)
+            fingerprint.update(f"{path}:{stat.st_mtime_ns}:{stat.st_size};".encode("utf-8"))
+        except OSError:
+            fingerprint.update(f"{path}:missing;".encode("utf-8"))
+    return fingerprint.hexdigest()
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def build_local_version_zip(fingerprint, directory):
+    """Build the local version zip once per fingerprint, shared by every session of this process"""
+    return create_local_version_zip(directory)
+
+# Function to show the download button for the local version
+def show_local_download():
+    """Render the local version download button; returns False if the local version is unavailable"""
+    # Build it where it can be served from disk when static serving is on
+    directory = ipfs_serve.STATIC_DIR if static_serving_enabled() else tempfile.gettempdir()
+    fingerprint = local_version_fingerprint()
+    zip_path = build_local_version_zip(fingerprint, directory)
+    if zip_path and not os.path.exists(zip_path):
+        # Removed behind our back (temp cleanup): build it again
+        build_local_version_zip.clear()
+        zip_path = build_local_version_zip(fingerprint, directory)
     if zip_path and os.path.exists(zip_path):
-        with open(zip_path, "rb") as f:
-            bytes_data = f.read()
-            b64 = base64.b64encode(bytes_data).decode()
-            href = f'<a href="data:application/zip;base64,{b64}" download="cyber_skulls_local_version.zip" style="text-decoration:none;"><button style="color:#00FF00;background-color:#111111;border:1px solid #00FF00;padding:8px 16px;font-family:\'Courier New\',monospace;cursor:pointer;">⬇ DOWNLOAD_LOCAL_VERSION</button></a>'
-        return href
-    return None
+        show_file_download(zip_path, "cyber_skulls_local_version.zip", "⬇ DOWNLOAD_LOCAL_VERSION",
+                           key="download_local_version")
+        return True
+    return False
 
 # Function to download an image from IPFS
-def download_image(url, output_path, gateway_url, log_callback=None, is_cloud_env=False):
+def download_image(url, output_path, gateway_url, log_callback=None, is_cloud_env=False,
+                   chunk_size=ipfs_http.DEFAULT_CHUNK_SIZE, hedge=False):
+    """Download url to output_path; returns the detected ipfs_sniff.FileType, or False on failure"""
     try:
         # Parse IPFS URL to extract CID
-        if url.startswith("ipfs://"):
-            # Extract the CID and handle any fragment identifier
-            path = url[7:]  # Remove 'ipfs://' prefix
-            
-            # Handle fragment identifiers (like #i at the end)
-            if '#' in path:
-                path = path.split("#")[0]
-            
-            # Create full gateway URL
-            full_url = f"{gateway_url}{path}"
-        else:
+        path = ipfs_gateways.ipfs_path_from_url(url)
+        if path is None:
             if log_callback:
                 log_callback(f"[WARNING] Skipping non-IPFS URL: {url}")
             return False
         
+        # Serve from the local CID cache when this content was fetched before
+        cache = ipfs_cache.get_default_cache()
+        if cache and cache.copy_to(path, output_path):
+            if log_callback:
+                log_callback(f"[CACHE] Reused cached copy: {os.path.basename(output_path)}")
+            return ipfs_sniff.sniff_file(output_path)
+        
         # Download the image with cloud-specific timeout
         if log_callback:
             log_callback(f"[DOWNLOAD] Retrieving: {os.path.basename(output_path)}")
@@ -416,20 +511,23 @@ def download_image(url, output_path, gateway_url, log_callback=None, is_cloud_en
         # Use shorter timeout for cloud environments to avoid hanging
         timeout = 30 if is_cloud_env else 60
         
-        response = requests.get(full_url, timeout=timeout)
-        if response.status_code == 200:
-            # Ensure the directory exists
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            
-            with open(output_path, 'wb') as f:
-                f.write(response.content)
-            if log_callback:
-                log_callback(f"[SUCCESS] Downloaded: {os.path.basename(output_path)}")
-            return True
-        else:
-            if log_callback:
-                log_callback(f"[ERROR] Failed to download {url}: HTTP {response.status_code}")
-            return False
+        # Transient failures (429, 5xx, timeouts) are retried with backoff
+        with ipfs_retry.call(lambda: ipfs_gateways.fetch(path, gateway_url, timeout=timeout, hedge=hedge),
+                             log_callback=log_callback, description=path) as response:
+            if response.status_code == 200:
+                # Stream to a temp file in chunks so large assets never sit in memory;
+                # only the first bytes are kept to detect the file type
+                sniffer = ipfs_sniff.Sniffer()
+                ipfs_gateways.save_content(response, output_path, chunk_size, sniffer.feed)
+                if cache:
+                    cache.put_file(path, output_path)
+                if log_callback:
+                    log_callback(f"[SUCCESS] Downloaded: {os.path.basename(output_path)}")
+                return sniffer.detect(response.headers.get("Content-Type"))
+            else:
+                if log_callback:
+                    log_callback(f"[ERROR] Failed to download {url}: HTTP {response.status_code}")
+                return False
     except requests.exceptions.Timeout:
         if log_callback:
             log_callback(f"[TIMEOUT] Download timeout for {url}")
@@ -444,130 +542,313 @@ def download_image(url, output_path, gateway_url, log_callback=None, is_cloud_en
         return False
 
 # Process CSV data for downloading in batches
-def process_csv_data_in_batches(df, output_dir, gateway_url, batch_size=50, 
-                               progress_callback=None, log_callback=None, is_cloud_env=False):
+def process_csv_data_in_batches(rows, total_count, output_dir, gateway_url, batch_size=50, 
+                               progress_callback=None, log_callback=None, is_cloud_env=False,
+                               max_workers=DEFAULT_MAX_WORKERS, hedge=False, manifest=None,
+                               collection_progress_callback=None, open_archive=None, expected_sizes=None,
+                               memory_budget=BUFFER_MEMORY_MB * 1024 * 1024):
+    """Download a stream of ipfs_csv.DownloadRow records into ZIP archives, batch by batch.
+    
+    Rows are pulled from the iterator one batch at a time, and every
+    downloaded file is appended to its collection's ZIP part as soon as it
+    arrives, so memory is bounded by the downloads in flight, not by the
+    collection. Rows of several collections (see ipfs_csv.iter_collections)
+    share one worker pool; each collection is written to its own subfolder.
+    open_archive(collection) returns the ipfs_archive.PartSink of a
+    collection (by default cyber_skulls_{collection} ZIP parts of ZIP_PART_MB).
+    
+    Returns (success_count, fail_count, downloaded_files, archives), where
+    archives maps each collection name to its PartSink, still open.
+    collection_progress_callback is called with (collection, processed,
+    succeeded, failed) after every row. expected_sizes maps CID keys to
+    probed sizes (see ipfs_probe.SizePlan.sizes); each batch is then
+    downloaded largest first, so the ZIP parts are packed first-fit
+    decreasing. Without a manifest, the bytes kept to serve repeated CIDs
+    are buffered too. memory_budget (bytes, or an ipfs_spill.MemoryBudget
+    shared with the sinks of open_archive) bounds the memory held by those
+    and by the default sinks together; beyond it files spill to temp files.
+    """
+    memory_budget = ipfs_spill.shared_budget(memory_budget)
+    fetched_buffer = None if manifest else ipfs_spill.SpillBuffer(memory_budget)
+    fetched_items = []  # Spill buffer items of fetched, released when done
+    archives = {}  # Collection -> PartSink receiving its files
     try:
-        # Check if required columns exist
-        required_columns = ["name", "unit-name", "url"]
-        for col in required_columns:
-            if col not in df.columns:
-                if log_callback:
-                    log_callback(f"[ERROR] CSV is missing required column: {col}")
-                return 0, 0, [], []
-        
         # Adjust batch size for cloud environments
         if is_cloud_env:
             # Use smaller batches in cloud to avoid timeouts
             batch_size = min(batch_size, 15)
+            max_workers = min(max_workers, CLOUD_MAX_WORKERS)
             if log_callback:
                 log_callback(f"[CLOUD] Adjusted batch size to {batch_size} for cloud environment")
+        max_workers = max(1, int(max_workers))
+        batch_size = max(1, int(batch_size))
         
         # Track success and failure counts
         success_count = 0
         fail_count = 0
-        total_count = len(df)
+        total_count = max(1, total_count)
         downloaded_files = []
-        file_data_list = []  # Store file data in memory for ZIP creation
+        collection_counts = {}  # Collection -> [processed, succeeded, failed]
+        if open_archive is None:
+            open_archive = lambda collection: ipfs_archive.ZipPartSink(
+                f"cyber_skulls_{collection or 'collection'}", collection or None, ZIP_PART_MB * 1024 * 1024,
+                log_callback=log_callback, memory_budget=memory_budget)
         processed_count = 0
+        queued_count = 0
         
         if log_callback:
-            log_callback(f"[INFO] Processing {total_count} items in batches of {batch_size}")
+            log_callback(f"[INFO] Processing {total_count} items in batches of {batch_size} with {max_workers} parallel downloads")
+        
+        # Worker threads must not touch Streamlit elements, so their log
+        # messages are queued and flushed from this thread
+        worker_logs = queue.Queue()
+        worker_log_callback = worker_logs.put if log_callback else None
+        
+        def flush_worker_logs():
+            while True:
+                try:
+                    message = worker_logs.get_nowait()
+                except queue.Empty:
+                    break
+                log_callback(message)
+        
+        def finish(collection, succeeded=None):
+            # Count one processed row; succeeded is None for skipped incomplete rows
+            nonlocal processed_count, success_count, fail_count
+            processed_count += 1
+            counts = collection_counts.setdefault(collection, [0, 0, 0])
+            counts[0] += 1
+            if succeeded is True:
+                success_count += 1
+                counts[1] += 1
+            elif succeeded is False:
+                fail_count += 1
+                counts[2] += 1
+            # Update progress based on processed count, not row index
+            if progress_callback:
+                progress_callback(processed_count / total_count)
+            if collection_progress_callback:
+                collection_progress_callback(collection, *counts)
+        
+        def record(url, key, output_path, file_data, file_type):
+            # Persist each finished file atomically so a later session can resume from it
+            if manifest:
+                ipfs_manifest.write_atomic(output_path, file_data)
+                manifest.mark_done(key, url, output_path, hashlib.sha256(file_data).hexdigest(),
+                                   file_type.mime_type)
+        
+        def download_and_record(url, key, output_path):
+            file_data, file_type = download_image_to_memory(url, gateway_url, worker_log_callback, is_cloud_env,
+                                                            hedge)
+            if file_data:
+                record(url, key, ipfs_sniff.with_extension(output_path, file_type.extension), file_data, file_type)
+            elif manifest:
+                manifest.mark_failed(key, url)
+            return file_data, file_type
+        
+        resumed_count = 0
+        deduped_count = 0
+        
+        # Detected type of every CID fetched so far and where its bytes can be
+        # read back (the file written for the manifest, or a spill buffer item
+        # without one); rows repeating a CID, in any collection, reuse them
+        # instead of sending another request
+        fetched = {}
+        
+        def remember(url, output_path, file_data, file_type):
+            cid = ipfs_plan.cid_key(url)
+            if cid is not None and cid not in fetched:
+                if manifest:
+                    fetched[cid] = (output_path, file_type)
+                else:
+                    fetched[cid] = (fetched_buffer.put(file_data), file_type)
+                    fetched_items.append(fetched[cid][0])
         
-        # Process in batches
-        for batch_start in range(0, total_count, batch_size):
-            batch_end = min(batch_start + batch_size, total_count)
-            batch = df.iloc[batch_start:batch_end]
-            
-            if log_callback:
-                log_callback(f"[BATCH] Processing items {batch_start+1}-{batch_end} of {total_count}")
-            
-            # Process each row in the batch
-            for _, row in batch.iterrows():
-                processed_count += 1
-                
-                # Update progress based on processed count, not row index
-                if progress_callback:
-                    progress_callback(processed_count / total_count)
-                
-                name = row["name"].strip() if isinstance(row["name"], str) else str(row["name"])
-                unit_name = row["unit-name"].strip() if isinstance(row["unit-name"], str) else str(row["unit-name"])
-                url = row["url"].strip() if isinstance(row["url"], str) else str(row["url"])
-                
-                if not url or not name or not unit_name:
-                    continue
+        def reuse_fetched(cid):
+            # Returns (file_data, file_type) of an earlier download, or None
+            if cid not in fetched:
+                return None
+            source, file_type = fetched[cid]
+            if not isinstance(source, str):
+                return source.read(), file_type
+            try:
+                with open(source, "rb") as f:
+                    return f.read(), file_type
+            except OSError:
+                return None
+        
+        def archive(collection, filename, output_path, file_data):
+            # Each file goes into its collection's ZIP part as soon as it is
+            # ready, so no bytes are held once the row is done
+            downloaded_files.append(output_path)
+            sink = archives.get(collection)
+            if sink is None:
+                sink = archives[collection] = open_archive(collection)
+            sink.add(filename, file_data)
+        
+        def archive_results(file_data, file_type, targets):
+            # Archive a finished download for every row that was waiting on it
+            nonlocal deduped_count
+            for index, (collection, filename, key, url) in enumerate(targets):
+                if file_data:
+                    # Name the file after the detected content type
+                    filename = ipfs_sniff.with_extension(filename, file_type.extension)
+                    output_path = os.path.join(output_dir, collection, filename)
+                    if index == 0:
+                        remember(url, output_path, file_data, file_type)
+                        if log_callback:
+                            log_callback(f"[SUCCESS] Downloaded: {os.path.join(collection, filename)}")
+                    else:
+                        # Duplicate zip entry sharing the bytes of the first row
+                        record(url, key, output_path, file_data, file_type)
+                        deduped_count += 1
+                    archive(collection, filename, output_path, file_data)
+                    finish(collection, True)
+                else:
+                    if manifest and index > 0:
+                        manifest.mark_failed(key, url)
+                    finish(collection, False)
+                    if is_cloud_env and fail_count > 5:
+                        if log_callback:
+                            log_callback(f"[CLOUD_WARNING] Multiple failures detected. This may be due to cloud resource limits.")
+        
+        rows = iter(rows)
+        batch_number = 0
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Process in batches pulled from the row stream
+            while True:
+                batch = list(itertools.islice(rows, batch_size))
+                if not batch:
+                    break
+                batch_number += 1
                 
-                # Create a filename-safe version of the name
-                safe_name = f"{name}_{unit_name}".replace("/", "_").replace("\\", "_")
-                safe_name = "".join(c for c in safe_name if c.isalnum() or c in "._- ")
+                if log_callback:
+                    log_callback(f"[BATCH] Processing items {queued_count+1}-{queued_count+len(batch)} of {total_count}")
+                queued_count += len(batch)
                 
-                # Determine file extension based on mime type or default to .png
-                mime_type = row.get("metadata_mime_type", "")
-                if isinstance(mime_type, str):
-                    mime_type = mime_type.strip()
-                else:
-                    mime_type = ""
+                # Each unique CID in the batch becomes one download job; jobs
+                # map to every row waiting on that CID
+                jobs = deque()
+                pending = {}
+                for row in batch:
+                    url, filename, collection = row.url, row.filename, row.collection
+                    
+                    # Rows missing a name, unit-name or URL have no planned filename
+                    if filename is None:
+                        finish(collection)
+                        continue
+                    
+                    output_path = os.path.join(output_dir, collection, filename)
+                    
+                    # Reuse rows a previous run of this job already finished and verified
+                    key = ipfs_manifest.row_key(collection or "csv", row.row_number, url)
+                    file_data = manifest.load_verified(key) if manifest else None
+                    if file_data:
+                        resumed_count += 1
+                        file_type = ipfs_sniff.detect(file_data)
+                        filename = ipfs_sniff.with_extension(filename, file_type.extension)
+                        output_path = os.path.join(output_dir, collection, filename)
+                        archive(collection, filename, output_path, file_data)
+                        remember(url, output_path, file_data, file_type)
+                        finish(collection, True)
+                        continue
                     
-                extension = ".png"  # Default extension
-                if mime_type:
-                    if "jpeg" in mime_type or "jpg" in mime_type:
-                        extension = ".jpg"
-                    elif "png" in mime_type:
-                        extension = ".png"
-                    elif "gif" in mime_type:
-                        extension = ".gif"
+                    # Rows repeating a CID from an earlier batch reuse its bytes
+                    cid = ipfs_plan.cid_key(url)
+                    reused = reuse_fetched(cid)
+                    if reused:
+                        file_data, file_type = reused
+                        filename = ipfs_sniff.with_extension(filename, file_type.extension)
+                        output_path = os.path.join(output_dir, collection, filename)
+                        record(url, key, output_path, file_data, file_type)
+                        deduped_count += 1
+                        archive(collection, filename, output_path, file_data)
+                        finish(collection, True)
+                        continue
+                    
+                    target = (collection, filename, key, url)
+                    if cid is not None and cid in pending:
+                        pending[cid].append(target)
+                        continue
+                    
+                    targets = [target]
+                    jobs.append((url, key, output_path, targets))
+                    if cid is not None:
+                        pending[cid] = targets
                 
-                filename = f"{safe_name}{extension}"
-                output_path = os.path.join(output_dir, filename)
+                # Largest downloads first, so big animations claim parts before
+                # the small images that fill the gaps; unprobed ones go last
+                if expected_sizes:
+                    jobs = deque(sorted(jobs, key=lambda job: -expected_sizes.get(ipfs_plan.cid_key(job[0]), 0)))
                 
-                # Download the image and store in memory for web apps
-                file_data = download_image_to_memory(url, gateway_url, log_callback, is_cloud_env)
-                if file_data:
-                    success_count += 1
-                    downloaded_files.append(output_path)
-                    file_data_list.append((filename, file_data))
-                    if log_callback:
-                        log_callback(f"[SUCCESS] Downloaded: {filename}")
-                else:
-                    fail_count += 1
-                    if is_cloud_env and fail_count > 5:
+                # Keep only a small window of downloads submitted to the worker
+                # pool and archive each result as soon as it is done, so memory
+                # is bounded by the window rather than by the batch or collection
+                window = max_workers * DOWNLOAD_WINDOW_PER_WORKER
+                futures = {}
+                while jobs or futures:
+                    while jobs and len(futures) < window:
+                        url, key, output_path, targets = jobs.popleft()
+                        futures[executor.submit(download_and_record, url, key, output_path)] = targets
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        file_data, file_type = future.result()
+                        targets = futures.pop(future)
+                        
                         if log_callback:
-                            log_callback(f"[CLOUD_WARNING] Multiple failures detected. This may be due to cloud resource limits.")
-            
-            # Log batch completion with current stats
-            if log_callback:
-                log_callback(f"[BATCH_COMPLETE] Batch {batch_start//batch_size + 1} finished. Success: {success_count}, Failed: {fail_count}")
-            
-            # Allow a longer pause between batches in cloud environment
-            pause_time = 1.0 if is_cloud_env else 0.2
-            time.sleep(pause_time)
+                            flush_worker_logs()
+                        
+                        archive_results(file_data, file_type, targets)
+                
+                # Log batch completion with current stats
+                if log_callback:
+                    log_callback(f"[BATCH_COMPLETE] Batch {batch_number} finished. Success: {success_count}, Failed: {fail_count}")
+                
+                # Allow a longer pause between batches in cloud environment
+                pause_time = 1.0 if is_cloud_env else 0.2
+                time.sleep(pause_time)
         
         if log_callback:
+            if resumed_count:
+                log_callback(f"[RESUME] {resumed_count} items restored from the previous run without downloading")
+            if deduped_count:
+                log_callback(f"[DEDUPE] {deduped_count} items repeated an already downloaded CID and were not fetched again")
+            if fetched_buffer and fetched_buffer.spilled_count:
+                log_callback(f"[SPILL] {fetched_buffer.spilled_count} downloads kept for repeated CIDs were "
+                             f"buffered on disk ({fetched_buffer.spilled_bytes / (1024 * 1024):.1f} MB)")
             log_callback(f"[ALL_BATCHES_COMPLETE] All {total_count} items processed")
             
-        return success_count, fail_count, downloaded_files, file_data_list
+        return success_count, fail_count, downloaded_files, archives
     except Exception as e:
         if log_callback:
             log_callback(f"[ERROR] Error processing CSV: {str(e)}")
-        return 0, 0, [], []
+        # Stop the part writers and drop the half-written parts
+        for sink in archives.values():
+            sink.abort()
+        return 0, 0, [], {}
+    finally:
+        for item in fetched_items:
+            item.release()
 
 # Function to download an image to memory instead of disk
-def download_image_to_memory(url, gateway_url, log_callback=None, is_cloud_env=False):
+def download_image_to_memory(url, gateway_url, log_callback=None, is_cloud_env=False, hedge=False):
+    """Download url into memory; returns (file_data, ipfs_sniff.FileType), or (None, None) on failure"""
     try:
         # Parse IPFS URL to extract CID
-        if url.startswith("ipfs://"):
-            # Extract the CID and handle any fragment identifier
-            path = url[7:]  # Remove 'ipfs://' prefix
-            
-            # Handle fragment identifiers (like #i at the end)
-            if '#' in path:
-                path = path.split("#")[0]
-            
-            # Create full gateway URL
-            full_url = f"{gateway_url}{path}"
-        else:
+        path = ipfs_gateways.ipfs_path_from_url(url)
+        if path is None:
             if log_callback:
                 log_callback(f"[WARNING] Skipping non-IPFS URL: {url}")
-            return None
+            return None, None
+        
+        # Serve from the local CID cache when this content was fetched before
+        cache = ipfs_cache.get_default_cache()
+        if cache:
+            file_data = cache.get(path)
+            if file_data is not None:
+                if log_callback:
+                    log_callback(f"[CACHE] Reused cached copy: {url.split('/')[-1] if '/' in url else url}")
+                return file_data, ipfs_sniff.detect(file_data)
         
         # Download the image with cloud-specific timeout
         if log_callback:
@@ -576,127 +857,39 @@ def download_image_to_memory(url, gateway_url, log_callback=None, is_cloud_env=F
         # Use shorter timeout for cloud environments to avoid hanging
         timeout = 30 if is_cloud_env else 60
         
-        response = requests.get(full_url, timeout=timeout)
-        if response.status_code == 200:
-            return response.content
-        else:
-            if log_callback:
-                log_callback(f"[ERROR] Failed to download {url}: HTTP {response.status_code}")
-            return None
+        # Transient failures (429, 5xx, timeouts) are retried with backoff
+        with ipfs_retry.call(lambda: ipfs_gateways.fetch(path, gateway_url, timeout=timeout, hedge=hedge),
+                             log_callback=log_callback, description=path) as response:
+            if response.status_code == 200:
+                file_data = ipfs_gateways.read_content(response)
+                if cache:
+                    cache.put(path, file_data)
+                return file_data, ipfs_sniff.detect(file_data, response.headers.get("Content-Type"))
+            else:
+                if log_callback:
+                    log_callback(f"[ERROR] Failed to download {url}: HTTP {response.status_code}")
+                return None, None
     except requests.exceptions.Timeout:
         if log_callback:
             log_callback(f"[TIMEOUT] Download timeout for {url}")
-        return None
+        return None, None
     except requests.exceptions.RequestException as e:
         if log_callback:
             log_callback(f"[ERROR] Network error downloading {url}: {str(e)}")
-        return None
+        return None, None
     except Exception as e:
         if log_callback:
             log_callback(f"[ERROR] Error downloading {url}: {str(e)}")
-        return None
-
-# Function to create multiple ZIP files from file data
-def create_multiple_zips(file_data_list, max_size_mb=80, log_callback=None):
-    """Create multiple ZIP files if the total size exceeds the limit"""
-    zip_files = []
-    current_zip_files = []
-    current_size = 0
-    max_size_bytes = max_size_mb * 1024 * 1024
-    zip_counter = 1
-    
-    if log_callback:
-        log_callback(f"[ZIP] Creating ZIP files with max size {max_size_mb}MB each")
-    
-    try:
-        for i, (filename, file_data) in enumerate(file_data_list):
-            file_size = len(file_data)
-            
-            # If adding this file would exceed the limit, create a new ZIP
-            if current_size + file_size > max_size_bytes and current_zip_files:
-                # Create ZIP for current batch
-                if log_callback:
-                    log_callback(f"[ZIP] Creating part {zip_counter} with {len(current_zip_files)} files...")
-                
-                zip_path = create_zip_from_data(current_zip_files, f"ipfs_downloads_part_{zip_counter}.zip")
-                if zip_path:
-                    zip_files.append((zip_path, f"Part {zip_counter}"))
-                    if log_callback:
-                        log_callback(f"[ZIP] Created part {zip_counter}: {current_size / (1024*1024):.1f}MB")
-                
-                # Clear memory by removing processed files
-                current_zip_files = []
-                current_size = 0
-                zip_counter += 1
-                
-                # Force garbage collection to free memory
-                import gc
-                gc.collect()
-            
-            # Add file to current batch
-            current_zip_files.append((filename, file_data))
-            current_size += file_size
-            
-            # Progress logging for large collections
-            if i % 20 == 0 and log_callback:
-                log_callback(f"[ZIP] Processed {i+1}/{len(file_data_list)} files for ZIP creation")
-        
-        # Create final ZIP if there are remaining files
-        if current_zip_files:
-            if log_callback:
-                log_callback(f"[ZIP] Creating final part {zip_counter} with {len(current_zip_files)} files...")
-            
-            zip_path = create_zip_from_data(current_zip_files, f"ipfs_downloads_part_{zip_counter}.zip")
-            if zip_path:
-                zip_files.append((zip_path, f"Part {zip_counter}"))
-                if log_callback:
-                    log_callback(f"[ZIP] Created part {zip_counter}: {current_size / (1024*1024):.1f}MB")
-        
-        return zip_files
-        
-    except MemoryError:
-        if log_callback:
-            log_callback(f"[ERROR] Out of memory while creating ZIP files. Try smaller batches or use local version.")
-        return zip_files  # Return what we have so far
-    except Exception as e:
-        if log_callback:
-            log_callback(f"[ERROR] Error creating ZIP files: {str(e)}")
-        return zip_files  # Return what we have so far
-
-# Function to create a ZIP file from file data in memory
-def create_zip_from_data(file_data_list, zip_name):
-    """Create a ZIP file from a list of (filename, data) tuples"""
-    try:
-        zip_path = os.path.join(tempfile.gettempdir(), zip_name)
-        
-        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-            for filename, file_data in file_data_list:
-                zipf.writestr(filename, file_data)
-        
-        return zip_path
-    except Exception as e:
-        print(f"Error creating ZIP {zip_name}: {str(e)}")
-        return None
+        return None, None
 
-# Function to create download buttons for multiple ZIPs (fixed for message size limit)
-def create_multiple_download_buttons(zip_files):
-    """Create download interface for multiple ZIP files - sequential to avoid message size limit"""
+# Function to show download buttons for multiple ZIPs (served from disk, never embedded)
+def show_multiple_download_buttons(placeholder, zip_files):
+    """Render the sequential download interface for a list of ipfs_archive.ArchivePart into placeholder"""
     if not zip_files:
-        return ""
-    
-    html_content = '<div style="margin-top:20px;">'
-    html_content += '<p class="cyber-label">⬇ DOWNLOAD_YOUR_FILES:</p>'
+        return
     
-    # Calculate total size
-    total_size = 0
-    for zip_path, part_name in zip_files:
-        if os.path.exists(zip_path):
-            total_size += os.path.getsize(zip_path)
-    
-    total_size_mb = total_size / (1024 * 1024)
-    
-    # Always use sequential download to avoid message size limits
-    html_content += f'<p style="color:#888888;font-size:11px;font-family:Courier;">Sequential download system - Total: {total_size_mb:.1f}MB in {len(zip_files)} files</p>'
+    # Part sizes were recorded when the parts were closed, so nothing is stat'ed again here
+    total_size_mb = sum(part.size for part in zip_files) / (1024 * 1024)
     
     # Initialize current download index in session state
     if 'current_download_index' not in st.session_state:
@@ -708,74 +901,91 @@ def create_multiple_download_buttons(zip_files):
     
     current_index = st.session_state.current_download_index
     
-    # Show current file for download
-    if current_index < len(zip_files):
-        zip_path, part_name = zip_files[current_index]
+    with placeholder.container():
+        st.markdown(f'''
+        <div style="margin-top:20px;">
+            <p class="cyber-label">⬇ DOWNLOAD_YOUR_FILES:</p>
+            <p style="color:#888888;font-size:11px;font-family:Courier;">Sequential download system - Total: {total_size_mb:.1f}MB in {len(zip_files)} files</p>
+        </div>
+        ''', unsafe_allow_html=True)
+        
+        # Show current file for download
+        zip_path, part_name, part_size = zip_files[current_index]
+        file_size = part_size / (1024 * 1024)
+        extension = ".tar.zst" if zip_path.endswith(".tar.zst") else os.path.splitext(zip_path)[1]
+        download_name = f"cyber_skulls_{part_name.lower().replace(' ', '_')}{extension}"
+        st.markdown('''
+        <div style="margin:15px 0 0 0; padding:15px; border:2px solid #00FF00; background-color:rgba(0,255,0,0.1);">
+            <p style="color:#00FF00;font-family:Courier;font-size:14px;margin:0;">📦 READY FOR DOWNLOAD:</p>
+        </div>
+        ''', unsafe_allow_html=True)
+        show_file_download(zip_path, download_name, f"⬇ DOWNLOAD {part_name} ({file_size:.1f} MB)", size=part_size)
+        st.markdown(f'''
+        <p style="color:#888888;font-size:11px;font-family:Courier;margin:5px 0 0 0;">
+            File {current_index + 1} of {len(zip_files)} - Use navigation buttons above to move between files
+        </p>
+        ''', unsafe_allow_html=True)
         
-        if os.path.exists(zip_path):
-            file_size = os.path.getsize(zip_path) / (1024 * 1024)
-            
-            # Only embed current file to avoid message size limit
-            with open(zip_path, "rb") as f:
-                bytes_data = f.read()
-                b64 = base64.b64encode(bytes_data).decode()
-                download_name = f"cyber_skulls_{part_name.lower().replace(' ', '_')}.zip"
-                
-                html_content += f'''
-                <div style="margin:15px 0; padding:15px; border:2px solid #00FF00; background-color:rgba(0,255,0,0.1);">
-                    <p style="color:#00FF00;font-family:Courier;font-size:14px;margin:0 0 10px 0;">📦 READY FOR DOWNLOAD:</p>
-                    <div style="margin:10px 0;">
-                        <a href="data:application/zip;base64,{b64}" download="{download_name}" style="text-decoration:none;">
-                            <button style="color:#00FF00;background-color:#111111;border:2px solid #00FF00;padding:12px 24px;font-family:'Courier New',monospace;cursor:pointer;font-size:14px;font-weight:bold;">
-                                ⬇ DOWNLOAD {part_name} ({file_size:.1f} MB)
-                            </button>
-                        </a>
-                    </div>
-                    <p style="color:#888888;font-size:11px;font-family:Courier;margin:5px 0 0 0;">
-                        File {current_index + 1} of {len(zip_files)} - Use navigation buttons above to move between files
-                    </p>
-                </div>
-                '''
-    
-    # File list overview (no navigation buttons needed here)
-    html_content += '<div style="margin:15px 0;"><p class="cyber-label">📋 ALL_FILES_OVERVIEW:</p>'
-    
-    for i, (zip_path, part_name) in enumerate(zip_files):
-        if os.path.exists(zip_path):
-            file_size = os.path.getsize(zip_path) / (1024 * 1024)
+        # File list overview (no navigation buttons needed here)
+        overview_html = '<div style="margin:15px 0;"><p class="cyber-label">📋 ALL_FILES_OVERVIEW:</p>'
+        for i, part in enumerate(zip_files):
+            file_size = part.size / (1024 * 1024)
             status = "📍 CURRENT" if i == current_index else "✅ READY" if i < current_index else "⏳ PENDING"
             
-            html_content += f'''
+            overview_html += f'''
             <div style="margin:3px 0; padding:5px; background-color:{'rgba(0,255,0,0.1)' if i == current_index else 'rgba(0,0,0,0.3)'};">
                 <span style="font-family:Courier;font-size:12px;color:{'#00FF00' if i == current_index else '#888888'};">
-                    {status} {part_name} ({file_size:.1f} MB)
+                    {status} {part.label} ({file_size:.1f} MB)
                 </span>
             </div>
             '''
-    
-    html_content += '</div>'
-    
-    # Instructions
-    html_content += '''
-    <div style="margin:15px 0; padding:10px; border:1px solid #00FF00; background-color:rgba(0,0,0,0.3);">
-        <p style="color:#00FF00;font-family:Courier;font-size:12px;margin:0;">💡 SEQUENTIAL DOWNLOAD SYSTEM:</p>
-        <p style="color:#888888;font-family:Courier;font-size:11px;margin:5px 0 0 0;">
-            1. Only one file is embedded at a time to avoid browser memory limits<br>
-            2. Click the green download button to download the current file<br>
-            3. Use the navigation buttons above to move between files<br>
-            4. This prevents the "MessageSizeError" that occurs with large collections
-        </p>
-    </div>
-    '''
-    
-    html_content += '</div>'
-    return html_content
+        overview_html += '</div>'
+        st.markdown(overview_html, unsafe_allow_html=True)
+        
+        # Instructions
+        st.markdown('''
+        <div style="margin:15px 0; padding:10px; border:1px solid #00FF00; background-color:rgba(0,0,0,0.3);">
+            <p style="color:#00FF00;font-family:Courier;font-size:12px;margin:0;">💡 SEQUENTIAL DOWNLOAD SYSTEM:</p>
+            <p style="color:#888888;font-family:Courier;font-size:11px;margin:5px 0 0 0;">
+                1. Files are streamed from the server, so large parts download (and resume) like any other file<br>
+                2. Click the green download button to download the current file<br>
+                3. Use the navigation buttons above to move between files
+            </p>
+        </div>
+        ''', unsafe_allow_html=True)
 
 # Keep the original function for backward compatibility
 def create_cloud_download_display(download_links):
     """Legacy function - redirects to enhanced display"""
     return create_enhanced_download_display(download_links)
 
+def builds_archives(download_mode):
+    """Return True for the modes downloaded by process_csv_data_in_batches into archive parts.
+    
+    Only cloud-to-cloud transfers upload files instead; every other mode,
+    the cloud storage modes included, goes through the worker pool.
+    """
+    return "Cloud-to-Cloud" not in download_mode
+
+# Job identity and pre-flight size planning
+def job_id_for(collections):
+    """Return the job id of a set of collections: a hash of their names and contents"""
+    job_hash = hashlib.sha256()
+    for collection in collections:
+        job_hash.update(collection.name.encode("utf-8"))
+        job_hash.update(collection.source.getvalue())
+    return job_hash.hexdigest()[:16]
+
+def probe_collections(collections, gateway_urls):
+    """Return the pre-flight ipfs_probe.SizePlan of a job, probed once per job and gateway list"""
+    if 'size_plans' not in st.session_state:
+        st.session_state.size_plans = {}
+    plan_key = (job_id_for(collections), tuple(gateway_urls))
+    if plan_key not in st.session_state.size_plans:
+        urls = (row.url for row in ipfs_csv.iter_collections(collections) if row.filename is not None)
+        st.session_state.size_plans[plan_key] = ipfs_probe.plan_collection(urls, gateway_urls)
+    return st.session_state.size_plans[plan_key]
+
 # Function to detect if running on Streamlit Cloud
 def is_running_on_streamlit_cloud():
     """Detect if the app is running on Streamlit Cloud"""
@@ -804,12 +1014,12 @@ def upload_to_temp_host(file_data, filename, log_callback=None):
         # Try file.io first (keeps files for 14 days, 100MB limit per file)
         if len(file_data) <= 100 * 1024 * 1024:  # 100MB limit
             try:
-                response = requests.post(
+                response = ipfs_retry.call(lambda: requests.post(
                     'https://file.io/',
                     files={'file': (filename, file_data)},
                     data={'expires': '14d'},  # Keep for 14 days
                     timeout=30
-                )
+                ), ipfs_retry.UPLOAD_POLICY, log_callback=log_callback, description=f"upload {filename} to file.io")
                 if response.status_code == 200:
                     result = response.json()
                     if result.get('success'):
@@ -819,11 +1029,11 @@ def upload_to_temp_host(file_data, filename, log_callback=None):
         
         # Fallback to 0x0.st (no size limit but temporary)
         try:
-            response = requests.post(
+            response = ipfs_retry.call(lambda: requests.post(
                 'https://0x0.st',
                 files={'file': (filename, file_data)},
                 timeout=30
-            )
+            ), ipfs_retry.UPLOAD_POLICY, log_callback=log_callback, description=f"upload {filename} to 0x0.st")
             if response.status_code == 200:
                 download_url = response.text.strip()
                 if download_url.startswith('https://'):
@@ -833,12 +1043,12 @@ def upload_to_temp_host(file_data, filename, log_callback=None):
             
         # Fallback to catbox.moe (good for images, permanent)
         try:
-            response = requests.post(
+            response = ipfs_retry.call(lambda: requests.post(
                 'https://catbox.moe/user/api.php',
                 data={'reqtype': 'fileupload'},
                 files={'fileToUpload': (filename, file_data)},
                 timeout=30
-            )
+            ), ipfs_retry.UPLOAD_POLICY, log_callback=log_callback, description=f"upload {filename} to catbox.moe")
             if response.status_code == 200:
                 download_url = response.text.strip()
                 if download_url.startswith('https://'):
@@ -888,7 +1098,9 @@ def upload_to_ipfs_service(file_data, filename, service_config, log_callback=Non
             
             data = {'pinataMetadata': json.dumps(metadata)}
             
-            response = requests.post(url, files=files, data=data, headers=headers, timeout=60)
+            response = ipfs_retry.call(
+                lambda: requests.post(url, files=files, data=data, headers=headers, timeout=60),
+                ipfs_retry.UPLOAD_POLICY, log_callback=log_callback, description=f"pin {filename} to Pinata")
             
             if response.status_code == 200:
                 result = response.json()
@@ -911,7 +1123,9 @@ def upload_to_ipfs_service(file_data, filename, service_config, log_callback=Non
                 'X-NAME': filename
             }
             
-            response = requests.post(url, data=file_data, headers=headers, timeout=60)
+            response = ipfs_retry.call(
+                lambda: requests.post(url, data=file_data, headers=headers, timeout=60),
+                ipfs_retry.UPLOAD_POLICY, log_callback=log_callback, description=f"upload {filename} to Web3.Storage")
             
             if response.status_code == 200:
                 result = response.json()
@@ -934,7 +1148,9 @@ def upload_to_ipfs_service(file_data, filename, service_config, log_callback=Non
             }
             
             files = {'file': (filename, file_data)}
-            response = requests.post(url, files=files, headers=headers, timeout=60)
+            response = ipfs_retry.call(
+                lambda: requests.post(url, files=files, headers=headers, timeout=60),
+                ipfs_retry.UPLOAD_POLICY, log_callback=log_callback, description=f"upload {filename} to NFT.Storage")
             
             if response.status_code == 200:
                 result = response.json()
@@ -1174,7 +1390,8 @@ def generate_google_oauth_url(client_id, client_secret):
         return None, None
 
 # Enhanced cloud-to-cloud processing with multiple storage options
-def process_csv_enhanced_cloud(df, gateway_url, storage_config, progress_callback=None, log_callback=None, is_cloud_env=False):
+def process_csv_enhanced_cloud(df, gateway_url, storage_config, progress_callback=None, log_callback=None, is_cloud_env=False,
+                               hedge=False):
     """Enhanced cloud processing with multiple storage options including IPFS and Google Drive"""
     try:
         # Check if required columns exist
@@ -1192,6 +1409,15 @@ def process_csv_enhanced_cloud(df, gateway_url, storage_config, progress_callbac
         arc19_metadata = []
         processed_count = 0
         
+        # ARC-19 collections: resolve template URLs from the reserve addresses
+        reserve = ipfs_arc19.reserve_column(df.columns)
+        if reserve:
+            df = df.assign(url=ipfs_csv.resolve_templates(df["url"].astype(str).str.strip(), df[reserve].fillna("")))
+        
+        # Plan every output filename in one pass, with collisions resolved
+        mime_types = df["metadata_mime_type"] if "metadata_mime_type" in df.columns else [""] * total_count
+        filenames = ipfs_plan.FilenamePlanner().plan(df["name"], df["unit-name"], mime_types, df["url"])
+        
         # Determine storage method
         storage_method = storage_config.get('method', 'temporary')
         
@@ -1211,37 +1437,21 @@ def process_csv_enhanced_cloud(df, gateway_url, storage_config, progress_callbac
             if log_callback:
                 log_callback(f"[IPFS] Starting individual file processing for optimal memory usage")
             
-            for index, row in df.iterrows():
+            for position, (index, row) in enumerate(df.iterrows()):
                 processed_count += 1
                 
                 # Update progress
                 if progress_callback:
                     progress_callback(processed_count / total_count)
                 
-                name = row["name"].strip() if isinstance(row["name"], str) else str(row["name"])
-                unit_name = row["unit-name"].strip() if isinstance(row["unit-name"], str) else str(row["unit-name"])
-                url = row["url"].strip() if isinstance(row["url"], str) else str(row["url"])
+                url = str(row["url"]).strip()
+                filename = filenames[position]
                 
-                if not url or not name or not unit_name:
+                if filename is None:
                     if log_callback:
                         log_callback(f"[SKIP] Missing data for item {processed_count}")
                     continue
                 
-                # Create filename
-                safe_name = f"{name}_{unit_name}".replace("/", "_").replace("\\", "_")
-                safe_name = "".join(c for c in safe_name if c.isalnum() or c in "._- ")
-                
-                # Determine file extension
-                mime_type = row.get("metadata_mime_type", "")
-                extension = ".png"  # Default
-                if mime_type and isinstance(mime_type, str):
-                    if "jpeg" in mime_type or "jpg" in mime_type:
-                        extension = ".jpg"
-                    elif "gif" in mime_type:
-                        extension = ".gif"
-                
-                filename = f"{safe_name}{extension}"
-                
                 if log_callback:
                     log_callback(f"[{processed_count}/{total_count}] Processing: {filename}")
                 
@@ -1249,9 +1459,11 @@ def process_csv_enhanced_cloud(df, gateway_url, storage_config, progress_callbac
                 if log_callback:
                     log_callback(f"[DOWNLOAD] Retrieving from original IPFS: {filename}")
                 
-                file_data = download_image_to_memory(url, gateway_url, log_callback, is_cloud_env)
+                file_data, file_type = download_image_to_memory(url, gateway_url, log_callback, is_cloud_env, hedge)
                 
                 if file_data:
+                    # Name the file after the detected content type
+                    filename = ipfs_sniff.with_extension(filename, file_type.extension)
                     file_size_mb = len(file_data) / (1024 * 1024)
                     if log_callback:
                         log_callback(f"[DOWNLOAD] Retrieved {filename} ({file_size_mb:.1f} MB)")
@@ -1316,42 +1528,28 @@ def process_csv_enhanced_cloud(df, gateway_url, storage_config, progress_callbac
         # Non-IPFS processing: original logic for other storage methods
         else:
             # Process each item for temporary hosting or Google Drive
-            for index, row in df.iterrows():
+            for position, (index, row) in enumerate(df.iterrows()):
                 processed_count += 1
                 
                 # Update progress
                 if progress_callback:
                     progress_callback(processed_count / total_count)
                 
-                name = row["name"].strip() if isinstance(row["name"], str) else str(row["name"])
-                unit_name = row["unit-name"].strip() if isinstance(row["unit-name"], str) else str(row["unit-name"])
-                url = row["url"].strip() if isinstance(row["url"], str) else str(row["url"])
+                url = str(row["url"]).strip()
+                filename = filenames[position]
                 
-                if not url or not name or not unit_name:
+                if filename is None:
                     continue
                 
-                # Create filename
-                safe_name = f"{name}_{unit_name}".replace("/", "_").replace("\\", "_")
-                safe_name = "".join(c for c in safe_name if c.isalnum() or c in "._- ")
-                
-                # Determine file extension
-                mime_type = row.get("metadata_mime_type", "")
-                extension = ".png"  # Default
-                if mime_type and isinstance(mime_type, str):
-                    if "jpeg" in mime_type or "jpg" in mime_type:
-                        extension = ".jpg"
-                    elif "gif" in mime_type:
-                        extension = ".gif"
-                
-                filename = f"{safe_name}{extension}"
-                
                 if log_callback:
                     log_callback(f"[{processed_count}/{total_count}] Processing: {filename}")
                 
                 # Download from IPFS
-                file_data = download_image_to_memory(url, gateway_url, log_callback, is_cloud_env)
+                file_data, file_type = download_image_to_memory(url, gateway_url, log_callback, is_cloud_env, hedge)
                 
                 if file_data:
+                    # Name the file after the detected content type
+                    filename = ipfs_sniff.with_extension(filename, file_type.extension)
                     download_url = None
                     service_name = None
                     
@@ -1573,10 +1771,8 @@ def main():
         
         with col1:
             st.markdown('<p class="cyber-label">> DESKTOP_APPLICATION:</p>', unsafe_allow_html=True)
-            # Create local download link
-            local_download_link = create_local_download_link()
-            if local_download_link:
-                st.markdown(local_download_link, unsafe_allow_html=True)
+            # Show local download button
+            if show_local_download():
                 st.markdown('<p style="color:#888888;font-size:10px;font-family:Courier;">No size limits • Faster downloads</p>', unsafe_allow_html=True)
             else:
                 st.markdown('<p style="color:#FF0000;">LOCAL VERSION UNAVAILABLE</p>', unsafe_allow_html=True)
@@ -1623,53 +1819,95 @@ def main():
     
     st.markdown('<p style="color:#888888;font-size:11px;font-family:Courier;margin-top:5px;">Download your collection data from wen.tools before uploading here</p>', unsafe_allow_html=True)
     
-    # IPFS Gateway setting
-    st.markdown('<p class="cyber-label">> IPFS_GATEWAY:</p>', unsafe_allow_html=True)
-    gateway_url = st.text_input("IPFS Gateway URL", value="https://ipfs.io/ipfs/", 
-                               label_visibility="collapsed")
-    if not gateway_url.endswith('/'):
-        gateway_url += '/'
+    # IPFS Gateway setting (one or more, routed by health score)
+    st.markdown('<p class="cyber-label">> IPFS_GATEWAYS:</p>', unsafe_allow_html=True)
+    gateway_text = st.text_area("IPFS Gateway URLs", value=ipfs_gateways.DEFAULT_GATEWAY, height=80,
+                                help="One gateway per line (or comma-separated). Requests go to the healthiest gateway first.",
+                                label_visibility="collapsed")
+    gateway_urls = ipfs_gateways.parse_gateway_list(gateway_text)
+    hedge_requests = False
+    if len(gateway_urls) > 1:
+        hedge_requests = st.checkbox("⚡ Hedge slow requests", value=True,
+                                     help="Fire a backup request at the next gateway when the first one is slow")
     
-    # CSV file upload
-    st.markdown('<p class="cyber-label">> SELECT_CSV_FILE:</p>', unsafe_allow_html=True)
-    uploaded_file = st.file_uploader("Upload CSV File", type=["csv"], label_visibility="collapsed")
+    # CSV file upload; several collections (or zips of CSVs) run as one job
+    st.markdown('<p class="cyber-label">> SELECT_CSV_FILES:</p>', unsafe_allow_html=True)
+    uploaded_files = st.file_uploader("Upload CSV Files", type=["csv", "zip"], accept_multiple_files=True,
+                                      help="One or more collection CSVs, or zips of CSVs. All collections download together.",
+                                      label_visibility="collapsed")
+    collections = []
+    collection_rows = {}
     
     # Preview CSV and estimate size
-    if uploaded_file is not None:
+    if uploaded_files:
         try:
-            # Read CSV for preview
-            csv_data = uploaded_file.getvalue().decode('utf-8')
-            df_preview = pd.read_csv(StringIO(csv_data))
+            collections = ipfs_csv.collections_from_uploads(uploaded_files)
+            if not collections:
+                raise ValueError("no CSV files found in the upload")
+            
+            # Count rows and read a few for the preview without parsing the whole CSVs
+            collection_rows = {collection.name: ipfs_csv.count_rows(collection.source) for collection in collections}
+            total_rows = sum(collection_rows.values())
             
             # Show basic stats
             st.markdown('<div class="cyber-box">', unsafe_allow_html=True)
             st.markdown('<h3 class="cyber-header">■ COLLECTION_ANALYSIS</h3>', unsafe_allow_html=True)
             
+            # Probe real sizes, types and availability before anything is downloaded
+            size_plan = None
+            try:
+                with st.spinner("PROBING_COLLECTION_SIZES..."):
+                    size_plan = probe_collections(collections, gateway_urls)
+            except Exception as e:
+                st.warning(f"⚠️ Size probe failed ({str(e)}), falling back to a rough estimate")
+            
+            if size_plan and size_plan.sized_count:
+                estimated_size = size_plan.archive_high_bytes / (1024 * 1024)
+                estimated_zips = size_plan.part_count(ZIP_PART_MB * 1024 * 1024)
+            else:
+                estimated_size = total_rows * DEFAULT_ITEM_SIZE_MB
+                estimated_zips = max(1, math.ceil(estimated_size / ZIP_PART_MB))
+            # Every collection gets at least one ZIP of its own
+            estimated_zips = max(len(collections), estimated_zips)
+            
             col1, col2, col3 = st.columns([1, 1, 1])
             with col1:
-                st.markdown(f'<p class="cyber-label">TOTAL_ITEMS: {len(df_preview)}</p>', unsafe_allow_html=True)
+                st.markdown(f'<p class="cyber-label">TOTAL_ITEMS: {total_rows}</p>', unsafe_allow_html=True)
+                if len(collections) > 1:
+                    st.markdown(f'<p class="cyber-label">COLLECTIONS: {len(collections)}</p>', unsafe_allow_html=True)
             with col2:
-                # Estimate average file size (typical NFT images are 200KB-2MB)
-                avg_size_mb = 0.8  # Conservative estimate: 800KB average
-                estimated_size = len(df_preview) * avg_size_mb
                 st.markdown(f'<p class="cyber-label">ESTIMATED_SIZE: ~{estimated_size:.0f}MB</p>', unsafe_allow_html=True)
             with col3:
-                estimated_zips = max(1, int(estimated_size / 80) + (1 if estimated_size % 80 > 0 else 0))
                 st.markdown(f'<p class="cyber-label">ESTIMATED_ZIPS: {estimated_zips}</p>', unsafe_allow_html=True)
+            if size_plan and size_plan.probed_count:
+                for line in size_plan.format_summary():
+                    st.markdown(f'<p style="color:#888888;font-size:11px;font-family:Courier;margin:0;">{line}</p>', unsafe_allow_html=True)
             
             # Size warnings
             if is_cloud:
-                if estimated_size > 800:
-                    st.error(f"🚨 **Collection Too Large:** {estimated_size:.0f}MB estimated size exceeds cloud limit (~800MB). Consider using the local desktop version.")
+                fits = (size_plan.fits_in_memory(CLOUD_MEMORY_LIMIT_MB * 1024 * 1024) if size_plan and size_plan.sized_count
+                        else estimated_size <= CLOUD_MEMORY_LIMIT_MB)
+                if not fits:
+                    st.warning(f"⚠️ **Very Large Collection:** {estimated_size:.0f}MB estimated, more than the cloud can hold in memory (~{CLOUD_MEMORY_LIMIT_MB}MB). Files will be buffered on disk; the local desktop version is faster for collections this size.")
                 elif estimated_size > 400:
                     st.warning(f"⚠️ **Large Collection:** {estimated_size:.0f}MB estimated. May cause timeouts or memory issues on cloud.")
                 elif estimated_size > 200:
                     st.info(f"ℹ️ **Medium Collection:** {estimated_size:.0f}MB estimated. Should process fine but may take time.")
             
+            # Per-collection item counts for multi-collection jobs
+            if len(collections) > 1:
+                st.dataframe(pd.DataFrame({"collection": list(collection_rows),
+                                           "items": list(collection_rows.values())}),
+                             use_container_width=True, hide_index=True)
+            
             # Show preview of first few rows
             if st.checkbox("👁️ PREVIEW_DATA", help="Show first 5 rows of your CSV"):
                 st.markdown('<p class="cyber-label">CSV_PREVIEW:</p>', unsafe_allow_html=True)
-                preview_df = df_preview.head().copy()
+                preview_collection = collections[0]
+                if len(collections) > 1:
+                    preview_name = st.selectbox("Collection", list(collection_rows), label_visibility="collapsed")
+                    preview_collection = next(c for c in collections if c.name == preview_name)
+                preview_df = ipfs_csv.read_preview(preview_collection.source)
                 # Truncate long URLs for display
                 if 'url' in preview_df.columns:
                     preview_df['url'] = preview_df['url'].apply(lambda x: str(x)[:50] + '...' if len(str(x)) > 50 else str(x))
@@ -1679,7 +1917,7 @@ def main():
             
         except Exception as e:
             st.error(f"Error reading CSV file: {str(e)}")
-            uploaded_file = None
+            collections = []
     
     # Download mode selection
     st.markdown('<p class="cyber-label">> SELECT_DOWNLOAD_MODE:</p>', unsafe_allow_html=True)
@@ -1931,6 +2169,26 @@ def main():
     else:
         batch_size = 1000  # Large batch for standard processing
     
+    # Parallel downloads and archive format, for every mode that builds archives
+    max_workers = DEFAULT_MAX_WORKERS
+    if builds_archives(download_mode):
+        st.markdown('<p class="cyber-label">> PARALLEL_DOWNLOADS:</p>', unsafe_allow_html=True)
+        max_parallel = CLOUD_MAX_WORKERS if is_cloud else 32
+        max_workers = st.slider("Parallel Downloads", min_value=1, max_value=max_parallel,
+                                value=min(DEFAULT_MAX_WORKERS, max_parallel), step=1,
+                                help="Number of images downloaded at the same time",
+                                label_visibility="collapsed")
+    
+    archive_format = ipfs_archive.ZIP
+    if builds_archives(download_mode):
+        st.markdown('<p class="cyber-label">> ARCHIVE_FORMAT:</p>', unsafe_allow_html=True)
+        format_labels = {ipfs_archive.ZIP: "ZIP", ipfs_archive.TAR_ZSTD: "TAR + ZSTD", ipfs_archive.TAR: "TAR"}
+        formats = [f for f in ipfs_archive.FORMATS if f != ipfs_archive.TAR_ZSTD or ipfs_archive.ZSTD_AVAILABLE]
+        archive_format = st.radio("Archive Format", formats, format_func=format_labels.get, horizontal=True,
+                                  help="ZIP opens everywhere. TAR + ZSTD packs JSON and SVG heavy collections "
+                                       "much faster at a similar size (needs zstandard; open with 7-Zip or tar).",
+                                  label_visibility="collapsed")
+    
     # Initialize log list in session state if it doesn't exist
     if 'logs' not in st.session_state:
         st.session_state.logs = []
@@ -1967,6 +2225,7 @@ def main():
     progress_bar = st.progress(0)
     status_text = st.empty()
     status_text.markdown('<p class="cyber-label">SYSTEM_READY</p>', unsafe_allow_html=True)
+    collection_progress_area = st.empty()
     
     # Download button
     download_button = st.button("▶ INITIALIZE_DOWNLOAD")
@@ -2004,8 +2263,7 @@ def main():
     # Display download interface
     if st.session_state.download_complete:
         if st.session_state.zip_files:
-            download_html = create_multiple_download_buttons(st.session_state.zip_files)
-            download_link_placeholder.markdown(download_html, unsafe_allow_html=True)
+            show_multiple_download_buttons(download_link_placeholder, st.session_state.zip_files)
         elif st.session_state.cloud_links:
             download_html = create_enhanced_download_display(st.session_state.cloud_links, st.session_state.arc19_metadata)
             download_link_placeholder.markdown(download_html, unsafe_allow_html=True)
@@ -2026,25 +2284,38 @@ def main():
             st.session_state.cloud_links = []
             st.session_state.arc19_metadata = []
             
-            # Read CSV data
-            csv_data = uploaded_file.getvalue().decode('utf-8')
-            df = pd.read_csv(StringIO(csv_data))
-            
-            # Set up the output directory based on download mode
-            temp_dir = tempfile.mkdtemp()
-            output_dir = temp_dir
+            # Set up the output directory based on download mode; the same CSVs
+            # always map to the same job directory so interrupted runs resume
+            job_id = job_id_for(collections)
+            output_dir = os.path.join(JOB_ROOT_DIR, job_id)
+            ipfs_serve.prune(JOB_MAX_AGE, root=JOB_ROOT_DIR)
             add_log(f"[SYSTEM] Processing files in memory for download")
             
             # Log start of process
             add_log("[SYSTEM] Initializing download sequence...")
-            total_items = len(df)
-            add_log(f"[SYSTEM] Found {total_items} items to process")
+            total_items = sum(collection_rows.values())
+            if len(collections) > 1:
+                add_log(f"[SYSTEM] Found {total_items} items to process in {len(collections)} collections")
+            else:
+                add_log(f"[SYSTEM] Found {total_items} items to process")
             
-            # Early size check and warning
-            estimated_size = total_items * 0.8  # 800KB average estimate
-            if is_cloud and estimated_size > 800:
-                add_log(f"[WARNING] Estimated size ({estimated_size:.0f}MB) may exceed cloud limits")
-                add_log(f"[WARNING] Processing anyway but may fail due to memory constraints")
+            # Early size check and warning, from the pre-flight probe when available
+            try:
+                size_plan = probe_collections(collections, gateway_urls)
+            except Exception as e:
+                size_plan = None
+                add_log(f"[PROBE] Size probe failed: {str(e)}")
+            if size_plan and size_plan.probed_count:
+                for line in size_plan.format_summary():
+                    add_log(f"[PROBE] {line}")
+            if size_plan and size_plan.sized_count:
+                estimated_size = size_plan.archive_high_bytes / (1024 * 1024)
+            else:
+                estimated_size = total_items * DEFAULT_ITEM_SIZE_MB
+            if is_cloud and estimated_size > CLOUD_MEMORY_LIMIT_MB:
+                # Only BUFFER_MEMORY_MB in total stays in memory; the rest goes through disk
+                add_log(f"[SPILL] Estimated size ({estimated_size:.0f}MB) exceeds the {CLOUD_MEMORY_LIMIT_MB}MB "
+                        f"memory limit; downloads beyond {BUFFER_MEMORY_MB}MB in flight are buffered on disk")
             
             # Update status
             status_text.markdown('<p class="cyber-label">DOWNLOADING_IMAGES...</p>', unsafe_allow_html=True)
@@ -2054,16 +2325,21 @@ def main():
                 progress_bar.progress(progress_value)
             
             # Choose processing method based on download mode
-            if "Cloud-to-Cloud" in download_mode:
+            if not builds_archives(download_mode):
                 # Cloud-to-cloud processing - no memory limitations
                 add_log("[CLOUD2CLOUD] Starting cloud-to-cloud transfer mode")
                 add_log("[CLOUD2CLOUD] Files will be uploaded to temporary hosting services")
                 
+                # ARC-19 metadata needs every column, so this mode reads the full CSVs
+                df = pd.concat([pd.read_csv(io.BytesIO(collection.source.getvalue())) for collection in collections],
+                               ignore_index=True)
+                
                 success_count, fail_count, download_links, arc19_metadata = process_csv_enhanced_cloud(
-                    df, gateway_url, storage_config,
+                    df, gateway_urls, storage_config,
                     progress_callback=update_progress,
                     log_callback=add_log,
-                    is_cloud_env=is_cloud
+                    is_cloud_env=is_cloud,
+                    hedge=hedge_requests
                 )
                 
                 if download_links:
@@ -2093,6 +2369,11 @@ def main():
                     
                     for service, count in services.items():
                         add_log(f"[REPORT] {service}: {count} files")
+                    for line in ipfs_http.format_pool_stats():
+                        add_log(f"[POOL] {line}")
+                    for line in ipfs_gateways.default_router.format_stats():
+                        add_log(f"[ROUTER] {line}")
+                    add_log(f"[RETRY] {ipfs_retry.default_budget.format_stats()}")
                     
                     st.session_state.download_complete = True
                     return
@@ -2103,65 +2384,123 @@ def main():
             
             else:
                 # Memory processing modes (existing ZIP-based approach)
-                # Process CSV and download images to memory
-                success_count, fail_count, downloaded_files, file_data_list = process_csv_data_in_batches(
-                    df, output_dir, gateway_url, 
-                    batch_size=batch_size if "Small Batches" in download_mode else total_items,
-                    progress_callback=update_progress,
-                    log_callback=add_log,
-                    is_cloud_env=is_cloud
-                )
+                # Collections missing required columns are skipped; the rest run together
+                runnable = []
+                for collection in collections:
+                    missing = ipfs_csv.missing_columns(collection.source)
+                    if missing:
+                        add_log(f"[ERROR] {collection.name} is missing required columns: {', '.join(missing)}")
+                    else:
+                        runnable.append(collection)
+                if not runnable:
+                    status_text.markdown('<p class="cyber-label">DOWNLOAD_FAILED</p>', unsafe_allow_html=True)
+                    return
+                total_items = sum(collection_rows[collection.name] for collection in runnable)
+                multi_collection = len(runnable) > 1
+                if multi_collection:
+                    add_log(f"[JOB] Downloading {len(runnable)} collections together with {max_workers} shared parallel downloads")
+                
+                # Per-collection progress bars, updated from this thread only
+                collection_counts = {}
+                collection_widgets = {}
+                if multi_collection:
+                    with collection_progress_area.container():
+                        for collection in runnable:
+                            collection_widgets[collection.name] = (st.empty(), st.progress(0))
+                
+                def update_collection_progress(collection, processed, succeeded, failed):
+                    collection_counts[collection] = (succeeded, failed)
+                    if collection in collection_widgets:
+                        label, bar = collection_widgets[collection]
+                        total = max(1, collection_rows[collection])
+                        bar.progress(min(1.0, processed / total))
+                        label.markdown(f'<p class="cyber-label">{collection}: {processed}/{total} '
+                                       f'(OK {succeeded}, FAILED {failed})</p>', unsafe_allow_html=True)
                 
-                if not file_data_list:
+                # Stream only the download columns, recording progress per row
+                manifest = ipfs_manifest.DownloadManifest.for_directory(output_dir)
+                previous = manifest.counts().get("done", 0)
+                if previous:
+                    add_log(f"[RESUME] Job {job_id} has {previous} completed items from an earlier run")
+                # Each collection streams into its own ZIP part(s) while downloading,
+                # written where the web server can stream them to the browser, or
+                # into a private temp folder of this run when it cannot
+                archive_dir = ipfs_serve.job_directory(
+                    job_id, root=ipfs_serve.DOWNLOADS_DIR if static_serving_enabled() else ipfs_serve.FALLBACK_DIR)
+                # One budget for every collection's sink and the repeated-CID buffer
+                memory_budget = ipfs_spill.MemoryBudget(BUFFER_MEMORY_MB * 1024 * 1024)
+                def open_archive(collection):
+                    if multi_collection:
+                        return ipfs_archive.open_sink(archive_format, f"cyber_skulls_{collection}", collection,
+                                                      ZIP_PART_MB * 1024 * 1024, archive_dir, add_log,
+                                                      memory_budget)
+                    return ipfs_archive.open_sink(archive_format, "cyber_skulls_collection", None,
+                                                  ZIP_PART_MB * 1024 * 1024, archive_dir, add_log,
+                                                  memory_budget)
+                
+                try:
+                    success_count, fail_count, downloaded_files, archives = process_csv_data_in_batches(
+                        ipfs_csv.iter_collections(runnable), total_items, output_dir, gateway_urls, 
+                        batch_size=batch_size if "Small Batches" in download_mode else total_items,
+                        progress_callback=update_progress,
+                        log_callback=add_log,
+                        is_cloud_env=is_cloud,
+                        max_workers=max_workers,
+                        hedge=hedge_requests,
+                        manifest=manifest,
+                        collection_progress_callback=update_collection_progress,
+                        open_archive=open_archive,
+                        expected_sizes=size_plan.sizes if size_plan else None,
+                        memory_budget=memory_budget
+                    )
+                finally:
+                    manifest.close()
+                
+                # Finish the last ZIP part of each collection; a sink that is empty,
+                # or left over when another one fails to close, is aborted so its
+                # writer threads and temp files are released
+                zip_files = []
+                closed = set()
+                try:
+                    for collection in runnable:
+                        sink = archives.get(collection.name)
+                        if sink is None or not sink.entry_count:
+                            add_log(f"[WARNING] {collection.name}: no files downloaded, no ZIP created")
+                            continue
+                        zip_files.extend(sink.close())
+                        closed.add(collection.name)
+                finally:
+                    for name, sink in archives.items():
+                        if name not in closed:
+                            sink.abort()
+                
+                if not zip_files:
                     add_log("[ERROR] No files were successfully downloaded")
                     status_text.markdown('<p class="cyber-label">DOWNLOAD_FAILED</p>', unsafe_allow_html=True)
                     return
                 
-                # Calculate total size and memory check
-                total_size = sum(len(data) for _, data in file_data_list)
-                total_size_mb = total_size / (1024 * 1024)
-                add_log(f"[SIZE_CHECK] Total downloaded files: {total_size_mb:.1f} MB")
+                total_size_mb = sum(sink.total_bytes for sink in archives.values()) / (1024 * 1024)
+                spilled = [sink.buffer for sink in archives.values() if sink.buffer.spilled_count]
+                if spilled:
+                    add_log(f"[SPILL] {sum(b.spilled_count for b in spilled)} files waiting to be archived were "
+                            f"buffered on disk ({sum(b.spilled_bytes for b in spilled) / (1024 * 1024):.1f} MB) "
+                            f"to stay within {BUFFER_MEMORY_MB}MB of memory")
+                add_log(f"[SIZE_CHECK] Total downloaded files: {total_size_mb:.1f} MB, "
+                        f"written to {archive_format.upper()} parts as they arrived")
+                st.session_state.zip_files = zip_files
                 
-                # Memory warning for cloud
-                if is_cloud and total_size_mb > 600:
-                    add_log(f"[MEMORY_WARNING] Large dataset in memory ({total_size_mb:.1f}MB)")
-                    add_log(f"[MEMORY_WARNING] ZIP creation may fail due to memory limits")
+                add_log(f"[SUCCESS] Created {len(zip_files)} {archive_format.upper()} files with {success_count} images total")
                 
-                # Determine how to package the files
-                if total_size_mb <= 50:
-                    # Single ZIP file
-                    add_log(f"[ZIP] Creating single ZIP file ({total_size_mb:.1f} MB)")
-                    zip_path = create_zip_from_data(file_data_list, "cyber_skulls_collection.zip")
-                    if zip_path:
-                        st.session_state.zip_files = [(zip_path, "Complete Collection")]
-                        add_log(f"[SUCCESS] Created ZIP file with {success_count} images")
-                    else:
-                        add_log(f"[ERROR] Failed to create ZIP file - possibly too large for memory")
-                        status_text.markdown('<p class="cyber-label">ZIP_CREATION_FAILED</p>', unsafe_allow_html=True)
-                        return
+                # Everything is in the archives now; only a job with failed rows keeps
+                # its downloads and manifest, so a rerun retries just those rows
+                if fail_count:
+                    add_log(f"[RESUME] Kept job {job_id} so a rerun only retries the {fail_count} failed items")
                 else:
-                    # Multiple ZIP files
-                    add_log(f"[ZIP] Collection too large for single download, creating multiple ZIP files")
-                    
-                    # Clear some memory before creating ZIPs
-                    import gc
-                    gc.collect()
-                    
-                    zip_files = create_multiple_zips(file_data_list, max_size_mb=50, log_callback=add_log)
-                    st.session_state.zip_files = zip_files
-                    
-                    if zip_files:
-                        add_log(f"[SUCCESS] Created {len(zip_files)} ZIP files with {success_count} images total")
-                    else:
-                        add_log(f"[ERROR] Failed to create any ZIP files - likely memory exhaustion")
-                        add_log(f"[SUGGESTION] Try using Cloud-to-Cloud mode or the local desktop version")
-                        status_text.markdown('<p class="cyber-label">MEMORY_EXHAUSTED</p>', unsafe_allow_html=True)
-                        return
+                    shutil.rmtree(output_dir, ignore_errors=True)
                 
                 # Display download buttons
                 if st.session_state.zip_files:
-                    download_html = create_multiple_download_buttons(st.session_state.zip_files)
-                    download_link_placeholder.markdown(download_html, unsafe_allow_html=True)
+                    show_multiple_download_buttons(download_link_placeholder, st.session_state.zip_files)
                 
                 # Complete the progress
                 progress_bar.progress(1.0)
@@ -2171,9 +2510,18 @@ def main():
                 add_log("\n[REPORT] Download Summary:")
                 add_log(f"[REPORT] Images successfully downloaded: {success_count}")
                 add_log(f"[REPORT] Images failed to download: {fail_count}")
+                if multi_collection:
+                    for collection in runnable:
+                        succeeded, failed = collection_counts.get(collection.name, (0, 0))
+                        add_log(f"[REPORT] {collection.name}: {succeeded} downloaded, {failed} failed")
                 if st.session_state.zip_files:
-                    add_log(f"[REPORT] ZIP files created: {len(st.session_state.zip_files)}")
+                    add_log(f"[REPORT] {archive_format.upper()} files created: {len(st.session_state.zip_files)}")
                     add_log(f"[REPORT] Click the download buttons above to get your files")
+                for line in ipfs_http.format_pool_stats():
+                    add_log(f"[POOL] {line}")
+                for line in ipfs_gateways.default_router.format_stats():
+                    add_log(f"[ROUTER] {line}")
+                add_log(f"[RETRY] {ipfs_retry.default_budget.format_stats()}")
                 
                 # Set download complete
                 st.session_state.download_complete = True
@@ -2188,7 +2536,7 @@ def main():
     
     # Handle download button click
     if download_button:
-        if uploaded_file is None:
+        if not collections:
             status_text.markdown('<p class="cyber-label">ERROR: NO_CSV_FILE_SELECTED</p>', unsafe_allow_html=True)
             add_log("[ERROR] Please select a CSV file")
         else:
@@ -0,0 +1,121 @@
+"""Local resolution of ARC-19 template-ipfs URLs.
+
+ARC-19 assets keep a fixed URL template such as
+template-ipfs://{ipfscid:1:raw:reserve:sha2-256} and point it at new
+content by changing the asset's reserve address: the 32-byte public key
+inside the Algorand address is the sha2-256 digest of the content. The
+CID is rebuilt from the address alone, so collections are resolved
+without any lookups against an indexer or other external service.
+"""
+import base64
+import functools
+import hashlib
+import re
+from collections import namedtuple
+
+import ipfs_cid
+
+TEMPLATE_SCHEME = "template-ipfs://"
+
+# CSV columns that may hold the asset reserve address, in order of preference
+RESERVE_COLUMNS = ("reserve", "reserve_address", "reserve-address", "asset_reserve", "params_reserve")
+
+ADDRESS_LENGTH = 58  # base32 of a 32-byte public key plus a 4-byte checksum
+PUBLIC_KEY_LENGTH = 32
+CHECKSUM_LENGTH = 4
+
+# Multicodecs and hashes ARC-19 templates may name
+CODECS = {"raw": 0x55, "dag-pb": ipfs_cid.DAG_PB}
+HASHES = {"sha2-256": ipfs_cid.SHA2_256}
+
+_TEMPLATE_RE = re.compile(
+    r"template-ipfs://\{ipfscid:(?P<version>[01]):(?P<codec>[a-z0-9-]+):(?P<field>[a-z0-9_-]+)"
+    r":(?P<hash_type>[a-z0-9-]+)\}(?P<suffix>.*)", re.IGNORECASE | re.DOTALL)
+
+# Address checksums need SHA-512/256, which some OpenSSL builds lack
+try:
+    hashlib.new("sha512_256")
+    _CHECKSUMS_AVAILABLE = True
+except ValueError:
+    _CHECKSUMS_AVAILABLE = False
+
+Template = namedtuple("Template", ["version", "codec", "field", "hash_type", "suffix"])
+
+
+@functools.lru_cache(maxsize=256)
+def parse_template(url):
+    """Return the Template of a template-ipfs URL, or None if url is not one"""
+    if not isinstance(url, str):
+        return None
+    match = _TEMPLATE_RE.fullmatch(url.strip())
+    if match is None:
+        return None
+    return Template(int(match["version"]), match["codec"].lower(), match["field"].lower(),
+                    match["hash_type"].lower(), match["suffix"])
+
+
+def is_template_url(url):
+    """Return True if url is a template-ipfs URL"""
+    return isinstance(url, str) and url.strip().lower().startswith(TEMPLATE_SCHEME)
+
+
+def address_public_key(address):
+    """Return the 32-byte public key of an Algorand address; raises ValueError if invalid"""
+    address = address.strip().upper()
+    if len(address) != ADDRESS_LENGTH:
+        raise ValueError(f"Algorand addresses are {ADDRESS_LENGTH} characters long")
+    try:
+        data = base64.b32decode(address + "=" * (-len(address) % 8))
+    except ValueError as e:
+        raise ValueError(f"invalid Algorand address: {e}") from None
+    public_key, checksum = data[:PUBLIC_KEY_LENGTH], data[PUBLIC_KEY_LENGTH:]
+    if _CHECKSUMS_AVAILABLE and hashlib.new("sha512_256", public_key).digest()[-CHECKSUM_LENGTH:] != checksum:
+        raise ValueError("Algorand address checksum mismatch")
+    return public_key
+
+
+def template_cid(template, address):
+    """Return the CID a template names for a reserve address; raises ValueError if unsupported"""
+    codec = CODECS.get(template.codec)
+    hash_code = HASHES.get(template.hash_type)
+    if template.field != "reserve" or codec is None or hash_code is None:
+        raise ValueError(f"unsupported ARC-19 template {template}")
+    public_key = address_public_key(address)
+    cid = ipfs_cid.Cid(template.version, codec, bytes([hash_code, len(public_key)]) + public_key)
+    if template.version == 0:
+        return ipfs_cid.encode_cidv0(cid)
+    return ipfs_cid.encode_cidv1(cid)
+
+
+def reserve_column(columns):
+    """Return the name of the reserve address column among columns, or None"""
+    by_name = {str(column).strip().lower(): column for column in columns}
+    for candidate in RESERVE_COLUMNS:
+        if candidate in by_name:
+            return by_name[candidate]
+    return None
+
+
+def resolve_url(url, reserve):
+    """Return the ipfs:// URL a template-ipfs URL resolves to with reserve.
+
+    Anything else, and templates that cannot be resolved (no or an invalid
+    reserve address, unsupported template), is returned unchanged.
+    """
+    template = parse_template(url)
+    if template is None or not isinstance(reserve, str) or not reserve.strip():
+        return url
+    try:
+        return f"ipfs://{template_cid(template, reserve)}{template.suffix}"
+    except ValueError:
+        return url
+
+
+def resolve_urls(urls, reserves):
+    """Resolve a whole column of URLs against a column of reserve addresses in one pass.
+
+    A collection shares one template, so each distinct template is parsed
+    once; rows that are not template-ipfs URLs are passed through untouched.
+    """
+    return [resolve_url(url, reserve) if is_template_url(url) else url
+            for url, reserve in zip(urls, reserves)]
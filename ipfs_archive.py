@@ -0,0 +1,414 @@
+"""Streaming archives (ZIP, or tar optionally compressed with zstd) for downloaded collections.
+
+Files are handed to an archive part the moment they are downloaded, and
+their bytes are dropped as soon as they are written, so building an
+archive never needs the whole collection in memory. Parts are packed as
+entries arrive: each entry goes into the first of up to open_parts open
+parts with room for it, and only when none has room is the fullest one
+finished, so a large file no longer closes a half-empty part and mixed
+image and animation sizes fill fewer parts. Fed largest first, this is
+first-fit-decreasing. Every part is written by a thread of its own, so
+parts compress concurrently; zlib and zstd release the GIL, so
+compression scales with cores.
+
+Images and video are already compressed, so DEFLATE costs CPU without
+shrinking them; compression_for() stores them as they are and only
+deflates text formats, or unknown files whose sample does compress.
+Tar parts are written strictly front to back with no central directory,
+so a TarStream can also go to a pipe; with zstd, metadata-heavy
+collections (JSON, SVG) pack much faster than with DEFLATE at a similar
+ratio. zstd needs the optional zstandard package.
+"""
+import io
+import os
+import queue
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import ipfs_spill
+
+# Optional zstd compression of tar archives
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+DEFAULT_PART_BYTES = 50 * 1024 * 1024
+DEFAULT_WRITERS = max(1, min(4, os.cpu_count() or 1))  # Parts written at the same time
+DEFAULT_OPEN_PARTS = 4  # Parts accepting entries at the same time
+MAX_PENDING_ENTRIES = 32  # Entries handed over but not yet written, across all parts of a sink
+DEFAULT_MEMORY_BUDGET = 64 * 1024 * 1024  # Bytes of pending entries kept in memory; the rest spill to disk
+
+# Archive formats
+ZIP = "zip"
+TAR = "tar"
+TAR_ZSTD = "tar.zst"
+FORMATS = (ZIP, TAR_ZSTD, TAR)
+DEFAULT_ZSTD_LEVEL = 3
+
+# Compression policies
+AUTO = "auto"  # Store already-compressed formats, deflate the rest
+DEFLATE = "deflate"
+STORE = "store"
+
+# Formats with compressed payloads; deflating them saves next to nothing
+STORED_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".avif", ".heic", ".mp4", ".mov", ".m4a",
+                     ".webm", ".mkv", ".mp3", ".ogg", ".flac", ".zip", ".gz", ".zst", ".7z"}
+# Text and uncompressed formats that deflate well
+DEFLATED_EXTENSIONS = {".json", ".svg", ".html", ".gltf", ".txt", ".md", ".csv", ".xml", ".py", ".bat",
+                       ".tif", ".tiff", ".bmp", ".wav"}
+
+# A finished archive part; size is its size on disk, recorded once when the part is closed
+ArchivePart = namedtuple("ArchivePart", ["path", "label", "size"])
+
+SAMPLE_BYTES = 16 * 1024  # Head of an unknown file that is test-compressed
+MIN_SAMPLE_SAVING = 0.1  # Unknown files are deflated when the sample shrinks by at least this much
+
+
+def compression_for(filename, data=None, policy=AUTO):
+    """Return the zipfile compression constant for one entry under policy.
+
+    With the AUTO policy the extension decides; files of other types are
+    deflated only if a quick level-1 compression of their first
+    SAMPLE_BYTES saves at least MIN_SAMPLE_SAVING (data may be None, in
+    which case they are deflated).
+    """
+    if policy == STORE:
+        return zipfile.ZIP_STORED
+    if policy == DEFLATE:
+        return zipfile.ZIP_DEFLATED
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in STORED_EXTENSIONS:
+        return zipfile.ZIP_STORED
+    if extension in DEFLATED_EXTENSIONS or not data:
+        return zipfile.ZIP_DEFLATED
+    sample = data[:SAMPLE_BYTES]
+    saving = 1 - len(zlib.compress(sample, 1)) / len(sample)
+    return zipfile.ZIP_DEFLATED if saving >= MIN_SAMPLE_SAVING else zipfile.ZIP_STORED
+
+
+class TarStream:
+    """Writes a tar archive strictly front to back to a binary file object, which may be a pipe.
+
+    With zstd the stream is compressed as it is written (level is the
+    zstd level; threads > 1 compresses on that many extra threads).
+    close() finishes the archive but leaves fileobj open.
+    """
+
+    def __init__(self, fileobj, zstd=False, level=DEFAULT_ZSTD_LEVEL, threads=0):
+        if zstd and not ZSTD_AVAILABLE:
+            raise RuntimeError("zstd archives require the zstandard package (pip install zstandard)")
+        self._compressor = None
+        if zstd:
+            self._compressor = zstandard.ZstdCompressor(level=level, threads=threads).stream_writer(
+                fileobj, closefd=False)
+            fileobj = self._compressor
+        self._tar = tarfile.open(fileobj=fileobj, mode="w|", format=tarfile.PAX_FORMAT)
+
+    def _info(self, filename, size, mtime=None):
+        info = tarfile.TarInfo(filename)
+        info.size = size
+        info.mtime = int(time.time() if mtime is None else mtime)
+        info.mode = 0o644
+        return info
+
+    def add(self, filename, data):
+        """Append one file from its bytes"""
+        self._tar.addfile(self._info(filename, len(data)), io.BytesIO(data))
+
+    def add_fileobj(self, filename, fileobj, size):
+        """Append one file of size bytes read from a binary file object, in blocks"""
+        self._tar.addfile(self._info(filename, size), fileobj)
+
+    def add_path(self, filename, path):
+        """Append one file from disk, copied through in blocks rather than read whole"""
+        stat = os.stat(path)
+        with open(path, "rb") as f:
+            self._tar.addfile(self._info(filename, stat.st_size, stat.st_mtime), f)
+
+    def close(self):
+        self._tar.close()
+        if self._compressor is not None:
+            self._compressor.close()
+
+
+class _Part:
+    """One planned archive part: its file and the queue its writer thread drains"""
+
+    def __init__(self, number, path):
+        self.number = number
+        self.path = path
+        self.entries = 0
+        self.planned_bytes = 0  # Uncompressed bytes of the entries assigned so far
+        self.queue = queue.Queue()
+        self.future = None
+
+
+class PartSink:
+    """Writes entries into archive parts named {name}_part_N{extension} as they arrive.
+
+    Parts are packed on the uncompressed size of their entries, which is
+    known before anything is compressed, so compressed parts can come out
+    smaller than max_part_bytes. An entry goes into the first open part
+    it fits in; with open_parts parts open and none fitting, the fullest
+    is finished to make room. An entry larger than max_part_bytes gets a
+    part of its own. Parts are written concurrently, each by its own
+    thread, while at most MAX_PENDING_ENTRIES entries wait to be written;
+    add() blocks beyond that. Waiting entries are held in an
+    ipfs_spill.SpillBuffer: in memory up to memory_budget bytes, in temp
+    files beyond it, so a backlog of large animations costs disk space
+    rather than RAM. Pass one ipfs_spill.MemoryBudget to several sinks to
+    bound their memory together.
+
+    A sink that never needed a second part is renamed to {name}{extension}
+    when closed. An entry name that was already added (ignoring case) is
+    skipped, so rows sharing a filename are archived once. Safe to share
+    between threads; log_callback is only called from the threads calling
+    add() and close(). Subclasses define extension and _write_part().
+    """
+
+    extension = ""
+    log_tag = "[ARCHIVE]"
+
+    def __init__(self, name, label=None, max_part_bytes=DEFAULT_PART_BYTES, directory=None, log_callback=None,
+                 writers=DEFAULT_WRITERS, open_parts=DEFAULT_OPEN_PARTS, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.name = name
+        self.label = label
+        self.max_part_bytes = max_part_bytes
+        self.directory = directory or tempfile.gettempdir()
+        self.log_callback = log_callback
+        self.entry_count = 0
+        self.total_bytes = 0  # Uncompressed bytes of every entry
+        self.open_parts = max(1, open_parts)
+        self._parts = []
+        self._open = []  # Parts still accepting entries, in the order they were opened
+        self._names = set()
+        self._archive = None  # Result of close()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(MAX_PENDING_ENTRIES)
+        self.buffer = ipfs_spill.SpillBuffer(memory_budget)
+        # Every open part needs a running writer, or entries queued for it
+        # could hold every slot while the writers wait on other open parts
+        self._executor = ThreadPoolExecutor(max_workers=max(1, writers, self.open_parts),
+                                            thread_name_prefix="archive-part")
+
+    def _log(self, message):
+        if self.log_callback:
+            self.log_callback(message)
+
+    def _part_label(self, number):
+        return f"{self.label} Part {number}" if self.label else f"Part {number}"
+
+    def _write_part(self, part):
+        raise NotImplementedError
+
+    def _drain(self, part, write):
+        # Pass every entry of the part to write(filename, item) until its end
+        # marker, then raise the first error; after a failure the queue is
+        # still drained so add() never waits for a free slot forever
+        error = None
+        while True:
+            entry = part.queue.get()
+            if entry is None:
+                break
+            filename, item = entry
+            try:
+                if error is None:
+                    write(filename, item)
+            except Exception as e:
+                error = e
+            finally:
+                item.release()
+                self._slots.release()
+        if error is not None:
+            raise error
+
+    def _open_part(self):
+        number = len(self._parts) + 1
+        part = _Part(number, os.path.join(self.directory, f"{self.name}_part_{number}{self.extension}"))
+        part.future = self._executor.submit(self._write_part, part)
+        self._parts.append(part)
+        self._open.append(part)
+        return part
+
+    def _finish(self, part):
+        part.queue.put(None)
+        self._open.remove(part)
+        self._log(f"{self.log_tag} Planned part {part.number} of {self.label or self.name}: "
+                  f"{part.entries} files, {part.planned_bytes / (1024 * 1024):.1f}MB")
+
+    def _part_for(self, size):
+        # First fit among the open parts; otherwise a new part, finishing the
+        # fullest open one first when open_parts are already open
+        for part in self._open:
+            if part.planned_bytes + size <= self.max_part_bytes:
+                return part
+        if len(self._open) >= self.open_parts:
+            self._finish(max(self._open, key=lambda part: part.planned_bytes))
+        return self._open_part()
+
+    def add(self, filename, data):
+        """Hand one file to an open part; returns False if filename was already archived"""
+        # Wait for a free slot first, so a full queue never blocks other add() calls under the lock
+        self._slots.acquire()
+        item = self.buffer.put(data)
+        with self._lock:
+            key = filename.lower()
+            if key in self._names or self._archive is not None:
+                item.release()
+                self._slots.release()
+                return False
+            part = self._part_for(len(data))
+            part.queue.put((filename, item))
+            part.entries += 1
+            part.planned_bytes += len(data)
+            if part.planned_bytes >= self.max_part_bytes:
+                # Nothing else fits; write it out now
+                self._finish(part)
+            self._names.add(key)
+            self.entry_count += 1
+            self.total_bytes += len(data)
+            return True
+
+    def close(self):
+        """Wait for every part to be written and return the archive as a list of ArchivePart.
+
+        Raises the first error a part writer ran into.
+        """
+        with self._lock:
+            if self._archive is not None:
+                return self._archive
+            for part in list(self._open):
+                self._finish(part)
+            self._executor.shutdown(wait=True)
+            sizes = []
+            for part in self._parts:
+                part.future.result()
+                sizes.append(os.path.getsize(part.path))
+                self._log(f"{self.log_tag} Finished part {part.number} of {self.label or self.name}: {part.entries} files, "
+                          f"{sizes[-1] / (1024 * 1024):.1f}MB")
+            if len(self._parts) == 1:
+                single_path = os.path.join(self.directory, f"{self.name}{self.extension}")
+                os.replace(self._parts[0].path, single_path)
+                self._archive = [ArchivePart(single_path, self.label or "Complete Collection", sizes[0])]
+            else:
+                self._archive = [ArchivePart(part.path, self._part_label(part.number), size)
+                                 for part, size in zip(self._parts, sizes)]
+            return self._archive
+
+    def abort(self):
+        """Stop the part writers and delete every part written so far; the sink accepts no more entries"""
+        with self._lock:
+            if self._archive is not None:
+                return
+            for part in list(self._open):
+                part.queue.put(None)
+                self._open.remove(part)
+            self._executor.shutdown(wait=True)
+            for part in self._parts:
+                try:
+                    os.unlink(part.path)
+                except OSError:
+                    pass
+            self._archive = []
+
+
+class ZipPartSink(PartSink):
+    """A PartSink writing ZIP parts; compression is a policy for compression_for()"""
+
+    extension = ".zip"
+    log_tag = "[ZIP]"
+
+    def __init__(self, name, label=None, max_part_bytes=DEFAULT_PART_BYTES, directory=None, log_callback=None,
+                 compression=AUTO, writers=DEFAULT_WRITERS, open_parts=DEFAULT_OPEN_PARTS,
+                 memory_budget=DEFAULT_MEMORY_BUDGET):
+        super().__init__(name, label, max_part_bytes, directory, log_callback, writers, open_parts, memory_budget)
+        self.compression = compression
+
+    def _write_part(self, part):
+        with zipfile.ZipFile(part.path, "w") as archive:
+            def write(filename, item):
+                # Spilled entries are read through a memory map, never copied whole
+                with item.view() as data:
+                    archive.writestr(filename, data,
+                                     compress_type=compression_for(filename, data, self.compression))
+            self._drain(part, write)
+
+
+class TarPartSink(PartSink):
+    """A PartSink writing tar parts, compressed as a whole with zstd unless zstd is False"""
+
+    log_tag = "[TAR]"
+
+    def __init__(self, name, label=None, max_part_bytes=DEFAULT_PART_BYTES, directory=None, log_callback=None,
+                 zstd=True, level=DEFAULT_ZSTD_LEVEL, writers=DEFAULT_WRITERS, open_parts=DEFAULT_OPEN_PARTS,
+                 memory_budget=DEFAULT_MEMORY_BUDGET):
+        if zstd and not ZSTD_AVAILABLE:
+            raise RuntimeError("zstd archives require the zstandard package (pip install zstandard)")
+        super().__init__(name, label, max_part_bytes, directory, log_callback, writers, open_parts, memory_budget)
+        self.zstd = zstd
+        self.level = level
+        self.extension = ".tar.zst" if zstd else ".tar"
+
+    def _write_part(self, part):
+        with open(part.path, "wb") as f:
+            stream = TarStream(f, self.zstd, self.level)
+            def write(filename, item):
+                with item.open() as data:
+                    stream.add_fileobj(filename, data, item.size)
+            self._drain(part, write)
+            stream.close()
+
+
+def open_sink(archive_format, name, label=None, max_part_bytes=DEFAULT_PART_BYTES, directory=None,
+              log_callback=None, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """Return a PartSink writing archive_format (ZIP, TAR or TAR_ZSTD) parts"""
+    if archive_format == ZIP:
+        return ZipPartSink(name, label, max_part_bytes, directory, log_callback, memory_budget=memory_budget)
+    if archive_format in (TAR, TAR_ZSTD):
+        return TarPartSink(name, label, max_part_bytes, directory, log_callback, zstd=archive_format == TAR_ZSTD,
+                           memory_budget=memory_budget)
+    raise ValueError(f"unknown archive format {archive_format!r}")
+
+
+def format_for_path(path):
+    """Return the archive format a file name asks for: TAR_ZSTD, TAR or ZIP"""
+    name = path.lower()
+    if name.endswith((".tar.zst", ".tzst")):
+        return TAR_ZSTD
+    if name.endswith(".tar"):
+        return TAR
+    return ZIP
+
+
+def write_tree(directory, fileobj, archive_format):
+    """Write every file under directory into one archive on fileobj and return how many were written.
+
+    Files are copied from disk one at a time in sorted order, never read
+    whole into memory; hidden files (the progress manifest, unfinished
+    .part files) are left out. fileobj may be a pipe; it is left open.
+    """
+    if archive_format == ZIP:
+        archive = zipfile.ZipFile(fileobj, "w")
+        add = lambda name, path: archive.write(path, name, compress_type=compression_for(name))
+    else:
+        archive = TarStream(fileobj, zstd=archive_format == TAR_ZSTD)
+        add = archive.add_path
+    count = 0
+    try:
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+            for filename in sorted(f for f in files if not f.startswith(".")):
+                path = os.path.join(root, filename)
+                add(os.path.relpath(path, directory).replace(os.sep, "/"), path)
+                count += 1
+    finally:
+        archive.close()
+    return count
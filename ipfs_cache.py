@@ -0,0 +1,198 @@
+"""On-disk, content-addressed cache for IPFS downloads.
+
+Files are stored under a hash of their IPFS path (CID plus any subpath),
+so content fetched once by any run, frontend or Streamlit session is
+served from disk afterwards. IPFS content never changes for a given CID,
+so entries never go stale; the cache is only capped in size, evicting
+the least recently used entries first.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+import ipfs_cid
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "cyber_skulls_ipfs_cache")
+DEFAULT_CACHE_SIZE_MB = 2048
+
+# Evict down to this share of the cap so eviction does not run on every write
+EVICTION_TARGET = 0.9
+
+
+def cache_key(path):
+    """Return the cache key for an IPFS path (CID plus optional subpath).
+
+    CIDv0 and CIDv1 spellings of the same content share one key.
+    """
+    return ipfs_cid.canonical_key(path)
+
+
+class CidCache:
+    """Size-capped LRU file cache keyed by IPFS path"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size_mb=DEFAULT_CACHE_SIZE_MB):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+        self._size = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_path(self, path):
+        digest = hashlib.sha256(cache_key(path).encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+    def _entries(self):
+        """Yield (file_path, size, mtime) for every cached file"""
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".part"):
+                    continue
+                file_path = os.path.join(root, name)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                yield file_path, stat.st_size, stat.st_mtime
+
+    def _current_size(self):
+        if self._size is None:
+            self._size = sum(size for _, size, _ in self._entries())
+        return self._size
+
+    def get_path(self, path):
+        """Return the cached file for path (marking it recently used), or None"""
+        entry_path = self._entry_path(path)
+        try:
+            os.utime(entry_path)
+        except OSError:
+            return None
+        return entry_path
+
+    def get(self, path):
+        """Return the cached bytes for path, or None"""
+        entry_path = self.get_path(path)
+        if entry_path is None:
+            return None
+        try:
+            with open(entry_path, "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def copy_to(self, path, output_path):
+        """Copy the cached file for path to output_path; returns False on a miss"""
+        entry_path = self.get_path(path)
+        if entry_path is None:
+            return False
+        directory = os.path.dirname(output_path) or "."
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".part", dir=directory)
+        os.close(fd)
+        try:
+            shutil.copyfile(entry_path, temp_path)
+            os.replace(temp_path, output_path)
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def _store(self, path, write):
+        entry_path = self._entry_path(path)
+        if os.path.exists(entry_path):
+            os.utime(entry_path)
+            return
+        directory = os.path.dirname(entry_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(suffix=".part", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                write(f)
+            size = os.path.getsize(temp_path)
+            # Count the size before the rename, so the first scan does not see
+            # the new file, and net out an entry a concurrent store already wrote
+            with self._lock:
+                total = self._current_size()
+                try:
+                    total -= os.path.getsize(entry_path)
+                except OSError:
+                    pass
+                os.replace(temp_path, entry_path)
+                self._size = total + size
+                if self._size > self.max_bytes:
+                    self._evict()
+        except OSError:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+
+    def put(self, path, data):
+        """Store bytes for path"""
+        if len(data) > self.max_bytes:
+            return
+        self._store(path, lambda f: f.write(data))
+
+    def put_file(self, path, source_path):
+        """Store a copy of an already downloaded file for path"""
+        try:
+            if os.path.getsize(source_path) > self.max_bytes:
+                return
+        except OSError:
+            return
+
+        def write(f):
+            with open(source_path, "rb") as source:
+                shutil.copyfileobj(source, f)
+        self._store(path, write)
+
+    def _evict(self):
+        """Delete least recently used files until the cache is under its target size"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes * EVICTION_TARGET
+        for file_path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(file_path)
+                total -= size
+            except OSError:
+                pass
+        self._size = total
+
+    def clear(self):
+        """Remove every cached file"""
+        with self._lock:
+            shutil.rmtree(self.cache_dir, ignore_errors=True)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self._size = 0
+
+
+_default_cache = None
+_default_cache_enabled = True
+_default_lock = threading.Lock()
+
+
+def configure_default_cache(cache_dir=DEFAULT_CACHE_DIR, max_size_mb=DEFAULT_CACHE_SIZE_MB, enabled=True):
+    """Replace the process-wide cache used by the download functions"""
+    global _default_cache, _default_cache_enabled
+    with _default_lock:
+        _default_cache_enabled = enabled
+        _default_cache = CidCache(cache_dir, max_size_mb) if enabled else None
+
+
+def get_default_cache():
+    """Return the process-wide cache, or None when caching is disabled"""
+    global _default_cache
+    with _default_lock:
+        if _default_cache is None and _default_cache_enabled:
+            try:
+                _default_cache = CidCache()
+            except OSError:
+                return None
+        return _default_cache
@@ -0,0 +1,245 @@
+"""IPFS CID and URL parsing.
+
+Collection CSVs point at the same content in many spellings:
+ipfs://<cid>, ipfs://ipfs/<cid>, /ipfs/<cid>, path gateway URLs
+(https://host/ipfs/<cid>/...), subdomain gateway URLs
+(https://<cid>.ipfs.host/...), and CIDv0 (Qm...) or CIDv1 (bafy...) for
+the same hash. parse_ipfs_url() reduces all of them to the CID as written
+plus an optional subpath, and canonical_key() turns that into one
+identity (base32 CIDv1 plus subpath) for caching and deduplication.
+
+CIDs are decoded for real: multibase prefix, version and codec varints
+and the multihash, whose digest length must match its header.
+"""
+import base64
+import binascii
+from collections import namedtuple
+from urllib.parse import urlsplit
+
+# Multicodec and multihash codes
+DAG_PB = 0x70  # Codec of every CIDv0
+SHA2_256 = 0x12
+
+CIDV0_LENGTH = 46
+CIDV0_PREFIX = "Qm"
+
+_BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+_BASE58_INDEX = {char: index for index, char in enumerate(_BASE58_ALPHABET)}
+
+# A decoded CID; multihash is the raw bytes (code, length, digest)
+Cid = namedtuple("Cid", ["version", "codec", "multihash"])
+
+
+class IpfsPath(namedtuple("IpfsPath", ["cid", "subpath"])):
+    """A CID as written in the source URL plus an optional subpath ("" if none)"""
+
+    __slots__ = ()
+
+    @property
+    def path(self):
+        """The gateway path: CID plus subpath"""
+        return f"{self.cid}/{self.subpath}" if self.subpath else self.cid
+
+    @property
+    def key(self):
+        """The canonical identity: base32 CIDv1 plus subpath"""
+        return canonical_key(self.path)
+
+
+def _b58decode(text):
+    number = 0
+    for char in text:
+        digit = _BASE58_INDEX.get(char)
+        if digit is None:
+            raise ValueError(f"invalid base58 character {char!r}")
+        number = number * 58 + digit
+    body = number.to_bytes((number.bit_length() + 7) // 8, "big")
+    # Each leading "1" stands for a zero byte
+    return b"\x00" * (len(text) - len(text.lstrip("1"))) + body
+
+
+def _b58encode(data):
+    number = int.from_bytes(data, "big")
+    chars = []
+    while number:
+        number, digit = divmod(number, 58)
+        chars.append(_BASE58_ALPHABET[digit])
+    # Each leading zero byte is written as "1"
+    return "1" * (len(data) - len(data.lstrip(b"\x00"))) + "".join(reversed(chars))
+
+
+def _b36decode(text):
+    number = int(text, 36)
+    body = number.to_bytes((number.bit_length() + 7) // 8, "big")
+    return b"\x00" * (len(text) - len(text.lstrip("0"))) + body
+
+
+def _b32decode(text):
+    return base64.b32decode(text.upper() + "=" * (-len(text) % 8))
+
+
+def _b64decode(text, altchars=None):
+    return base64.b64decode(text + "=" * (-len(text) % 4), altchars=altchars, validate=True)
+
+
+# Multibase prefixes of the encodings CIDs are written in
+_MULTIBASE_DECODERS = {
+    "b": _b32decode,  # base32 (the CIDv1 default)
+    "B": _b32decode,
+    "c": lambda text: _b32decode(text.rstrip("=")),  # base32 with padding
+    "C": lambda text: _b32decode(text.rstrip("=")),
+    "z": _b58decode,  # base58btc
+    "f": bytes.fromhex,  # base16
+    "F": bytes.fromhex,
+    "k": lambda text: _b36decode(text.lower()),  # base36 (subdomain gateways)
+    "K": lambda text: _b36decode(text.lower()),
+    "m": _b64decode,
+    "M": lambda text: _b64decode(text.rstrip("=")),
+    "u": lambda text: _b64decode(text, altchars=b"-_"),
+    "U": lambda text: _b64decode(text.rstrip("="), altchars=b"-_"),
+}
+
+
+def _read_varint(data, offset):
+    """Return (value, next offset) of the unsigned varint at offset"""
+    value = 0
+    shift = 0
+    while True:
+        if offset >= len(data) or shift > 63:
+            raise ValueError("truncated varint")
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def _write_varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _check_multihash(data, offset):
+    """Validate the multihash starting at offset and return its bytes"""
+    _, digest_offset = _read_varint(data, offset)
+    length, digest_offset = _read_varint(data, digest_offset)
+    if len(data) - digest_offset != length:
+        raise ValueError("multihash digest length does not match its header")
+    return bytes(data[offset:])
+
+
+def decode_cid(text):
+    """Decode a CID string into a Cid; raises ValueError if it is not a valid CID"""
+    if not isinstance(text, str) or not text:
+        raise ValueError("empty CID")
+    if len(text) == CIDV0_LENGTH and text.startswith(CIDV0_PREFIX):
+        multihash = _check_multihash(_b58decode(text), 0)
+        return Cid(0, DAG_PB, multihash)
+
+    decoder = _MULTIBASE_DECODERS.get(text[0])
+    if decoder is None:
+        raise ValueError(f"unsupported multibase prefix {text[0]!r}")
+    try:
+        data = decoder(text[1:])
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"invalid multibase data: {e}") from None
+    version, offset = _read_varint(data, 0)
+    if version != 1:
+        raise ValueError(f"unsupported CID version {version}")
+    codec, offset = _read_varint(data, offset)
+    return Cid(1, codec, _check_multihash(data, offset))
+
+
+def is_cid(text):
+    """Return True if text is a valid CID"""
+    try:
+        decode_cid(text)
+    except ValueError:
+        return False
+    return True
+
+
+def encode_cidv1(cid):
+    """Return the base32 CIDv1 string of a Cid (CIDv0 is upgraded, keeping dag-pb)"""
+    data = _write_varint(1) + _write_varint(cid.codec) + cid.multihash
+    return "b" + base64.b32encode(data).decode("ascii").lower().rstrip("=")
+
+
+def encode_cidv0(cid):
+    """Return the base58btc CIDv0 string of a dag-pb, sha2-256 Cid"""
+    if cid.codec != DAG_PB or cid.multihash[:2] != bytes([SHA2_256, 32]):
+        raise ValueError("CIDv0 requires dag-pb and a sha2-256 multihash")
+    return _b58encode(cid.multihash)
+
+
+def canonical_cid(text):
+    """Return the base32 CIDv1 form of a CID string"""
+    return encode_cidv1(decode_cid(text))
+
+
+def canonical_key(path):
+    """Return the canonical identity of an IPFS path: base32 CIDv1 plus subpath.
+
+    Paths whose first segment is not a decodable CID are keyed as written.
+    """
+    path = path.strip("/")
+    cid, _, subpath = path.partition("/")
+    try:
+        cid = canonical_cid(cid)
+    except ValueError:
+        return path
+    return f"{cid}/{subpath}" if subpath else cid
+
+
+def _split_path(path, require_cid=True):
+    """Return an IpfsPath for "<cid>[/subpath]", or None"""
+    cid, _, subpath = path.strip("/").partition("/")
+    if not cid or (require_cid and not is_cid(cid)):
+        return None
+    return IpfsPath(cid, subpath.strip("/"))
+
+
+def parse_ipfs_url(url):
+    """Return the IpfsPath an IPFS or gateway URL points at, or None.
+
+    Fragments (such as the #i ARC-3 suffix) and query strings are dropped.
+    ipfs:// URLs are trusted as written even when their CID cannot be
+    decoded; gateway URLs and bare paths must contain a valid CID.
+    """
+    if not isinstance(url, str):
+        return None
+    text = url.strip().split("#", 1)[0].split("?", 1)[0]
+    lower = text.lower()
+
+    if lower.startswith("ipfs://"):
+        rest = text[len("ipfs://"):].lstrip("/")
+        if rest.lower().startswith("ipfs/"):
+            rest = rest[len("ipfs/"):]
+        return _split_path(rest, require_cid=False)
+
+    if lower.startswith(("http://", "https://")):
+        parts = urlsplit(text)
+        # Subdomain gateways: https://<cid>.ipfs.<host>/<subpath>
+        labels = (parts.hostname or "").split(".")
+        if len(labels) > 2 and labels[1] == "ipfs" and is_cid(labels[0]):
+            return IpfsPath(labels[0], parts.path.strip("/"))
+        # Path gateways: https://<host>/ipfs/<cid>/<subpath>
+        segments = parts.path.split("/")
+        if "ipfs" in segments:
+            return _split_path("/".join(segments[segments.index("ipfs") + 1:]))
+        return None
+
+    if lower.startswith("/ipfs/"):
+        return _split_path(text[len("/ipfs/"):])
+    if "://" in text:
+        return None
+    # Bare CID, optionally with a subpath
+    return _split_path(text)
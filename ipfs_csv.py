@@ -0,0 +1,165 @@
+"""Streaming, column-projected CSV ingestion for collection exports.
+
+wen.tools exports carry many trait columns (properties_*,
+metadata_description) that downloading never looks at. Rows are parsed
+in fixed-size chunks with only the download columns selected and handed
+out as small records, so memory stays flat however many rows or columns
+the CSV has.
+
+Several collections (many CSVs, or zips of CSVs) can be merged into one
+interleaved row stream so they are downloaded side by side.
+"""
+import io
+import os
+import re
+import zipfile
+from collections import namedtuple
+
+import pandas as pd
+
+import ipfs_arc19
+import ipfs_plan
+
+REQUIRED_COLUMNS = ["name", "unit-name", "url"]
+DOWNLOAD_COLUMNS = REQUIRED_COLUMNS + ["metadata_mime_type"]
+
+# Rows parsed per chunk
+DEFAULT_CHUNK_ROWS = 5000
+
+DownloadRow = namedtuple("DownloadRow", ["row_number", "name", "unit_name", "url", "mime_type", "filename",
+                                         "collection"], defaults=("",))
+
+# One uploaded collection: a folder-safe name and a readable CSV source
+Collection = namedtuple("Collection", ["name", "source"])
+
+_COLLECTION_UNSAFE_RE = re.compile(r"[^\w.-]+")
+
+
+def _rewind(source):
+    """Return a fresh reader over source so it can be read again.
+
+    pandas closes the binary handles it wraps, so in-memory uploads get a
+    new BytesIO over their (shared, uncopied) buffer each time.
+    """
+    if hasattr(source, "getvalue"):
+        return io.BytesIO(source.getvalue())
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+def read_columns(source):
+    """Return the column names of a CSV without parsing any rows"""
+    return list(pd.read_csv(_rewind(source), nrows=0, encoding="utf-8").columns)
+
+
+def missing_columns(source):
+    """Return the required download columns the CSV lacks"""
+    columns = read_columns(source)
+    return [col for col in REQUIRED_COLUMNS if col not in columns]
+
+
+def count_rows(source, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Count data rows by parsing a single column in chunks"""
+    chunks = pd.read_csv(_rewind(source), usecols=[0], dtype=str, encoding="utf-8", chunksize=chunk_rows)
+    return sum(len(chunk) for chunk in chunks)
+
+
+def read_preview(source, rows=5):
+    """Return the first rows of a CSV as a DataFrame"""
+    return pd.read_csv(_rewind(source), nrows=rows, encoding="utf-8")
+
+
+def collection_name(filename):
+    """Return a folder-safe collection name from an uploaded file name"""
+    stem = os.path.splitext(os.path.basename(filename.replace("\\", "/")))[0]
+    return _COLLECTION_UNSAFE_RE.sub("_", stem).strip("._") or "collection"
+
+
+def collections_from_uploads(uploads):
+    """Return a Collection for every uploaded CSV and every CSV inside uploaded zips.
+
+    uploads are file-like objects with a name attribute (Streamlit
+    UploadedFile). Names are made unique with _2, _3, ... suffixes.
+    """
+    collections = []
+    used = set()
+
+    def add(filename, source):
+        base = name = collection_name(filename)
+        suffix = 2
+        while name.lower() in used:
+            name = f"{base}_{suffix}"
+            suffix += 1
+        used.add(name.lower())
+        collections.append(Collection(name, source))
+
+    for upload in uploads:
+        if not upload.name.lower().endswith(".zip"):
+            add(upload.name, upload)
+            continue
+        with zipfile.ZipFile(_rewind(upload)) as archive:
+            for member in archive.infolist():
+                member_name = member.filename
+                # Skip folders and the resource forks macOS adds to zips
+                if member.is_dir() or not member_name.lower().endswith(".csv"):
+                    continue
+                if member_name.startswith("__MACOSX/") or os.path.basename(member_name).startswith("._"):
+                    continue
+                add(member_name, io.BytesIO(archive.read(member)))
+    return collections
+
+
+def resolve_templates(urls, reserves):
+    """Return a url Series with ARC-19 template URLs resolved from the reserve addresses"""
+    templates = urls.str.lower().str.startswith(ipfs_arc19.TEMPLATE_SCHEME).fillna(False).astype(bool)
+    if not templates.any():
+        return urls
+    resolved = ipfs_arc19.resolve_urls(urls[templates], reserves[templates].astype(str).str.strip())
+    return urls.where(~templates, pd.Series(resolved, index=urls.index[templates], dtype=urls.dtype))
+
+
+def iter_rows(source, chunk_rows=DEFAULT_CHUNK_ROWS, planner=None, collection=""):
+    """Yield a DownloadRow for every CSV row, reading only the download columns.
+
+    Values are stripped strings; missing cells become empty strings.
+    row_number counts every data row from 0, including incomplete ones.
+    Output filenames are planned a chunk at a time with planner (a fresh
+    ipfs_plan.FilenamePlanner by default); incomplete rows get None.
+    Every row carries the given collection name. ARC-19 template URLs are
+    resolved from the reserve address column when the CSV has one.
+    """
+    planner = planner or ipfs_plan.FilenamePlanner()
+    present = set(read_columns(source))
+    reserve = ipfs_arc19.reserve_column(present)
+    usecols = [col for col in DOWNLOAD_COLUMNS if col in present] + ([reserve] if reserve else [])
+    chunks = pd.read_csv(_rewind(source), usecols=usecols, dtype=str, keep_default_na=False,
+                         encoding="utf-8", chunksize=chunk_rows)
+    row_number = 0
+    for chunk in chunks:
+        columns = [chunk[col].str.strip() if col in present else [""] * len(chunk)
+                   for col in DOWNLOAD_COLUMNS]
+        if reserve and "url" in present:
+            columns[2] = resolve_templates(columns[2], chunk[reserve])
+        filenames = planner.plan(*columns[:2], columns[3], columns[2])
+        for name, unit_name, url, mime_type, filename in zip(*columns, filenames):
+            yield DownloadRow(row_number, name, unit_name, url, mime_type, filename, collection)
+            row_number += 1
+
+
+def iter_collections(collections, chunk_rows=DEFAULT_CHUNK_ROWS):
+    """Yield the rows of several collections interleaved round-robin.
+
+    Every collection gets its own filename planner, since each one is
+    written to a folder and archive of its own. Interleaving lets all
+    collections progress together under one shared download pool.
+    """
+    streams = [iter_rows(collection.source, chunk_rows, collection=collection.name)
+               for collection in collections]
+    while streams:
+        for stream in list(streams):
+            row = next(stream, None)
+            if row is None:
+                streams.remove(stream)
+            else:
+                yield row
@@ -0,0 +1,448 @@
+"""IPFS gateway URL building, health-based routing and hedged requests.
+
+fetch() turns an ipfs:// path into a response from one of several
+gateways. A GatewayRouter keeps rolling health scores for every gateway
+and decides the order in which they are tried. Without hedging the
+gateways are tried in that order; with hedging a backup request is fired
+at the next gateway whenever the current ones have not produced a
+response within the recent time-to-first-byte percentile, and the first
+successful response wins.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import ipfs_cid
+import ipfs_http
+import ipfs_retry
+
+DEFAULT_GATEWAY = "https://ipfs.io/ipfs/"
+
+# Hedging settings
+HEDGE_PERCENTILE = 0.9  # Fire a backup once a request is slower than this share of recent ones
+HEDGE_DEFAULT_DELAY = 2.0  # Seconds to wait before hedging until enough samples exist
+HEDGE_MIN_DELAY = 0.25
+HEDGE_MIN_SAMPLES = 10
+
+# Routing settings
+ROUTER_SMOOTHING = 0.2  # Weight of the newest sample in the rolling averages
+ROUTER_DEFAULT_TTFB = 1.0  # Assumed seconds to first byte before a gateway has served a file
+ROUTER_TYPICAL_BYTES = 800 * 1024  # Typical NFT image size used to weigh throughput
+ROUTER_MIN_THROUGHPUT_BYTES = 256 * 1024  # Smaller bodies say nothing useful about throughput
+ROUTER_THROTTLE_COOLDOWN = 30.0  # Seconds a gateway is avoided after HTTP 429
+ROUTER_ERROR_COOLDOWN = 10.0  # Seconds a gateway is avoided after a 5xx or network error
+ROUTER_COOLDOWN_PENALTY = 60.0  # Extra expected seconds while cooling down
+ROUTER_EXPLORE_RATE = 0.05  # Share of requests sent to a non-best gateway to refresh its score
+
+_ttfb_samples = deque(maxlen=500)
+_ttfb_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="ipfs-hedge")
+
+
+def parse_gateway_list(value):
+    """Return gateway URLs from a list or a comma/whitespace separated string.
+
+    Every gateway is normalized to end with a slash; duplicates are dropped
+    and the default gateway is used when nothing is configured.
+    """
+    if isinstance(value, str):
+        items = value.replace(",", " ").split()
+    else:
+        items = [item for item in (value or []) if item]
+
+    gateways = []
+    for item in items:
+        item = item.strip()
+        if not item:
+            continue
+        if not item.endswith('/'):
+            item += '/'
+        if item not in gateways:
+            gateways.append(item)
+    return gateways or [DEFAULT_GATEWAY]
+
+
+def ipfs_path_from_url(url):
+    """Return the CID path (CID plus subpath) an IPFS or gateway URL points at, or None.
+
+    Besides ipfs:// URLs, gateway URLs and /ipfs/ paths that embed a valid
+    CID are rewritten to their IPFS path, so they are routed like any other.
+    """
+    parsed = ipfs_cid.parse_ipfs_url(url)
+    return parsed.path if parsed else None
+
+
+def build_gateway_url(gateway_url, path):
+    """Join a gateway base URL and an IPFS path"""
+    return f"{gateway_url}{path}"
+
+
+def record_ttfb(seconds):
+    """Add a time-to-first-byte sample used to pick the hedging delay"""
+    with _ttfb_lock:
+        _ttfb_samples.append(seconds)
+
+
+def hedge_delay(percentile=HEDGE_PERCENTILE):
+    """Return how long to wait for a response before firing a backup request"""
+    with _ttfb_lock:
+        samples = sorted(_ttfb_samples)
+    if len(samples) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    index = min(len(samples) - 1, int(len(samples) * percentile))
+    return max(HEDGE_MIN_DELAY, samples[index])
+
+
+class GatewayRouter:
+    """Rolling per-gateway health scores used to route each new request.
+
+    Every gateway tracks its success rate, time to first byte and
+    throughput as exponentially weighted averages, plus HTTP 429 and 5xx
+    counts. A throttled or failing gateway is put on a short cooldown.
+    order() ranks gateways by the expected time to fetch a typical file.
+    """
+
+    def __init__(self, explore_rate=ROUTER_EXPLORE_RATE):
+        self.explore_rate = explore_rate
+        self._stats = {}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def _entry(self, gateway):
+        entry = self._stats.get(gateway)
+        if entry is None:
+            entry = {
+                "requests": 0,
+                "successes": 0,
+                "success_rate": 1.0,
+                "ttfb": None,
+                "throughput": None,
+                "throttled": 0,
+                "server_errors": 0,
+                "network_errors": 0,
+                "cooldown_until": 0.0,
+            }
+            self._stats[gateway] = entry
+        return entry
+
+    @staticmethod
+    def _smooth(previous, sample):
+        if previous is None:
+            return sample
+        return previous + ROUTER_SMOOTHING * (sample - previous)
+
+    def record_response(self, gateway, status_code, ttfb, retry_after=None):
+        """Record the status and time to first byte of one gateway response"""
+        with self._lock:
+            entry = self._entry(gateway)
+            entry["requests"] += 1
+            if status_code == 200:
+                entry["ttfb"] = self._smooth(entry["ttfb"], ttfb)
+                entry["successes"] += 1
+                entry["success_rate"] = self._smooth(entry["success_rate"], 1.0)
+                return
+            entry["success_rate"] = self._smooth(entry["success_rate"], 0.0)
+            if status_code == 429:
+                entry["throttled"] += 1
+                cooldown = ipfs_retry.parse_retry_after(retry_after) or ROUTER_THROTTLE_COOLDOWN
+                entry["cooldown_until"] = max(entry["cooldown_until"], time.monotonic() + cooldown)
+            elif status_code >= 500:
+                entry["server_errors"] += 1
+                entry["cooldown_until"] = max(entry["cooldown_until"], time.monotonic() + ROUTER_ERROR_COOLDOWN)
+
+    def record_error(self, gateway, elapsed=None):
+        """Record a timeout or connection failure after elapsed seconds"""
+        with self._lock:
+            entry = self._entry(gateway)
+            entry["requests"] += 1
+            entry["network_errors"] += 1
+            if elapsed is not None:
+                entry["ttfb"] = self._smooth(entry["ttfb"], elapsed)
+            entry["success_rate"] = self._smooth(entry["success_rate"], 0.0)
+            entry["cooldown_until"] = max(entry["cooldown_until"], time.monotonic() + ROUTER_ERROR_COOLDOWN)
+
+    def record_transfer(self, gateway, nbytes, seconds):
+        """Record how fast a response body was read"""
+        if nbytes < ROUTER_MIN_THROUGHPUT_BYTES or seconds <= 0:
+            return
+        with self._lock:
+            entry = self._entry(gateway)
+            entry["throughput"] = self._smooth(entry["throughput"], nbytes / seconds)
+
+    def _score(self, entry, now):
+        # Untried gateways go first so that every gateway gets measured
+        if entry["requests"] == 0:
+            return 0.0
+        ttfb = entry["ttfb"] if entry["ttfb"] is not None else ROUTER_DEFAULT_TTFB
+        transfer = ROUTER_TYPICAL_BYTES / entry["throughput"] if entry["throughput"] else 0.0
+        cost = (ttfb + transfer) / max(entry["success_rate"], 0.05)
+        if now < entry["cooldown_until"]:
+            cost += ROUTER_COOLDOWN_PENALTY
+        return cost
+
+    def score(self, gateway):
+        """Return the expected seconds to fetch a typical file (lower is better)"""
+        with self._lock:
+            return self._score(self._entry(gateway), time.monotonic())
+
+    def order(self, gateways):
+        """Return gateways sorted best first, occasionally promoting another one to keep scores fresh"""
+        now = time.monotonic()
+        with self._lock:
+            scores = [self._score(self._entry(gateway), now) for gateway in gateways]
+            explore = len(gateways) > 1 and self._random.random() < self.explore_rate
+            pick = self._random.randrange(1, len(gateways)) if explore else 0
+        ranked = [gateway for _, _, gateway in sorted(zip(scores, range(len(gateways)), gateways))]
+        if pick:
+            ranked.insert(0, ranked.pop(pick))
+        return ranked
+
+    def get_stats(self):
+        """Return a copy of the per-gateway statistics with the current score"""
+        now = time.monotonic()
+        with self._lock:
+            return {gateway: dict(entry, score=self._score(entry, now))
+                    for gateway, entry in self._stats.items()}
+
+    def format_stats(self):
+        """Return one human-readable line per gateway"""
+        lines = []
+        for gateway, entry in sorted(self.get_stats().items(), key=lambda item: item[1]["score"]):
+            ttfb = f"{entry['ttfb'] * 1000:.0f}ms" if entry["ttfb"] is not None else "n/a"
+            throughput = f"{entry['throughput'] / 1024:.0f}KB/s" if entry["throughput"] else "n/a"
+            lines.append(f"{gateway}: {entry['successes']}/{entry['requests']} ok, "
+                         f"ttfb {ttfb}, {throughput}, 429 x{entry['throttled']}, "
+                         f"5xx x{entry['server_errors']}, errors x{entry['network_errors']}, "
+                         f"score {entry['score']:.2f}")
+        return lines
+
+
+# Process-wide router shared by every download path
+default_router = GatewayRouter()
+
+
+def _stream_get(gateway, path, timeout, router):
+    """GET one gateway without reading the body yet and report the outcome to the router"""
+    started = time.monotonic()
+    try:
+        response = ipfs_http.get(build_gateway_url(gateway, path), timeout=timeout, stream=True)
+    except Exception:
+        router.record_error(gateway, time.monotonic() - started)
+        raise
+    router.record_response(gateway, response.status_code, response.elapsed.total_seconds(),
+                           response.headers.get("Retry-After"))
+    response.ipfs_gateway = gateway
+    response.ipfs_router = router
+    return response
+
+
+def record_transfer(response, nbytes, seconds):
+    """Report how fast the body of a fetch() response was read"""
+    router = getattr(response, "ipfs_router", None)
+    gateway = getattr(response, "ipfs_gateway", None)
+    if router is not None and gateway is not None:
+        router.record_transfer(gateway, nbytes, seconds)
+
+
+def read_content(response):
+    """Read the whole body of a fetch() response"""
+    started = time.monotonic()
+    content = response.content
+    record_transfer(response, len(content), time.monotonic() - started)
+    return content
+
+
+def save_content(response, output_path, chunk_size=ipfs_http.DEFAULT_CHUNK_SIZE, on_chunk=None):
+    """Stream the body of a fetch() response to output_path; returns bytes written"""
+    started = time.monotonic()
+    written = ipfs_http.stream_to_file(response, output_path, chunk_size, on_chunk)
+    record_transfer(response, written, time.monotonic() - started)
+    return written
+
+
+def _discard(future):
+    """Close the response of a request that lost the race"""
+    if future.cancelled():
+        return
+    try:
+        future.result().close()
+    except Exception:
+        pass
+
+
+def fetch(path, gateways, timeout=30, hedge=False, router=None):
+    """GET an IPFS path from the configured gateways, best scored first.
+
+    Returns a streamed requests.Response; the first HTTP 200 wins. If no
+    gateway succeeds, the last non-200 response is returned, or the last
+    network error is raised when there is none. Callers must close the
+    response.
+    """
+    router = router or default_router
+    gateways = router.order(parse_gateway_list(gateways))
+
+    if not hedge or len(gateways) == 1:
+        return _fetch_in_order(path, gateways, timeout, router)
+
+    pending = set()
+    next_index = 0
+    last_response = None
+    last_error = None
+
+    def launch():
+        nonlocal next_index
+        pending.add(_hedge_executor.submit(_stream_get, gateways[next_index], path, timeout, router))
+        next_index += 1
+
+    launch()
+    while pending:
+        # Wait for the hedging delay only while there is a backup left to fire
+        delay = hedge_delay() if next_index < len(gateways) else None
+        done, _ = wait(pending, timeout=delay, return_when=FIRST_COMPLETED)
+        if not done:
+            launch()
+            continue
+
+        winner = None
+        for future in done:
+            pending.discard(future)
+            try:
+                response = future.result()
+            except Exception as e:
+                last_error = e
+                continue
+            if response.status_code == 200 and winner is None:
+                winner = response
+            else:
+                if last_response is not None:
+                    last_response.close()
+                last_response = response
+
+        if winner is not None:
+            # Only winners are sampled; losers would drag the percentile towards the slow gateway
+            record_ttfb(winner.elapsed.total_seconds())
+            # Cancel requests that have not started and close the rest on arrival
+            for future in pending:
+                if not future.cancel():
+                    future.add_done_callback(_discard)
+            if last_response is not None:
+                last_response.close()
+            return winner
+
+        # A gateway failed outright, so move on without waiting
+        if next_index < len(gateways):
+            launch()
+
+    if last_response is not None:
+        return last_response
+    raise last_error
+
+
+def _fetch_in_order(path, gateways, timeout, router):
+    """Try each gateway in turn until one answers with HTTP 200"""
+    last_response = None
+    last_error = None
+    for gateway in gateways:
+        try:
+            response = _stream_get(gateway, path, timeout, router)
+        except Exception as e:
+            last_error = e
+            continue
+        if response.status_code == 200:
+            record_ttfb(response.elapsed.total_seconds())
+            if last_response is not None:
+                last_response.close()
+            return response
+        if last_response is not None:
+            last_response.close()
+        last_response = response
+    if last_response is not None:
+        return last_response
+    raise last_error
+
+
+def _release_task(task):
+    """Release the response of a request task that lost the race"""
+    if task.cancelled() or task.exception() is not None:
+        return
+    response, _ = task.result()
+    response.release()
+
+
+async def fetch_async(session, path, gateways, hedge=False, router=None):
+    """Asyncio counterpart of fetch() for an aiohttp session.
+
+    Losing requests are cancelled outright. Callers must release the
+    returned response.
+    """
+    router = router or default_router
+    gateways = router.order(parse_gateway_list(gateways))
+
+    async def timed_get(gateway):
+        started = time.monotonic()
+        try:
+            response = await session.get(build_gateway_url(gateway, path))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            router.record_error(gateway, time.monotonic() - started)
+            raise
+        elapsed = time.monotonic() - started
+        router.record_response(gateway, response.status, elapsed, response.headers.get("Retry-After"))
+        response.ipfs_gateway = gateway
+        response.ipfs_router = router
+        return response, elapsed
+
+    pending = set()
+    next_index = 0
+    last_response = None
+    last_error = None
+
+    def launch():
+        nonlocal next_index
+        pending.add(asyncio.ensure_future(timed_get(gateways[next_index])))
+        next_index += 1
+
+    launch()
+    while pending:
+        if hedge and next_index < len(gateways):
+            done, pending = await asyncio.wait(pending, timeout=hedge_delay(),
+                                               return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                launch()
+                continue
+        else:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+        winner = None
+        for task in done:
+            try:
+                response, elapsed = task.result()
+            except Exception as e:
+                last_error = e
+                continue
+            if response.status == 200 and winner is None:
+                winner = response
+                record_ttfb(elapsed)
+            else:
+                if last_response is not None:
+                    last_response.release()
+                last_response = response
+
+        if winner is not None:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(_release_task)
+            if last_response is not None:
+                last_response.release()
+            return winner
+
+        if next_index < len(gateways):
+            launch()
+
+    if last_response is not None:
+        return last_response
+    raise last_error
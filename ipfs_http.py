@@ -0,0 +1,173 @@
+"""Shared HTTP connection pool for IPFS gateway requests.
+
+Every download path goes through get() so repeated requests to the same
+gateway reuse kept-alive TCP/TLS connections instead of paying a fresh
+handshake per file. The session is created once per process and is safe
+to use from worker threads.
+"""
+import os
+import tempfile
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Default connection pool sizing
+DEFAULT_POOL_MAXSIZE = 32  # Kept-alive connections per gateway host
+DEFAULT_POOL_HOSTS = 10  # Hosts handled by the fallback adapter
+
+# Bytes held in memory per download when streaming to disk
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+_session = None
+_session_lock = threading.Lock()
+_host_pool_sizes = {}
+_host_adapters = {}
+
+
+def _host_prefix(url):
+    """Return the scheme://host[:port]/ prefix used to mount a per-host adapter"""
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.netloc:
+        return None
+    return f"{parts.scheme}://{parts.netloc.lower()}/"
+
+
+def configure_host_pool(host_url, pool_maxsize):
+    """Set how many kept-alive connections are pooled for one gateway host"""
+    prefix = _host_prefix(host_url)
+    if prefix is None:
+        return
+    with _session_lock:
+        _host_pool_sizes[prefix] = max(1, int(pool_maxsize))
+        # Remount on the next request so the new size takes effect
+        adapter = _host_adapters.pop(prefix, None)
+        if adapter is not None and _session is not None:
+            _session.adapters.pop(prefix, None)
+            adapter.close()
+
+
+class _PooledSession(requests.Session):
+    """A session whose adapter lookup is serialized with adapter mounting.
+
+    Session.get_adapter iterates session.adapters, which per-host adapters
+    are mounted into (and removed from) on first use; without the lock a
+    worker thread could look up an adapter while another one mounts.
+    """
+
+    def get_adapter(self, url):
+        with _session_lock:
+            return super().get_adapter(url)
+
+
+def get_session():
+    """Return the process-wide pooled requests session"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = _PooledSession()
+            fallback = HTTPAdapter(pool_connections=DEFAULT_POOL_HOSTS,
+                                   pool_maxsize=DEFAULT_POOL_MAXSIZE)
+            session.mount("https://", fallback)
+            session.mount("http://", fallback)
+            session.headers.update({"Connection": "keep-alive"})
+            _session = session
+        return _session
+
+
+def _ensure_host_adapter(session, url):
+    """Mount a dedicated, sized adapter for the host of url on first use"""
+    prefix = _host_prefix(url)
+    if prefix is None or prefix in _host_adapters:
+        return
+    with _session_lock:
+        if prefix in _host_adapters:
+            return
+        pool_maxsize = _host_pool_sizes.get(prefix, DEFAULT_POOL_MAXSIZE)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        session.mount(prefix, adapter)
+        _host_adapters[prefix] = adapter
+
+
+def get(url, **kwargs):
+    """Send a GET request through the shared connection pool"""
+    session = get_session()
+    _ensure_host_adapter(session, url)
+    return session.get(url, **kwargs)
+
+
+def head(url, **kwargs):
+    """Send a HEAD request through the shared connection pool"""
+    session = get_session()
+    _ensure_host_adapter(session, url)
+    return session.head(url, **kwargs)
+
+
+def get_pool_stats():
+    """Return per-host request and connection counters for the shared pool.
+
+    Each entry maps "scheme://host:port" to a dict with "requests",
+    "new_connections" and "reused" (requests served on a kept-alive
+    connection). Only requests sent through this module are counted; the
+    aiohttp engine of download_ipfs_images.py --async pools its own
+    connections and is not included.
+    """
+    with _session_lock:
+        adapters = list(_host_adapters.values())
+        if _session is not None:
+            adapters.extend(a for a in _session.adapters.values() if a not in adapters)
+
+    stats = {}
+    for adapter in adapters:
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+            entry = stats.setdefault(host, {"requests": 0, "new_connections": 0, "reused": 0})
+            entry["requests"] += pool.num_requests
+            entry["new_connections"] += pool.num_connections
+            entry["reused"] += max(0, pool.num_requests - pool.num_connections)
+    return stats
+
+
+def format_pool_stats():
+    """Return one human-readable line per host describing connection reuse"""
+    lines = []
+    for host, entry in sorted(get_pool_stats().items()):
+        lines.append(f"{host}: {entry['requests']} requests, "
+                     f"{entry['new_connections']} new connections, {entry['reused']} reused")
+    return lines
+
+
+def stream_to_file(response, output_path, chunk_size=DEFAULT_CHUNK_SIZE, on_chunk=None):
+    """Write a streamed response to output_path in fixed-size chunks.
+
+    Data goes to a temporary file in the target directory that is renamed
+    into place only once the body is complete, so at most chunk_size bytes
+    are held in memory and a partial file never appears under output_path.
+    on_chunk, if given, is called with every chunk as it is written.
+    Returns the number of bytes written.
+    """
+    directory = os.path.dirname(output_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".part", dir=directory)
+    written = 0
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+                    written += len(chunk)
+                    if on_chunk:
+                        on_chunk(chunk)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return written
@@ -0,0 +1,166 @@
+"""Persistent per-row progress manifest for resumable downloads.
+
+Each CSV row that has been downloaded is recorded in a small SQLite
+database together with its output path, byte size, SHA-256 hash and
+detected content type. On the next run rows whose output still exists
+and still matches the recorded size and hash are skipped. Outputs are
+only recorded after they were written atomically, so a half-written file
+is never counted as done.
+"""
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+MANIFEST_FILENAME = ".cyber_skulls_manifest.sqlite"
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def row_key(source, row_number, url):
+    """Return the manifest key identifying one CSV row"""
+    return f"{source}|{row_number}|{url}"
+
+
+def file_sha256(file_path):
+    """Return the hex SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_atomic(output_path, data):
+    """Write bytes to output_path through a temp file renamed into place"""
+    directory = os.path.dirname(output_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".part", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class DownloadManifest:
+    """SQLite-backed record of completed and failed rows, safe to share between threads"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS rows ("
+                " row_key TEXT PRIMARY KEY,"
+                " status TEXT NOT NULL,"
+                " url TEXT,"
+                " output_path TEXT,"
+                " size INTEGER,"
+                " sha256 TEXT,"
+                " error TEXT,"
+                " updated REAL,"
+                " content_type TEXT)"
+            )
+            # Manifests written before content types were detected lack the column
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(rows)")}
+            if "content_type" not in columns:
+                self._conn.execute("ALTER TABLE rows ADD COLUMN content_type TEXT")
+            self._conn.commit()
+
+    @classmethod
+    def for_directory(cls, output_dir):
+        """Open the manifest kept inside an output directory"""
+        return cls(os.path.join(output_dir, MANIFEST_FILENAME))
+
+    def _completed_entry(self, key):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT output_path, size, sha256 FROM rows WHERE row_key = ? AND status = 'done'",
+                (key,)).fetchone()
+
+    def is_complete(self, key, output_path=None, verify_hash=True):
+        """Return True if the row is done and its output is still intact.
+
+        The extension of output_path is not compared, since the planned
+        extension is replaced by the content type detected on download.
+        """
+        entry = self._completed_entry(key)
+        if entry is None:
+            return False
+        recorded_path, size, sha256 = entry
+        if output_path is not None and (os.path.splitext(os.path.abspath(output_path))[0]
+                                        != os.path.splitext(os.path.abspath(recorded_path))[0]):
+            return False
+        try:
+            if os.path.getsize(recorded_path) != size:
+                return False
+            return not verify_hash or file_sha256(recorded_path) == sha256
+        except OSError:
+            return False
+
+    def load_verified(self, key):
+        """Return the bytes of a completed row if its output is intact, else None"""
+        entry = self._completed_entry(key)
+        if entry is None:
+            return None
+        recorded_path, size, sha256 = entry
+        try:
+            with open(recorded_path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        if len(data) != size or hashlib.sha256(data).hexdigest() != sha256:
+            return None
+        return data
+
+    def mark_done(self, key, url, output_path, sha256=None, content_type=None):
+        """Record a row whose output has been fully written to output_path"""
+        size = os.path.getsize(output_path)
+        if sha256 is None:
+            sha256 = file_sha256(output_path)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rows"
+                " (row_key, status, url, output_path, size, sha256, error, updated, content_type)"
+                " VALUES (?, 'done', ?, ?, ?, ?, NULL, ?, ?)",
+                (key, url, os.path.abspath(output_path), size, sha256, time.time(), content_type))
+            self._conn.commit()
+
+    def mark_failed(self, key, url, error=None):
+        """Record a row that could not be downloaded"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO rows (row_key, status, url, output_path, size, sha256, error, updated)"
+                " VALUES (?, 'failed', ?, NULL, NULL, NULL, ?, ?)",
+                (key, url, error, time.time()))
+            self._conn.commit()
+
+    def counts(self):
+        """Return a dict of row counts per status"""
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM rows GROUP BY status").fetchall()
+        return dict(rows)
+
+    def content_types(self):
+        """Return a dict of completed row counts per detected content type (None if unknown)"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT content_type, COUNT(*) FROM rows WHERE status = 'done' GROUP BY content_type"
+                " ORDER BY COUNT(*) DESC").fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,254 @@
+"""Download planning: output filenames for every row, and each IPFS CID fetched once.
+
+FilenamePlanner turns name, unit-name and MIME type columns into unique,
+filesystem-safe output filenames, vectorized with pandas when available.
+
+Collections often point many rows (editions, collabs, overlapping CSV
+files) at the same CID. Rows are grouped by their normalized IPFS path so
+only one request goes out per unique CID; the other rows get a hard link
+or copy of the downloaded file, or a duplicate entry of the same bytes.
+"""
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+import ipfs_cache
+import ipfs_gateways
+
+# pandas is optional; without it filenames are planned row by row
+try:
+    import numpy as np
+    import pandas as pd
+    PANDAS_AVAILABLE = True
+except ImportError:
+    PANDAS_AVAILABLE = False
+
+DEFAULT_EXTENSION = ".png"
+
+# Path separators become underscores, then anything but word characters,
+# dots, dashes and spaces is dropped
+_SEPARATOR_PATTERN = r"[/\\]"
+_UNSAFE_PATTERN = r"[^\w. -]"
+_separator_re = re.compile(_SEPARATOR_PATTERN)
+_unsafe_re = re.compile(_UNSAFE_PATTERN)
+
+# Arrow-backed strings run the vectorized regex passes in C, but with RE2,
+# whose \w is ASCII-only; \p{L}\p{N}_ matches what Python's \w does
+_ARROW_UNSAFE_PATTERN = r"[^\p{L}\p{N}_. -]"
+
+
+def _arrow_strings_supported():
+    """Return True if Arrow string columns run _ARROW_UNSAFE_PATTERN correctly"""
+    try:
+        probe = pd.Series(["Caf\u00e9_1!"], dtype="string[pyarrow]")
+        return probe.str.replace(_ARROW_UNSAFE_PATTERN, "", regex=True).iloc[0] == "Caf\u00e9_1"
+    except Exception:
+        return False
+
+
+if PANDAS_AVAILABLE and _arrow_strings_supported():
+    _STRING_DTYPE = "string[pyarrow]"
+    _VECTOR_UNSAFE_PATTERN = _ARROW_UNSAFE_PATTERN
+else:
+    _STRING_DTYPE = object
+    _VECTOR_UNSAFE_PATTERN = _UNSAFE_PATTERN
+
+
+def safe_stem(name, unit_name):
+    """Return the filesystem-safe "name_unit-name" stem of an output filename"""
+    return _unsafe_re.sub("", _separator_re.sub("_", f"{name}_{unit_name}"))
+
+
+def extension_for(mime_type):
+    """Return the file extension for a metadata MIME type"""
+    if "jpeg" in mime_type or "jpg" in mime_type:
+        return ".jpg"
+    if "png" in mime_type:
+        return ".png"
+    if "gif" in mime_type:
+        return ".gif"
+    return DEFAULT_EXTENSION
+
+
+def _text(value):
+    """Return a cell as a stripped string; missing values (None, NaN) become empty strings"""
+    return "" if value is None or value != value else str(value).strip()
+
+
+def _text_column(values):
+    """Return cells as a Series of stripped strings with missing values as empty strings"""
+    if _STRING_DTYPE is object:
+        return pd.Series([_text(value) for value in values], dtype=object)
+    column = pd.Series(values).reset_index(drop=True).astype(_STRING_DTYPE)
+    return column.fillna("").str.strip()
+
+
+class FilenamePlanner:
+    """Assigns every row a unique output filename, deterministically in row order.
+
+    Rows whose names sanitize to the same stem (compared case-insensitively,
+    as on Windows and macOS) but point at different URLs get _2, _3, ...
+    suffixes instead of overwriting each other; rows repeating the same URL
+    share the name. A URL owns its stem with any extension, so the planned
+    extension can be replaced by the type sniffed at download time without
+    colliding with another row. State carries over between calls, so the
+    chunks of one CSV and several CSVs written to one folder are planned
+    consistently.
+    """
+
+    def __init__(self):
+        self._owners = {}  # Lowercased stem -> URL that claimed it
+        self._renamed = {}  # (lowercased stem, URL) -> suffixed stem
+        self._next_suffix = {}  # Lowercased stem -> next suffix to try
+
+    def _claim(self, stem, extension, url):
+        key = stem.lower()
+        if self._owners.setdefault(key, url) == url:
+            return f"{stem}{extension}"
+        renamed = self._renamed.get((key, url))
+        if renamed is None:
+            suffix = self._next_suffix.get(key, 2)
+            while True:
+                renamed = f"{stem}_{suffix}"
+                suffix += 1
+                if self._owners.setdefault(renamed.lower(), url) == url:
+                    break
+            self._next_suffix[key] = suffix
+            self._renamed[(key, url)] = renamed
+        return f"{renamed}{extension}"
+
+    def plan_row(self, name, unit_name, mime_type, url):
+        """Return the output filename for one row, or None if the row is incomplete"""
+        name, unit_name, url = _text(name), _text(unit_name), _text(url)
+        if not url or not name or not unit_name:
+            return None
+        return self._claim(safe_stem(name, unit_name), extension_for(_text(mime_type)), url)
+
+    def plan(self, names, unit_names, mime_types, urls):
+        """Return output filenames (None for incomplete rows) for whole columns at once"""
+        if not PANDAS_AVAILABLE:
+            return [self.plan_row(*row) for row in zip(names, unit_names, mime_types, urls)]
+
+        names, unit_names, mime_types, urls = (_text_column(values)
+                                               for values in (names, unit_names, mime_types, urls))
+        complete = ((names != "") & (unit_names != "") & (urls != "")).to_numpy(dtype=bool)
+
+        stems = (names + "_" + unit_names).str.replace(_SEPARATOR_PATTERN, "_", regex=True)
+        stems = stems.str.replace(_VECTOR_UNSAFE_PATTERN, "", regex=True)
+
+        # Same precedence as extension_for(): jpeg/jpg, then png, then gif
+        extensions = np.select([mime_types.str.contains("jpeg|jpg", regex=True).to_numpy(dtype=bool),
+                                mime_types.str.contains("png", regex=False).to_numpy(dtype=bool),
+                                mime_types.str.contains("gif", regex=False).to_numpy(dtype=bool)],
+                               [".jpg", ".png", ".gif"], DEFAULT_EXTENSION)
+
+        # Collisions depend on every earlier row, so names are claimed in row order
+        return [self._claim(stem, extension, url) if is_complete else None
+                for stem, extension, url, is_complete
+                in zip(stems.tolist(), extensions.tolist(), urls.tolist(), complete)]
+
+
+def cid_key(url):
+    """Return the normalized IPFS path used to group rows, or None for non-IPFS URLs"""
+    path = ipfs_gateways.ipfs_path_from_url(url)
+    if path is None:
+        return None
+    return ipfs_cache.cache_key(path)
+
+
+def group_by_cid(items, url_of=lambda item: item[0]):
+    """Group items by the CID of their URL, keeping first-appearance order.
+
+    Returns a list of (key, [items]). Items whose URL is not an IPFS URL
+    each get a group of their own with a key of None.
+    """
+    groups = {}
+    ordered = []
+    for item in items:
+        key = cid_key(url_of(item))
+        if key is None:
+            ordered.append((None, [item]))
+            continue
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = []
+            ordered.append((key, group))
+        group.append(item)
+    return ordered
+
+
+def link_or_copy(source_path, output_path):
+    """Place a copy of an already downloaded file at output_path.
+
+    A hard link is used when source and target share a filesystem, a byte
+    copy otherwise; either way the result is renamed into place atomically.
+    """
+    if os.path.abspath(source_path) == os.path.abspath(output_path):
+        return
+    directory = os.path.dirname(output_path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(prefix=".", suffix=".part", dir=directory)
+    os.close(fd)
+    try:
+        try:
+            os.remove(temp_path)
+            os.link(source_path, temp_path)
+        except OSError:
+            shutil.copyfile(source_path, temp_path)
+        os.replace(temp_path, output_path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+class DownloadedCids:
+    """CIDs already written to disk during a run, shared across CSV files and threads"""
+
+    def __init__(self):
+        self._paths = {}
+        self._lock = threading.Lock()
+
+    def add(self, url, output_path, mime_type=None):
+        """Remember that the content of url, of mime_type, now lives at output_path"""
+        key = cid_key(url)
+        if key is None:
+            return
+        try:
+            inode = os.stat(output_path).st_ino
+        except OSError:
+            return
+        with self._lock:
+            self._paths[key] = (output_path, inode, mime_type)
+
+    def reuse(self, url, output_path):
+        """Materialize url from an earlier download at output_path, with the extension of that download.
+
+        Returns (output_path, mime_type) with the path actually written, or
+        None if the CID has not been downloaded.
+        """
+        key = cid_key(url)
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._paths.get(key)
+        if entry is None:
+            return None
+        source_path, inode, mime_type = entry
+        output_path = os.path.splitext(output_path)[0] + os.path.splitext(source_path)[1]
+        try:
+            # A later row may have replaced the file under the same name
+            if os.stat(source_path).st_ino != inode:
+                return None
+            link_or_copy(source_path, output_path)
+        except OSError:
+            return None
+        return output_path, mime_type
+
+    def __len__(self):
+        with self._lock:
+            return len(self._paths)
@@ -0,0 +1,202 @@
+"""Pre-flight size and availability probing of collection content.
+
+Before anything is downloaded, a HEAD request goes out for every unique
+CID of a collection, or for a random sample of them when there are more
+than sample_size, to learn real Content-Length and Content-Type values
+and which CIDs the gateways can serve. The results become a SizePlan:
+expected download and archive sizes (with a confidence margin when
+sampled), ZIP part counts and whether the archive fits in memory.
+"""
+import math
+import os
+import random
+from collections import Counter, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import ipfs_cache
+import ipfs_gateways
+import ipfs_http
+import ipfs_retry
+
+DEFAULT_SAMPLE_SIZE = 200  # Unique CIDs probed at most; larger collections are sampled
+DEFAULT_PROBE_WORKERS = 16
+DEFAULT_PROBE_TIMEOUT = 10
+CONFIDENCE_Z = 1.96  # 95% confidence interval for sampled estimates
+
+# Probes are only estimates, so they give up sooner than downloads
+PROBE_POLICY = ipfs_retry.RetryPolicy({ipfs_retry.THROTTLED: 1, ipfs_retry.UNAVAILABLE: 1,
+                                       ipfs_retry.TIMEOUT: 0, ipfs_retry.CONNECTION: 1})
+
+# status is the HTTP status (200 when available, None if no gateway answered)
+ProbeResult = namedtuple("ProbeResult", ["key", "status", "size", "content_type"])
+
+
+def _content_length(response):
+    """Return the full body size a response announces, or None"""
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range:
+        total = content_range.rsplit("/", 1)[1].strip()
+        if total.isdigit():
+            return int(total)
+    length = response.headers.get("Content-Length")
+    return int(length) if length and length.isdigit() else None
+
+
+def _ranged_size(url, timeout):
+    # Some gateways omit Content-Length on HEAD; a one-byte range request
+    # reveals the size through Content-Range without fetching the body
+    with ipfs_http.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=timeout) as response:
+        if response.status_code in (200, 206):
+            return _content_length(response)
+    return None
+
+
+def probe_path(path, gateways, timeout=DEFAULT_PROBE_TIMEOUT, router=None, budget=None):
+    """HEAD an IPFS path on the gateways, best scored first, and return a ProbeResult"""
+    key = ipfs_cache.cache_key(path)
+
+    # Content already in the local CID cache needs no request at all
+    cache = ipfs_cache.get_default_cache()
+    cached = cache.get_path(path) if cache else None
+    if cached:
+        try:
+            return ProbeResult(key, 200, os.path.getsize(cached), None)
+        except OSError:
+            pass
+
+    router = router or ipfs_gateways.default_router
+    last_status = None
+    for gateway in router.order(ipfs_gateways.parse_gateway_list(gateways)):
+        url = ipfs_gateways.build_gateway_url(gateway, path)
+        try:
+            response = ipfs_retry.call(lambda: ipfs_http.head(url, timeout=timeout, allow_redirects=True),
+                                       PROBE_POLICY, budget, description=path)
+            with response:
+                status = response.status_code
+                size = _content_length(response)
+                content_type = response.headers.get("Content-Type")
+            if status == 200 and size is None:
+                size = _ranged_size(url, timeout)
+        except requests.exceptions.RequestException:
+            continue
+        if status == 200:
+            return ProbeResult(key, status, size, content_type)
+        last_status = status
+    return ProbeResult(key, last_status, None, None)
+
+
+class SizePlan:
+    """Expected sizes and availability of a collection, extrapolated from probed CIDs.
+
+    row_count counts every row with an IPFS URL; rows_by_key maps each
+    unique CID key to how many rows use it (each row becomes one archive
+    entry, so shared CIDs count once for downloading but per row for the
+    archive). results are the ProbeResults of all or a sample of the keys.
+    """
+
+    def __init__(self, rows_by_key, results, skipped_rows=0):
+        self.unique_count = len(rows_by_key)
+        self.row_count = sum(rows_by_key.values())
+        self.skipped_rows = skipped_rows
+        self.probed_count = len(results)
+        self.sampled = self.probed_count < self.unique_count
+
+        available = [r for r in results if r.status == 200]
+        sized = [r for r in available if r.size is not None]
+        # Without a single known size every estimate below is 0; callers check this first
+        self.sized_count = len(sized)
+        self.availability = len(available) / self.probed_count if self.probed_count else 0.0
+        self.unavailable_estimate = round((1 - self.availability) * self.unique_count)
+        # Cache hits carry no Content-Type, so only gateway answers are counted
+        self.content_types = Counter(r.content_type.split(";")[0].strip() for r in available if r.content_type)
+
+        # Probed size of every available CID whose size is known, by key
+        self.sizes = {r.key: r.size for r in sized}
+        sizes = [r.size for r in sized]
+        self.mean_size = sum(sizes) / len(sizes) if sizes else 0.0
+        variance = sum((size - self.mean_size) ** 2 for size in sizes) / (len(sizes) - 1) if len(sizes) > 1 else 0.0
+
+        if not self.sampled and len(sized) == len(available):
+            # Every CID probed with a known size: the totals are exact
+            self.download_bytes = sum(sizes)
+            self.archive_bytes = sum(r.size * rows_by_key[r.key] for r in sized)
+            self.margin_bytes = 0.0
+        else:
+            rows_per_key = self.row_count / self.unique_count if self.unique_count else 0.0
+            self.download_bytes = self.mean_size * self.unique_count * self.availability
+            self.archive_bytes = self.download_bytes * rows_per_key
+            # Standard error of the mean with the finite population correction
+            population = self.unique_count
+            correction = (population - len(sizes)) / (population - 1) if population > 1 else 0.0
+            standard_error = math.sqrt(variance / len(sizes) * max(0.0, correction)) if sizes else 0.0
+            self.margin_bytes = CONFIDENCE_Z * standard_error * self.row_count * self.availability
+
+    @property
+    def archive_mb(self):
+        return self.archive_bytes / (1024 * 1024)
+
+    @property
+    def archive_high_bytes(self):
+        """Upper end of the archive size estimate"""
+        return self.archive_bytes + self.margin_bytes
+
+    def part_count(self, max_part_bytes):
+        """Return how many archive parts of at most max_part_bytes the collection needs"""
+        return max(1, math.ceil(self.archive_high_bytes / max_part_bytes))
+
+    def fits_in_memory(self, memory_limit_bytes):
+        """Return True if even the high estimate of the archive fits in memory_limit_bytes.
+
+        False when no size is known, since nothing was actually measured.
+        """
+        return bool(self.sized_count) and self.archive_high_bytes <= memory_limit_bytes
+
+    def format_summary(self):
+        """Return human-readable lines describing the plan"""
+        basis = (f"sampled {self.probed_count} of {self.unique_count} unique CIDs" if self.sampled
+                 else f"probed all {self.unique_count} unique CIDs")
+        if self.sized_count:
+            size = f"~{self.archive_mb:.1f}MB"
+            if self.margin_bytes:
+                size += f" (±{self.margin_bytes / (1024 * 1024):.1f}MB)"
+        else:
+            size = "Size unknown (no gateway reported a size)"
+        lines = [f"{size} for {self.row_count} items, {basis}",
+                 f"{self.availability:.0%} available, ~{self.unavailable_estimate} unique CIDs unreachable"]
+        if self.content_types:
+            lines.append("Types: " + ", ".join(f"{kind} x{count}" for kind, count in self.content_types.most_common(4)))
+        if self.skipped_rows:
+            lines.append(f"{self.skipped_rows} rows have no IPFS URL and will be skipped")
+        return lines
+
+
+def plan_collection(urls, gateways, sample_size=DEFAULT_SAMPLE_SIZE, max_workers=DEFAULT_PROBE_WORKERS,
+                    timeout=DEFAULT_PROBE_TIMEOUT, router=None, seed=0):
+    """Probe the unique CIDs of a collection's URLs concurrently and return a SizePlan.
+
+    With more than sample_size unique CIDs a seeded random sample is
+    probed, so the same collection always yields the same estimate.
+    """
+    rows_by_key = Counter()
+    paths = {}
+    skipped_rows = 0
+    for url in urls:
+        path = ipfs_gateways.ipfs_path_from_url(url)
+        if path is None:
+            skipped_rows += 1
+            continue
+        key = ipfs_cache.cache_key(path)
+        rows_by_key[key] += 1
+        paths.setdefault(key, path)
+
+    keys = list(paths)
+    if len(keys) > sample_size:
+        keys = random.Random(seed).sample(keys, sample_size)
+
+    # Probe failures must not drain the download retry budget
+    budget = ipfs_retry.RetryBudget()
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        results = list(executor.map(lambda key: probe_path(paths[key], gateways, timeout, router, budget), keys))
+    return SizePlan(rows_by_key, results, skipped_rows)
@@ -0,0 +1,247 @@
+"""Retry policy for gateway downloads and uploads.
+
+Failures are sorted into classes (throttled, unavailable, timeout,
+connection), each with its own retry allowance. Retries wait with
+exponential backoff and full jitter, or for the server's Retry-After on
+HTTP 429/503. A process-wide RetryBudget caps retries to a share of
+first attempts, so a dying gateway cannot set off a retry storm.
+Anything else, such as HTTP 404, fails at once.
+"""
+import asyncio
+import email.utils
+import random
+import threading
+import time
+
+import requests
+
+# aiohttp is optional; its errors are only classified when it is installed
+try:
+    import aiohttp
+    _AIOHTTP_CONNECTION_ERRORS = (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)
+except ImportError:
+    _AIOHTTP_CONNECTION_ERRORS = ()
+
+# Error classes
+THROTTLED = "throttled"  # HTTP 429
+UNAVAILABLE = "unavailable"  # HTTP 5xx other than 501
+TIMEOUT = "timeout"
+CONNECTION = "connection"  # Refused, reset or truncated connections
+
+# Retry settings
+DEFAULT_MAX_RETRIES = {THROTTLED: 4, UNAVAILABLE: 3, TIMEOUT: 2, CONNECTION: 3}
+DEFAULT_BASE_DELAY = 0.5  # Seconds before the first retry, doubled for each one after
+DEFAULT_MAX_DELAY = 20.0
+MAX_RETRY_AFTER = 60.0  # Longer Retry-After values mean giving up rather than waiting
+
+# Global retry budget (token bucket)
+BUDGET_RATIO = 0.2  # Retry tokens earned per first attempt
+BUDGET_MIN_TOKENS = 10.0  # Tokens available at start, so early failures can still retry
+BUDGET_MAX_TOKENS = 100.0
+BUDGET_REFILL_PER_SECOND = 1.0  # Floor so a fully throttled run still trickles retries through
+
+_TIMEOUT_ERRORS = (requests.exceptions.Timeout, asyncio.TimeoutError, TimeoutError)
+_CONNECTION_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError,
+                      ConnectionError) + _AIOHTTP_CONNECTION_ERRORS
+
+
+def parse_retry_after(value):
+    """Return a Retry-After header (seconds or HTTP date) as seconds from now, or None"""
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def classify_status(status_code):
+    """Return the error class of an HTTP status, or None if it should not be retried"""
+    if status_code == 429:
+        return THROTTLED
+    if status_code >= 500 and status_code != 501:
+        return UNAVAILABLE
+    return None
+
+
+def classify_exception(error):
+    """Return the error class of a request exception, or None if it should not be retried"""
+    if isinstance(error, _TIMEOUT_ERRORS):
+        return TIMEOUT
+    if isinstance(error, _CONNECTION_ERRORS):
+        return CONNECTION
+    return None
+
+
+def _status_of(response):
+    # requests uses status_code, aiohttp uses status
+    status = getattr(response, "status_code", None)
+    return getattr(response, "status", None) if status is None else status
+
+
+def _close(response):
+    release = getattr(response, "release", None) or getattr(response, "close", None)
+    if release is not None:
+        try:
+            release()
+        except Exception:
+            pass
+
+
+class RetryBudget:
+    """Token bucket limiting retries to a share of first attempts, shared by all threads"""
+
+    def __init__(self, ratio=BUDGET_RATIO, min_tokens=BUDGET_MIN_TOKENS, max_tokens=BUDGET_MAX_TOKENS,
+                 refill_per_second=BUDGET_REFILL_PER_SECOND):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.refill_per_second = refill_per_second
+        self._tokens = min_tokens
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+        self.retries = 0
+        self.denied = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.max_tokens, self._tokens + (now - self._refilled) * self.refill_per_second)
+        self._refilled = now
+
+    def deposit(self):
+        """Earn retry credit for a first attempt"""
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self):
+        """Spend one token for a retry; False when the budget is exhausted"""
+        with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                self.denied += 1
+                return False
+            self._tokens -= 1
+            self.retries += 1
+            return True
+
+    def format_stats(self):
+        with self._lock:
+            return f"{self.retries} retries, {self.denied} denied by the retry budget"
+
+
+class RetryPolicy:
+    """Per-class retry allowances and the backoff schedule between attempts"""
+
+    def __init__(self, max_retries=None, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 max_retry_after=MAX_RETRY_AFTER):
+        self.max_retries = dict(DEFAULT_MAX_RETRIES if max_retries is None else max_retries)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+
+    def backoff(self, retry_number, retry_after=None):
+        """Return the seconds to wait before a retry, or None to give up"""
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            # Spread clients that were all told the same Retry-After
+            return retry_after + random.uniform(0, self.base_delay)
+        # Full jitter: uniform over the exponential window
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** retry_number)))
+
+
+DEFAULT_POLICY = RetryPolicy()
+# Uploads fall back to other services, so each one gets fewer retries
+UPLOAD_POLICY = RetryPolicy({THROTTLED: 3, UNAVAILABLE: 2, TIMEOUT: 1, CONNECTION: 2})
+default_budget = RetryBudget()
+
+
+class _Attempt:
+    """Retry bookkeeping for one call"""
+
+    def __init__(self, policy, budget):
+        self.policy = policy or DEFAULT_POLICY
+        self.budget = budget or default_budget
+        self.counts = {}
+        self.budget.deposit()
+
+    def next_delay(self, error_class, retry_after=None):
+        """Return the delay before the next attempt, or None when no retry is allowed"""
+        if error_class is None:
+            return None
+        used = self.counts.get(error_class, 0)
+        if used >= self.policy.max_retries.get(error_class, 0):
+            return None
+        delay = self.policy.backoff(sum(self.counts.values()), retry_after)
+        if delay is None or not self.budget.withdraw():
+            return None
+        self.counts[error_class] = used + 1
+        return delay
+
+    def outcome(self, response=None, error=None):
+        """Return (delay, reason) for a failed attempt; delay is None when giving up"""
+        if error is not None:
+            error_class = classify_exception(error)
+            return self.next_delay(error_class), f"{error_class or 'error'}: {error}"
+        status = _status_of(response)
+        error_class = classify_status(status)
+        retry_after = None
+        if status in (429, 503):
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        return self.next_delay(error_class, retry_after), f"HTTP {status}"
+
+
+def _log_retry(log_callback, description, reason, delay):
+    if log_callback:
+        log_callback(f"[RETRY] {description} ({reason}), retrying in {delay:.1f}s")
+
+
+def call(request, policy=None, budget=None, log_callback=None, description="request"):
+    """Run request() until it returns a non-retryable response or the retries run out.
+
+    request must return a response object (requests or aiohttp) or raise.
+    The final response is returned even if it is an error status; the final
+    exception is re-raised.
+    """
+    attempt = _Attempt(policy, budget)
+    while True:
+        try:
+            response = request()
+        except Exception as e:
+            delay, reason = attempt.outcome(error=e)
+            if delay is None:
+                raise
+        else:
+            delay, reason = attempt.outcome(response=response)
+            if delay is None:
+                return response
+            _close(response)
+        _log_retry(log_callback, description, reason, delay)
+        time.sleep(delay)
+
+
+async def call_async(request, policy=None, budget=None, log_callback=None, description="request"):
+    """Asyncio counterpart of call(); request must return an awaitable"""
+    attempt = _Attempt(policy, budget)
+    while True:
+        try:
+            response = await request()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            delay, reason = attempt.outcome(error=e)
+            if delay is None:
+                raise
+        else:
+            delay, reason = attempt.outcome(response=response)
+            if delay is None:
+                return response
+            _close(response)
+        _log_retry(log_callback, description, reason, delay)
+        await asyncio.sleep(delay)
@@ -0,0 +1,77 @@
+"""Serving finished archives to the browser straight from disk.
+
+Inlining a ZIP part as a base64 data URL keeps the file, its base64 copy
+and the page message in memory at once. With Streamlit's static file
+serving (server.enableStaticServing) the app's `static` folder is served
+at app/static/ by the web server itself, which streams files in chunks
+and answers Range requests, so a part written into that folder is
+downloaded, and resumed, without ever being read into the Python process.
+
+Every job gets its own folder under static/downloads with a random
+suffix in its name, so links cannot be guessed from the collection and
+parts of earlier runs or concurrent sessions never collide; folders older
+than max_age are removed when the next one is created. Without static
+serving the same kind of folders are made under FALLBACK_DIR in the temp
+directory, where they are only read by the download button.
+"""
+import os
+import secrets
+import shutil
+import tempfile
+import time
+from urllib.parse import quote
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+STATIC_DIR = os.path.join(APP_DIR, "static")  # Streamlit serves the static folder next to the app
+STATIC_URL = "app/static"
+DOWNLOADS_DIR = os.path.join(STATIC_DIR, "downloads")
+MAX_STATIC_FILE_BYTES = 200 * 1024 * 1024  # Streamlit answers 404 for larger static files
+DEFAULT_MAX_AGE = 24 * 60 * 60  # Seconds a job folder is kept
+FALLBACK_DIR = os.path.join(tempfile.gettempdir(), "cyber_skulls_downloads")  # Job folders when not served
+
+
+def prune(max_age=DEFAULT_MAX_AGE, now=None, root=DOWNLOADS_DIR):
+    """Remove folders in root last modified more than max_age seconds ago; returns how many were removed"""
+    now = time.time() if now is None else now
+    removed = 0
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False) and now - entry.stat().st_mtime > max_age:
+                shutil.rmtree(entry.path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+def job_directory(job_id, max_age=DEFAULT_MAX_AGE, root=DOWNLOADS_DIR):
+    """Create and return a fresh folder in root for one run of job_id, pruning stale ones first"""
+    prune(max_age, root=root)
+    os.makedirs(root, exist_ok=True)
+    # The token keeps served links unguessable; mkdtemp makes the folder unique
+    return tempfile.mkdtemp(prefix=f"{job_id}-{secrets.token_hex(8)}-", dir=root)
+
+
+def url_for(path, size=None):
+    """Return the app-relative URL a file is served at, or None if it cannot be served statically.
+
+    Only files inside STATIC_DIR of at most MAX_STATIC_FILE_BYTES are
+    served; pass size when it is already known to skip the stat.
+    """
+    path = os.path.abspath(path)
+    if os.path.commonpath([path, STATIC_DIR]) != STATIC_DIR:
+        return None
+    if size is None:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return None
+    if size > MAX_STATIC_FILE_BYTES:
+        return None
+    relative = os.path.relpath(path, STATIC_DIR).replace(os.sep, "/")
+    return f"{STATIC_URL}/{quote(relative)}"
+
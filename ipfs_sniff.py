@@ -0,0 +1,165 @@
+"""Content type detection from the first bytes of a download.
+
+The metadata_mime_type column is often missing or wrong, and gateways
+frequently answer application/octet-stream, so the type of every file is
+decided from its magic bytes first, then from a specific Content-Type
+header, and only then from the planned extension. Only the first
+SNIFF_BYTES of a streamed body are kept; the rest is never buffered.
+"""
+import mimetypes
+import os
+from collections import namedtuple
+
+SNIFF_BYTES = 512  # Enough for every signature below, including SVG after an XML prolog
+
+FileType = namedtuple("FileType", ["mime_type", "extension"])
+
+# A successful download whose type could not be determined keeps its planned extension
+UNKNOWN = FileType(None, None)
+
+PNG = FileType("image/png", ".png")
+JPEG = FileType("image/jpeg", ".jpg")
+GIF = FileType("image/gif", ".gif")
+WEBP = FileType("image/webp", ".webp")
+AVIF = FileType("image/avif", ".avif")
+HEIC = FileType("image/heic", ".heic")
+TIFF = FileType("image/tiff", ".tif")
+SVG = FileType("image/svg+xml", ".svg")
+MP4 = FileType("video/mp4", ".mp4")
+MOV = FileType("video/quicktime", ".mov")
+M4A = FileType("audio/mp4", ".m4a")
+WEBM = FileType("video/webm", ".webm")
+MKV = FileType("video/x-matroska", ".mkv")
+MP3 = FileType("audio/mpeg", ".mp3")
+WAV = FileType("audio/wav", ".wav")
+OGG = FileType("audio/ogg", ".ogg")
+FLAC = FileType("audio/flac", ".flac")
+GLB = FileType("model/gltf-binary", ".glb")
+GLTF = FileType("model/gltf+json", ".gltf")
+JSON = FileType("application/json", ".json")
+HTML = FileType("text/html", ".html")
+PDF = FileType("application/pdf", ".pdf")
+ZIP = FileType("application/zip", ".zip")
+
+# Fixed signatures at offset 0, checked in order
+_PREFIXES = [
+    (b"\x89PNG\r\n\x1a\n", PNG),
+    (b"\xff\xd8\xff", JPEG),
+    (b"GIF87a", GIF),
+    (b"GIF89a", GIF),
+    (b"II*\x00", TIFF),
+    (b"MM\x00*", TIFF),
+    (b"glTF", GLB),
+    (b"%PDF-", PDF),
+    (b"OggS", OGG),
+    (b"fLaC", FLAC),
+    (b"ID3", MP3),
+    (b"PK\x03\x04", ZIP),
+]
+
+# ISO base media (ftyp box) major brands
+_FTYP_BRANDS = {
+    b"avif": AVIF, b"avis": AVIF,
+    b"heic": HEIC, b"heix": HEIC, b"mif1": HEIC, b"msf1": HEIC,
+    b"qt  ": MOV,
+    b"M4A ": M4A,
+}
+
+# Content-Type values that say nothing about the content
+_GENERIC_TYPES = {"application/octet-stream", "binary/octet-stream", "application/unknown", "text/plain", ""}
+
+_BY_MIME_TYPE = {file_type.mime_type: file_type for file_type in (
+    PNG, JPEG, GIF, WEBP, AVIF, HEIC, TIFF, SVG, MP4, MOV, M4A, WEBM, MKV, MP3, WAV, OGG, FLAC,
+    GLB, GLTF, JSON, HTML, PDF, ZIP)}
+_BY_MIME_TYPE.update({"image/jpg": JPEG, "image/pjpeg": JPEG, "image/svg": SVG, "audio/mp3": MP3,
+                      "audio/x-wav": WAV, "audio/wave": WAV, "video/ogg": OGG, "audio/x-flac": FLAC})
+
+
+def _sniff_text(head):
+    """Detect the text formats: SVG, HTML and JSON (glTF included)"""
+    text = head.lstrip(b"\xef\xbb\xbf \t\r\n").lower()
+    if text.startswith(b"<"):
+        if b"<svg" in text:
+            return SVG
+        if text.startswith((b"<!doctype html", b"<html")):
+            return HTML
+        return None
+    if text.startswith((b"{", b"[")):
+        # glTF JSON puts its "asset" object first
+        return GLTF if text.startswith(b"{") and b'"asset"' in text[:64] else JSON
+    return None
+
+
+def sniff(head):
+    """Return the FileType the first bytes of a file identify, or None"""
+    head = bytes(head[:SNIFF_BYTES])
+    for prefix, file_type in _PREFIXES:
+        if head.startswith(prefix):
+            return file_type
+    if head[:4] == b"RIFF" and len(head) >= 12:
+        return {b"WEBP": WEBP, b"WAVE": WAV}.get(head[8:12])
+    if head[4:8] == b"ftyp":
+        return _FTYP_BRANDS.get(head[8:12], MP4)
+    if head.startswith(b"\x1a\x45\xdf\xa3"):
+        return WEBM if b"webm" in head else MKV
+    # MPEG audio frame sync without an ID3 tag
+    if len(head) >= 2 and head[0] == 0xFF and head[1] in (0xFB, 0xF3, 0xF2):
+        return MP3
+    return _sniff_text(head)
+
+
+def from_content_type(content_type):
+    """Return the FileType of a specific Content-Type header value, or None for generic ones"""
+    mime_type = (content_type or "").split(";", 1)[0].strip().lower()
+    if mime_type in _GENERIC_TYPES:
+        return None
+    file_type = _BY_MIME_TYPE.get(mime_type)
+    if file_type is None:
+        extension = mimetypes.guess_extension(mime_type)
+        file_type = FileType(mime_type, extension) if extension else None
+    return file_type
+
+
+def detect(head, content_type=None):
+    """Return the FileType of a body from its first bytes, then its Content-Type; UNKNOWN otherwise"""
+    return sniff(head) or from_content_type(content_type) or UNKNOWN
+
+
+def sniff_file(path):
+    """Return the FileType of a file on disk from its first bytes"""
+    try:
+        with open(path, "rb") as f:
+            return sniff(f.read(SNIFF_BYTES)) or UNKNOWN
+    except OSError:
+        return UNKNOWN
+
+
+def with_extension(path, extension):
+    """Return path with its extension replaced; unchanged when extension is None"""
+    if not extension:
+        return path
+    stem, current = os.path.splitext(path)
+    return path if current.lower() == extension.lower() else stem + extension
+
+
+class Sniffer:
+    """Keeps the first SNIFF_BYTES of a streamed body; pass feed as the chunk callback"""
+
+    def __init__(self):
+        self._head = bytearray()
+
+    def feed(self, chunk):
+        missing = SNIFF_BYTES - len(self._head)
+        if missing > 0:
+            self._head += chunk[:missing]
+
+    def detect(self, content_type=None):
+        return detect(self._head, content_type)
+
+
+def retype_file(path, file_type):
+    """Rename a written file to the extension of file_type and return its path"""
+    new_path = with_extension(path, file_type.extension)
+    if new_path != path:
+        os.replace(path, new_path)
+    return new_path
@@ -0,0 +1,135 @@
+"""Byte buffers that spill to disk once a memory budget is used up.
+
+Downloads waiting to be archived, or kept to serve repeated CIDs, are
+held as SpillBuffer items: in memory while the buffer's in-memory total
+stays within its budget, in a temp file beyond that. Readers get the
+same bytes-like view either way (spilled items are memory-mapped, so the
+OS pages them in and out as needed), so a large collection costs disk
+space instead of failing once RAM runs out. Several buffers can share one
+MemoryBudget, so the budget bounds a whole run rather than each buffer.
+"""
+import contextlib
+import io
+import mmap
+import os
+import tempfile
+import threading
+
+DEFAULT_MEMORY_BUDGET = 128 * 1024 * 1024
+
+
+class MemoryBudget:
+    """Bytes of memory that the SpillBuffers sharing it may hold in total; safe to share between threads"""
+
+    def __init__(self, limit=DEFAULT_MEMORY_BUDGET):
+        self.limit = limit
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        """Take size bytes of the budget; returns False, taking nothing, if they do not fit"""
+        with self._lock:
+            if size and self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+
+    def release(self, size):
+        """Give back size bytes taken by reserve()"""
+        with self._lock:
+            self.used -= size
+
+
+def shared_budget(memory_budget):
+    """Return memory_budget as a MemoryBudget: a byte count gets a budget of its own"""
+    if isinstance(memory_budget, MemoryBudget):
+        return memory_budget
+    return MemoryBudget(memory_budget)
+
+
+class _Item:
+    """One buffered byte string; read it through view() or read(), then release() it"""
+
+    def __init__(self, buffer, size, data=None, path=None):
+        self._buffer = buffer
+        self.size = size
+        self._data = data
+        self.path = path  # Temp file of a spilled item, None while in memory
+
+    @property
+    def spilled(self):
+        return self.path is not None
+
+    @contextlib.contextmanager
+    def view(self):
+        """Yield a bytes-like view of the item: the bytes themselves, or a read-only memory map"""
+        if not self.spilled:
+            yield self._data
+            return
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+    def open(self):
+        """Return a binary file object reading the item"""
+        if not self.spilled:
+            return io.BytesIO(self._data)  # Shares the bytes until written to
+        return open(self.path, "rb")
+
+    def read(self):
+        """Return the item as bytes"""
+        if not self.spilled:
+            return self._data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def release(self):
+        """Free the memory or temp file of the item; it cannot be read afterwards"""
+        self._buffer._release(self)
+
+
+class SpillBuffer:
+    """Holds byte strings in memory up to memory_budget bytes in total, spilling the rest to temp files.
+
+    Items are kept in memory when they fit in what is left of the budget
+    and written to a temp file in directory otherwise; releasing an item
+    gives its share of the budget back. memory_budget is a byte count, or
+    a MemoryBudget shared with other buffers. Empty items never spill.
+    Safe to share between threads.
+    """
+
+    def __init__(self, memory_budget=DEFAULT_MEMORY_BUDGET, directory=None):
+        self.memory_budget = shared_budget(memory_budget)
+        self.directory = directory or tempfile.gettempdir()
+        self.memory_bytes = 0  # Bytes of this buffer's items currently held in memory
+        self.spilled_count = 0  # Items written to disk so far
+        self.spilled_bytes = 0
+        self._lock = threading.Lock()
+
+    def put(self, data):
+        """Buffer a byte string and return its item"""
+        size = len(data)
+        if self.memory_budget.reserve(size):
+            with self._lock:
+                self.memory_bytes += size
+            return _Item(self, size, data=data)
+        fd, path = tempfile.mkstemp(prefix=".spill-", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+        except BaseException:
+            os.unlink(path)
+            raise
+        with self._lock:
+            self.spilled_count += 1
+            self.spilled_bytes += size
+        return _Item(self, size, path=path)
+
+    def _release(self, item):
+        if item.spilled:
+            with contextlib.suppress(OSError):
+                os.unlink(item.path)
+        elif item._data is not None:
+            with self._lock:
+                self.memory_bytes -= item.size
+            self.memory_budget.release(item.size)
+        item._data = None